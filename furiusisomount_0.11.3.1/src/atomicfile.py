@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import contextlib
+import fcntl
+import os
+import threading
+
+# Files that are rewritten whole (the mount list, the history, settings.cfg,
+# caches and reports) go through atomic_write: the new contents are written
+# to a temporary file next to the original and renamed over it, so a crash
+# or an error part way through never leaves a half written file behind.
+# Files that several processes update (the window and the command line)
+# are read, merged and written while holding locked(path).
+
+def temporary_path(path):
+    # Unique per process and thread, in the same directory so the rename
+    # stays on one filesystem
+    return '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w', **options):
+    # Use as "with atomic_write(path) as output_file:"; path is replaced only
+    # if the block finishes without raising
+    temporary = temporary_path(path)
+    try:
+        with open(temporary, mode, **options) as output_file:
+            yield output_file
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+@contextlib.contextmanager
+def locked(path):
+    # Exclusive lock for a read-merge-write of path, across threads and
+    # processes. The file itself is replaced by rename, so the lock is held
+    # on path.lock, which never is.
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import os
+import re
+import sys
+from gettext import gettext as _
+import cli
+import compressedimage
+import filehash
+import iosched
+import settings
+
+# Headless verification of images listed in MD5SUMS/SHA256SUMS style files.
+#
+# Exit status: 0 when every image matched, 1 when at least one image did not
+# match, 3 when nothing mismatched but some images were missing or unreadable.
+
+exit_ok = 0
+exit_failed = 1
+exit_missing = 3
+
+# Sum file names understood without looking at the digests
+sum_file_algorithms = (
+    ('md5', ('md5sums', 'md5sum', 'md5sum.txt')),
+    ('sha1', ('sha1sums', 'sha1sum', 'sha1sum.txt')),
+    ('sha256', ('sha256sums', 'sha256sum', 'sha256sum.txt')),
+    ('sha512', ('sha512sums', 'sha512sum', 'sha512sum.txt')),
+    ('blake2b', ('b2sums', 'b2sum', 'b2sum.txt', 'blake2sums')),
+)
+extension_algorithms = {'.md5': 'md5', '.sha1': 'sha1', '.sha256': 'sha256', '.sha512': 'sha512', '.b2': 'blake2b'}
+length_algorithms = {8: 'crc32', 32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+tag_algorithms = {'MD5': 'md5', 'SHA1': 'sha1', 'SHA256': 'sha256', 'SHA512': 'sha512', 'BLAKE2b': 'blake2b', 'BLAKE2b-512': 'blake2b', 'CRC32': 'crc32'}
+
+gnu_line = re.compile(r'^(\\?)([0-9a-fA-F]+) [ *](.+)$')
+bsd_line = re.compile(r'^(\\?)([A-Za-z0-9-]+) ?\((.+)\) ?= ([0-9a-fA-F]+)$')
+
+class entry():
+    def __init__(self, image, algorithm, expected, sum_file):
+        self.image = image
+        self.algorithm = algorithm
+        self.expected = expected.lower()
+        self.sum_file = sum_file
+        self.status = None
+        self.actual = None
+
+def sum_file_algorithm(sum_file):
+    name = os.path.basename(sum_file).lower()
+    for algorithm, names in sum_file_algorithms:
+        if name in names:
+            return algorithm
+    return extension_algorithms.get(os.path.splitext(name)[1])
+
+def unescape(name):
+    # sha256sum escapes backslashes and newlines in names with a leading '\'
+    return name.replace('\\\\', '\0').replace('\\n', '\n').replace('\0', '\\')
+
+def parse(sum_file):
+    directory = os.path.dirname(os.path.abspath(sum_file))
+    default_algorithm = sum_file_algorithm(sum_file)
+    entries = []
+    with open(sum_file, 'r', encoding='utf-8', errors='surrogateescape') as sums:
+        for line in sums:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            match = bsd_line.match(line)
+            if match and match.group(2) in tag_algorithms:
+                escaped, tag, name, expected = match.groups()
+                algorithm = tag_algorithms[tag]
+            else:
+                match = gnu_line.match(line)
+                if not match:
+                    continue
+                escaped, expected, name = match.groups()
+                algorithm = default_algorithm or length_algorithms.get(len(expected))
+                if algorithm is None:
+                    continue
+            if escaped:
+                name = unescape(name)
+            entries.append(entry(os.path.join(directory, name), algorithm, expected, sum_file))
+    return entries
+
+def verify_image(items, use_cache=True):
+    # Checks entries that all list the same image against one read of it,
+    # so an image named in both MD5SUMS and SHA256SUMS is read only once.
+    # A sum listed for image.iso is checked against image.iso.gz (or .xz,
+    # .zst) decompressed when only the compressed copy is kept; a sum listed
+    # for the compressed file itself is checked against its raw bytes
+    image = items[0].image
+    decompress = False
+    if not os.path.isfile(image):
+        image = next((image + suffix for suffix in compressedimage.suffixes if os.path.isfile(image + suffix)), None)
+        decompress = True
+    if image is None:
+        for item in items:
+            item.status = 'MISSING'
+        return items
+    algorithms = []
+    for item in items:
+        if item.algorithm not in algorithms:
+            algorithms.append(item.algorithm)
+    checksum = filehash.checksum()
+    checksum.compute(image, tuple(algorithms), use_cache=use_cache, decompress=decompress)
+    for item in items:
+        item.actual = checksum.hashes.get(item.algorithm)
+        if item.actual is None:
+            item.status = 'ERROR'
+        elif item.actual == item.expected:
+            item.status = 'OK'
+        else:
+            item.status = 'FAILED'
+    return items
+
+def default_workers():
+    return settings.get_int('checksum_options', 'verify_workers', min(4, os.cpu_count() or 1))
+
+def verify(entries, workers=None, use_cache=True, report=None):
+    # Verifies every entry through the I/O scheduler, so each disk reads as
+    # many images at once as suits it and at most workers run in all,
+    # calling report(entry) in listing order as results become available.
+    # Entries naming the same image share one read of it.
+    queue = iosched.scheduler(max(workers or default_workers(), 1))
+    images = {}
+    for item in entries:
+        images.setdefault(item.image, []).append(item)
+    tasks = dict((image, queue.submit(image, verify_image, items, use_cache, priority='low', description=image))
+                 for image, items in images.items())
+    for item in entries:
+        tasks[item.image].result()
+        if report:
+            report(item)
+    return entries
+
+def exit_status(entries):
+    statuses = set(item.status for item in entries)
+    if 'FAILED' in statuses:
+        return exit_failed
+    if statuses & set(('MISSING', 'ERROR')):
+        return exit_missing
+    return exit_ok
+
+def build_parser(parser=None):
+    if parser is None:
+        parser = argparse.ArgumentParser(prog='furiusisomount verify',
+                                         description=_('Verify images against MD5SUMS/SHA256SUMS style files.'),
+                                         epilog=_('Exit status is 0 when all images match, 1 on a mismatch and 3 when images are missing or unreadable.'))
+    return cli.verify_arguments(parser)
+
+def run(args):
+    entries = []
+    status = exit_ok
+    for sum_file in args.sum_files:
+        try:
+            entries.extend(parse(sum_file))
+        except (IOError, OSError) as e:
+            sys.stderr.write(_('%s: cannot read sum file: %s\n') % (sum_file, e.strerror))
+            status = exit_missing
+
+    def report(item):
+        if item.status != 'OK' or not args.quiet:
+            sys.stdout.write('%s: %s\n' % (item.image, item.status))
+            sys.stdout.flush()
+
+    verify(entries, args.workers, not args.no_cache, report)
+    counts = dict((name, sum(1 for item in entries if item.status == name)) for name in ('OK', 'FAILED', 'MISSING', 'ERROR'))
+    sys.stdout.write(_('%d verified, %d failed, %d missing, %d unreadable\n') % (counts['OK'], counts['FAILED'], counts['MISSING'], counts['ERROR']))
+    result = exit_status(entries)
+    return result if result != exit_ok else status
+
+def main(argv=None):
+    return run(build_parser().parse_args(argv))
+
+if __name__ == '__main__':
+    sys.exit(main())
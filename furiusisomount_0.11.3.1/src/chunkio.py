@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import abc
+import errno
+import fcntl
+import mmap
+import os
+import queue
+import threading
+import compressedimage
+import settings
+from gettext import gettext as _
+
+# Sequential readers used for checksum I/O.
+#
+# Every reader hands out (view, token) pairs from chunks(). The memoryview is
+# only valid until release(token) is called, after which its buffer may be
+# refilled, so consumers must release each chunk once they are done with it.
+# At most `depth` chunks are outstanding at any time, which bounds memory use
+# to depth * buffer_size no matter how many consumers share the chunks.
+#
+# cache_mode ([checksum_options] cache_mode) sets how a read treats the page
+# cache:
+#
+#   normal      no hints
+#   sequential  POSIX_FADV_SEQUENTIAL, for more read-ahead (the default)
+#   dropbehind  sequential, and each range is dropped from the cache with
+#               POSIX_FADV_DONTNEED once it has been read, so hashing a large
+#               image does not push everything else out of memory
+#   direct      O_DIRECT reads into page-aligned buffers, bypassing the cache;
+#               where the filesystem refuses O_DIRECT this becomes dropbehind.
+#               The mmap strategy cannot read this way and uses dropbehind.
+#
+# Compressed images (gzip, xz, zstd) can be read decompressed through
+# decompressing_reader whatever the strategy, so they are hashed as the image
+# they hold without being unpacked anywhere first.
+
+strategies = ('readinto', 'mmap', 'readahead')
+cache_modes = ('normal', 'sequential', 'dropbehind', 'direct')
+default_strategy = 'readinto'
+default_cache_mode = 'sequential'
+default_buffer_size = 2**20
+default_depth = 4
+# O_DIRECT needs offsets, lengths and buffers aligned to the logical block
+# size; a page is a multiple of it on every common device
+direct_alignment = mmap.PAGESIZE
+
+def advise(descriptor, offset, length, advice):
+    # posix_fadvise is only a hint, so failures are ignored
+    try:
+        os.posix_fadvise(descriptor, offset, length, advice)
+    except (AttributeError, OSError):
+        pass
+
+def warm(file):
+    # Ask the kernel to start reading file into the page cache in the
+    # background, ahead of it being browsed
+    descriptor = os.open(file, os.O_RDONLY)
+    try:
+        advise(descriptor, 0, 0, getattr(os, 'POSIX_FADV_WILLNEED', 3))
+    finally:
+        os.close(descriptor)
+
+def drop(file):
+    # Ask the kernel to evict file's clean pages from the page cache, so the
+    # next read of it comes from the device
+    descriptor = os.open(file, os.O_RDONLY)
+    try:
+        advise(descriptor, 0, 0, getattr(os, 'POSIX_FADV_DONTNEED', 4))
+    finally:
+        os.close(descriptor)
+
+class reader(abc.ABC):
+    def __init__(self, file, buffer_size=default_buffer_size, depth=default_depth, cache_mode='normal'):
+        self.file = file
+        self.buffer_size = buffer_size
+        self.depth = max(depth, 1)
+        self.cache_mode = cache_mode
+        self.position = 0
+        self.file_stream = self.open(file)
+        self.size = os.fstat(self.file_stream.fileno()).st_size
+        if self.cache_mode != 'normal':
+            advise(self.file_stream.fileno(), 0, 0, getattr(os, 'POSIX_FADV_SEQUENTIAL', 2))
+
+    def open(self, file):
+        if self.cache_mode == 'direct':
+            try:
+                return open(os.open(file, os.O_RDONLY | os.O_DIRECT), 'rb', buffering=0)
+            except (AttributeError, OSError) as e:
+                if getattr(e, 'errno', errno.EINVAL) != errno.EINVAL:
+                    raise
+                self.cache_mode = 'dropbehind'
+        return open(file, 'rb', buffering=0)
+
+    def new_buffer(self):
+        if self.cache_mode == 'direct':
+            # Anonymous maps are page aligned
+            return mmap.mmap(-1, self.buffer_size)
+        return bytearray(self.buffer_size)
+
+    def read_chunk(self, buffer):
+        # readinto the next chunk, dropping it from the cache afterwards
+        # when asked to
+        try:
+            count = self.file_stream.readinto(buffer)
+        except OSError as e:
+            if e.errno != errno.EINVAL or self.cache_mode != 'direct':
+                raise
+            # Opened with O_DIRECT but the filesystem will not read that way
+            descriptor = self.file_stream.fileno()
+            fcntl.fcntl(descriptor, fcntl.F_SETFL, fcntl.fcntl(descriptor, fcntl.F_GETFL) & ~os.O_DIRECT)
+            self.cache_mode = 'dropbehind'
+            count = self.file_stream.readinto(buffer)
+        if count and self.cache_mode == 'dropbehind':
+            advise(self.file_stream.fileno(), self.position, count, getattr(os, 'POSIX_FADV_DONTNEED', 4))
+        self.position += count or 0
+        return count
+
+    def fraction(self, bytes_done):
+        # How much of the file has been read, from 0 to 1
+        return float(bytes_done) / float(self.size) if self.size else 0.0
+
+    @abc.abstractmethod
+    def chunks(self):
+        # Yields (view, token) pairs up to the end of the file
+        pass
+
+    def release(self, token):
+        pass
+
+    def close(self):
+        if self.cache_mode in ('dropbehind', 'direct'):
+            # Also drop whatever the kernel read ahead past the last chunk
+            advise(self.file_stream.fileno(), 0, 0, getattr(os, 'POSIX_FADV_DONTNEED', 4))
+        self.file_stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class readinto_reader(reader):
+    # Reads straight into a small pool of reused buffers
+    def __init__(self, file, buffer_size=default_buffer_size, depth=default_depth, cache_mode='normal'):
+        reader.__init__(self, file, buffer_size, depth, cache_mode)
+        self.free = queue.Queue()
+        for i in range(self.depth):
+            self.free.put(self.new_buffer())
+
+    def chunks(self):
+        while True:
+            buffer = self.free.get()
+            count = self.read_chunk(buffer)
+            if not count:
+                self.free.put(buffer)
+                return
+            yield memoryview(buffer)[:count], buffer
+
+    def release(self, token):
+        self.free.put(token)
+
+class mmap_reader(reader):
+    # Maps the whole image and hands out slices of the mapping
+    def __init__(self, file, buffer_size=default_buffer_size, depth=default_depth, cache_mode='normal'):
+        reader.__init__(self, file, buffer_size, depth, 'dropbehind' if cache_mode == 'direct' else cache_mode)
+        self.map = None
+        self.slots = threading.Semaphore(self.depth)
+        if self.size:
+            self.map = mmap.mmap(self.file_stream.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self.map, 'madvise'):
+                self.map.madvise(mmap.MADV_SEQUENTIAL)
+
+    def chunks(self):
+        if self.map is None:
+            return
+        for offset in range(0, self.size, self.buffer_size):
+            self.slots.acquire()
+            view = memoryview(self.map)[offset:offset + self.buffer_size]
+            yield view, (view, offset)
+
+    def release(self, token):
+        view, offset = token
+        length = len(view)
+        view.release()
+        if self.cache_mode == 'dropbehind':
+            # Mapped pages stay cached until they are unmapped
+            start = offset - offset % mmap.PAGESIZE
+            if hasattr(mmap, 'MADV_DONTNEED'):
+                self.map.madvise(mmap.MADV_DONTNEED, start, offset + length - start)
+            advise(self.file_stream.fileno(), start, offset + length - start, getattr(os, 'POSIX_FADV_DONTNEED', 4))
+        self.slots.release()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        reader.close(self)
+
+class readahead_reader(readinto_reader):
+    # Fills the buffer pool on a background thread so the next read is
+    # already in flight while the current chunk is being consumed
+    def __init__(self, file, buffer_size=default_buffer_size, depth=default_depth, cache_mode='normal'):
+        readinto_reader.__init__(self, file, buffer_size, max(depth, 2), cache_mode)
+        self.filled = queue.Queue()
+        self.error = None
+        self.thread = None
+        self.stopping = False
+
+    def fill(self):
+        try:
+            while True:
+                buffer = self.free.get()
+                if buffer is None or self.stopping:
+                    return
+                count = self.read_chunk(buffer)
+                if not count:
+                    self.free.put(buffer)
+                    return
+                self.filled.put((count, buffer))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.filled.put(None)
+
+    def chunks(self):
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+        while True:
+            item = self.filled.get()
+            if item is None:
+                break
+            count, buffer = item
+            yield memoryview(buffer)[:count], buffer
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.thread is not None:
+            # Wake the fill thread if it is waiting for a free buffer
+            self.stopping = True
+            self.free.put(None)
+            self.thread.join()
+        readinto_reader.close(self)
+
+class decompressing_reader(readinto_reader):
+    # Fills the buffer pool with the decompressed image. size is the image
+    # size where the seek index already knows it and the compressed size
+    # until then. A read that reaches the end saves the seek index.
+    def __init__(self, file, buffer_size=default_buffer_size, depth=default_depth, cache_mode='normal', compression=None):
+        readinto_reader.__init__(self, file, buffer_size, depth, 'dropbehind' if cache_mode == 'direct' else cache_mode)
+        self.compressed_size = self.size
+        self.compression = compression if compression else compressedimage.compression_of(file)
+        if not compressedimage.is_supported(self.compression):
+            raise ValueError(_('Unsupported compressed image: %s') % file)
+        index = compressedimage.quick_index(file, self.file_stream.fileno(), self.compression)
+        if index.size is not None:
+            self.size = index.size
+        # Checkpoints are collected unless the index is already complete
+        self.found = None if index.complete else compressedimage.seek_index(self.compression)
+        self.decoder = compressedimage.decoders[self.compression](self.file_stream.fileno(), compressedimage.checkpoint(0, 0), self.found)
+
+    def fraction(self, bytes_done):
+        return float(self.decoder.coffset) / float(self.compressed_size) if self.compressed_size else 0.0
+
+    def chunks(self):
+        pending = bytearray()
+        for output in self.decoder.chunks():
+            pending += output
+            while len(pending) >= self.buffer_size:
+                yield self.fill(pending)
+            if self.cache_mode == 'dropbehind':
+                advise(self.file_stream.fileno(), 0, self.decoder.coffset, getattr(os, 'POSIX_FADV_DONTNEED', 4))
+        while pending:
+            yield self.fill(pending)
+        if self.found is not None:
+            compressedimage.record_index(self.file, self.found, self.decoder.uoffset)
+
+    def fill(self, pending):
+        buffer = self.free.get()
+        count = min(len(pending), self.buffer_size)
+        buffer[:count] = pending[:count]
+        del pending[:count]
+        return memoryview(buffer)[:count], buffer
+
+def open_reader(file, strategy=None, buffer_size=None, depth=None, cache_mode=None, decompress=False):
+    # Unspecified parameters come from [checksum_options] in settings.cfg
+    if strategy is None:
+        strategy = settings.get('checksum_options', 'read_strategy', default_strategy)
+    if buffer_size is None:
+        buffer_size = settings.get_int('checksum_options', 'buffer_size', default_buffer_size)
+    if depth is None:
+        depth = settings.get_int('checksum_options', 'buffer_count', default_depth)
+    if cache_mode is None:
+        cache_mode = settings.get('checksum_options', 'cache_mode', default_cache_mode).strip()
+    if cache_mode not in cache_modes:
+        raise ValueError(_('Unknown cache mode: %s') % cache_mode)
+    buffer_size = max(buffer_size, 4096)
+    if cache_mode == 'direct':
+        buffer_size += -buffer_size % direct_alignment
+    if decompress:
+        compression = compressedimage.compression_of(file)
+        if compression is not None:
+            return decompressing_reader(file, buffer_size, depth, cache_mode, compression)
+    if strategy == 'readinto':
+        return readinto_reader(file, buffer_size, depth, cache_mode)
+    if strategy == 'mmap':
+        return mmap_reader(file, buffer_size, depth, cache_mode)
+    if strategy == 'readahead':
+        return readahead_reader(file, buffer_size, depth, cache_mode)
+    raise ValueError(_('Unknown read strategy: %s') % strategy)
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+# --profile-startup measures from here
+started = time.perf_counter()
+import sys
+import os
+import argparse
+import gettext
+from gettext import gettext as _
+import globals
+
+# Command line front end. Only the GUI path imports main (and with it gi), so
+# scripted use starts quickly and works without a display.
+
+commands = ('mount', 'unmount', 'list', 'ls', 'index', 'search', 'checksum', 'verify', 'manifest', 'convert', 'benchmark', 'perf')
+# What perfsuite can run, named here so the parser needs no perfsuite
+perf_benchmarks = ('hash', 'history', 'mountlist', 'detect', 'startup')
+perf_tolerance = 0.10
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='furiusisomount',
+                                     description=globals.assembly_description)
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+    mount_parser = subparsers.add_parser('mount', help=_('mount image files'))
+    mount_parser.add_argument('images', nargs='+', metavar='IMAGE')
+    mount_parser.add_argument('--loop', action='store_true', help=_('use a loop mount instead of fuseiso'))
+
+    unmount_parser = subparsers.add_parser('unmount', help=_('unmount images by mount point or image file'))
+    unmount_parser.add_argument('targets', nargs='+', metavar='TARGET')
+
+    subparsers.add_parser('list', help=_('list mounted images'))
+
+    ls_parser = subparsers.add_parser('ls', help=_('list files inside an ISO image without mounting it'))
+    ls_parser.add_argument('image', metavar='IMAGE')
+    ls_parser.add_argument('path', nargs='?', default='/', metavar='PATH')
+    ls_parser.add_argument('-l', '--long', action='store_true', help=_('show size, modification time and mode'))
+
+    index_parser = subparsers.add_parser('index', help=_('record the files inside images for searching'))
+    index_parser.add_argument('paths', nargs='*', metavar='IMAGE_OR_DIRECTORY')
+    index_parser.add_argument('--force', action='store_true', help=_('re-read images even if they did not change'))
+    index_parser.add_argument('--prune', action='store_true', help=_('forget indexed images that no longer exist'))
+
+    search_parser = subparsers.add_parser('search', help=_('find files inside indexed images'))
+    search_parser.add_argument('pattern', metavar='PATTERN')
+    search_parser.add_argument('-g', '--glob', action='store_true', help=_('treat PATTERN as a glob instead of a substring'))
+    search_parser.add_argument('-n', '--limit', type=int, default=None, help=_('show at most this many matches'))
+
+    checksum_parser = subparsers.add_parser('checksum', help=_('print checksums of image files'))
+    checksum_parser.add_argument('images', nargs='+', metavar='IMAGE')
+    checksum_parser.add_argument('-a', '--algorithm', default='md5',
+                                 help=_('comma separated list of algorithms (default: md5)'))
+    checksum_parser.add_argument('--no-cache', action='store_true', help=_('ignore and do not update the checksum cache'))
+    checksum_parser.add_argument('--cache-mode', choices=('normal', 'sequential', 'dropbehind', 'direct'), default=None,
+                                 help=_('how reads use the page cache (default: [checksum_options] cache_mode)'))
+    checksum_parser.add_argument('--raw', dest='decompress', action='store_false', default=None,
+                                 help=_('hash gzip, xz and zstd images as they are stored instead of decompressed'))
+
+    manifest_parser = subparsers.add_parser('manifest', help=_('create or check block manifests for images'))
+    manifest_parser.add_argument('action', choices=('create', 'verify'))
+    manifest_parser.add_argument('images', nargs='+', metavar='IMAGE')
+    manifest_parser.add_argument('-b', '--block-size', type=int, default=None, help=_('block size in bytes for new manifests'))
+    manifest_parser.add_argument('-j', '--workers', type=int, default=None, help=_('number of blocks hashed at once'))
+    manifest_parser.add_argument('--restart', action='store_true', help=_('ignore the progress of an interrupted verify'))
+
+    convert_parser = subparsers.add_parser('convert', help=_('write the data track of a BIN, MDF or NRG image as an ISO'))
+    convert_parser.add_argument('image', metavar='IMAGE')
+    convert_parser.add_argument('output', nargs='?', metavar='OUTPUT', help=_('defaults to IMAGE with an .iso extension'))
+
+    benchmark_parser = subparsers.add_parser('benchmark', help=_('compare read speed through each mount backend'))
+    benchmark_parser.add_argument('image', metavar='IMAGE')
+    benchmark_parser.add_argument('-b', '--backend', action='append', default=None, metavar='NAME',
+                                  help=_('backend to measure, may be repeated (default: every installed backend)'))
+    benchmark_parser.add_argument('--json', action='store_true', help=_('print the results as JSON'))
+    benchmark_parser.add_argument('--apply', action='store_true', help=_('make the fastest backends the defaults'))
+
+    verify_arguments(subparsers.add_parser('verify', help=_('verify images against sum files')))
+    perf_arguments(subparsers.add_parser('perf', help=_('run the performance benchmarks on synthetic images')))
+    return parser
+
+def verify_arguments(parser):
+    # Declared here rather than in bulkverify so that building the parser
+    # for any command does not import it
+    parser.add_argument('sum_files', nargs='+', metavar='SUMS', help=_('sum file listing images to verify'))
+    parser.add_argument('-j', '--workers', type=int, default=None, help=_('number of images verified at once'))
+    parser.add_argument('--no-cache', action='store_true', help=_('ignore and do not update the checksum cache'))
+    parser.add_argument('-q', '--quiet', action='store_true', help=_('only report images that did not verify'))
+    return parser
+
+def perf_arguments(parser):
+    # Likewise declared here rather than in perfsuite, which imports most of
+    # the application
+    parser.add_argument('-s', '--size', type=int, default=64, metavar='MB', help=_('size of the synthetic images (default: 64)'))
+    parser.add_argument('-r', '--repeat', type=int, default=3, help=_('runs per figure, the median is kept (default: 3)'))
+    parser.add_argument('-o', '--output', metavar='FILE', help=_('write the results as JSON to FILE'))
+    parser.add_argument('-c', '--compare', metavar='BASELINE', help=_('compare with results saved earlier'))
+    parser.add_argument('-t', '--tolerance', type=float, default=perf_tolerance * 100, metavar='PERCENT',
+                        help=_('change allowed before a figure counts as a regression (default: 10)'))
+    parser.add_argument('only', nargs='*', metavar='BENCHMARK',
+                        help=_('%s (default: all)') % ', '.join(perf_benchmarks))
+    return parser
+
+def load_history():
+    import history
+    return history.history().load()
+
+def load_registry(mount_history):
+    import mountregistry
+    registry = mountregistry.registry().load()
+    dropped, adopted = registry.reconcile(mount_history)
+    if dropped or adopted:
+        registry.save()
+    return registry
+
+def mount_images(args):
+    import imageaction
+    import imageformat
+    import mountengine
+    mount_history = load_history()
+    registry = load_registry(mount_history)
+    status = 0
+    # Images are checked before anything is started, and each one goes to
+    # the best mount method for its format unless --loop asks for loop
+    groups = {True: [], False: []}
+    for image in args.images:
+        image = os.path.abspath(image)
+        try:
+            image_format = imageformat.detect(image)
+        except OSError as e:
+            sys.stderr.write(_('Error mounting %s: %s\n') % (image, e.strerror))
+            status = 1
+            continue
+        if args.loop and image_format.supports_loop():
+            groups[False].append(image)
+        elif image_format.is_mountable() and not args.loop:
+            groups[image_format.preferred_backend() == 'fuse'].append(image)
+        else:
+            sys.stderr.write(_('Error mounting %s: %s cannot be mounted%s\n')
+                             % (image, image_format.description, _(' with --loop') if args.loop else ''))
+            status = 1
+    outcomes = []
+    for is_fuse, images in groups.items():
+        if images:
+            outcomes.extend(mountengine.mount_batch(images, is_fuse))
+    for outcome in outcomes:
+        try:
+            imageaction.record_mount(outcome, [], mount_history, registry)
+            sys.stdout.write('%s\t%s\n' % (outcome.mount_location, outcome.image_file))
+        except Exception as e:
+            sys.stderr.write(_('Error mounting %s: %s\n') % (outcome.image_file, e))
+            status = 1
+    return unmount_least_recently_used(registry, [outcome.mount_location for outcome in outcomes if outcome.ok]) or status
+
+def unmount_least_recently_used(registry, new_mount_points):
+    # Keep to max_mounts by unmounting idle images other than the new ones.
+    # Without a running window to watch them, idle_timeout does not apply.
+    import imageaction
+    import mountengine
+    import mountlifecycle
+    if not mountlifecycle.max_mounts():
+        return 0
+    expired = mountlifecycle.manager(registry, idle_timeout=0).expired(keep=new_mount_points)
+    status = 0
+    outcomes = mountengine.unmount_batch([(item.mount_point, item.is_fuse, item.backend) for item in expired])
+    for outcome in outcomes:
+        try:
+            imageaction.record_unmount(outcome, [], None, True, registry)
+            sys.stderr.write(_('Unmounted %s to stay within max_mounts\n') % outcome.mount_location)
+        except Exception as e:
+            sys.stderr.write(_('Error unmounting %s: %s\n') % (outcome.mount_location, e))
+            status = 1
+    return status
+
+def unmount_images(args):
+    import imageaction
+    import mountengine
+    registry = load_registry(load_history())
+    status = 0
+    selected = []
+    for target in args.targets:
+        target = os.path.abspath(target)
+        matches = registry.mounts_of(target)
+        if target in registry:
+            matches.append(registry.get(target))
+        matches = [item for item in matches if item not in selected]
+        if not matches:
+            sys.stderr.write(_('%s is not mounted\n') % target)
+            status = 1
+        selected.extend(matches)
+    outcomes = mountengine.unmount_batch([(item.mount_point, item.is_fuse, item.backend) for item in selected])
+    for outcome in outcomes:
+        try:
+            imageaction.record_unmount(outcome, [], None, True, registry)
+        except Exception as e:
+            sys.stderr.write(_('Error unmounting %s: %s\n') % (outcome.mount_location, e))
+            status = 1
+    return status
+
+def list_images(args):
+    for item in load_registry(load_history()):
+        sys.stdout.write('%s\t%s\t%s\n' % tuple(item.row()))
+    return 0
+
+def list_image_contents(args):
+    import isoreader
+    import stat
+    import time
+    try:
+        with isoreader.image(args.image) as image:
+            item = image.stat(args.path)
+            children = image.scandir(args.path) if item.is_directory() else [item]
+            for child in children:
+                name = child.name + ('/' if child.is_directory() else '')
+                if child.is_symlink():
+                    name = '%s -> %s' % (child.name, child.link)
+                if args.long:
+                    modified = time.strftime('%Y-%m-%d %H:%M', time.localtime(child.mtime))
+                    sys.stdout.write('%s %12d %s %s\n' % (stat.filemode(child.st_mode), child.size, modified, name))
+                else:
+                    sys.stdout.write('%s\n' % name)
+    except (IOError, OSError, ValueError) as e:
+        sys.stderr.write('%s: %s\n' % (args.image, e))
+        return 1
+    return 0
+
+def index_images(args):
+    import contentindex
+    if args.prune:
+        with contentindex.index() as content_index:
+            for path in content_index.prune():
+                sys.stdout.write(_('%s: removed\n') % path)
+
+    def report(path, status):
+        sys.stdout.write('%s: %s\n' % (path, status))
+        sys.stdout.flush()
+
+    paths = args.paths
+    if not paths:
+        # Refresh everything that is already indexed
+        with contentindex.index() as content_index:
+            paths = content_index.images()
+    contentindex.update(paths, report, args.force)
+    return 0
+
+def search_images(args):
+    import contentindex
+    with contentindex.index() as content_index:
+        matches = content_index.search(args.pattern, args.glob, args.limit)
+    for item in matches:
+        sys.stdout.write('%s:%s%s\n' % (item.image, item.path, '/' if item.is_directory else ''))
+    return 0 if matches else 1
+
+def checksum_images(args):
+    import filehash
+    algorithms = tuple(name.strip().lower() for name in args.algorithm.split(',') if name.strip())
+    for algorithm in algorithms:
+        if algorithm not in filehash.supported_algorithms:
+            sys.stderr.write(_('Unsupported checksum algorithm: %s\n') % algorithm)
+            return 2
+    status = 0
+    for image in args.images:
+        checksum = filehash.checksum()
+        checksum.compute(image, algorithms, use_cache=not args.no_cache, cache_mode=args.cache_mode, decompress=args.decompress)
+        if not checksum.hashes:
+            sys.stderr.write('%s: %s\n' % (image, checksum.hash))
+            status = 1
+        elif len(algorithms) == 1:
+            sys.stdout.write('%s  %s\n' % (checksum.hash, image))
+        else:
+            for algorithm in algorithms:
+                sys.stdout.write('%s (%s) = %s\n' % (algorithm.upper(), image, checksum.hashes[algorithm]))
+    return status
+
+def manifest_images(args):
+    import manifest
+    import threading
+    cancelled = threading.Event()
+    status = 0
+    try:
+        for image in args.images:
+            try:
+                if args.action == 'create':
+                    created = manifest.create(image, args.block_size, workers=args.workers, cancelled=cancelled)
+                    sys.stdout.write('%s: %s\n' % (image, created['root']))
+                    continue
+                result = manifest.verify(image, args.workers, not args.restart, cancelled)
+            except (IOError, OSError, ValueError) as e:
+                sys.stderr.write('%s: %s\n' % (image, e))
+                status = max(status, 3)
+                continue
+            if result.resumed:
+                sys.stdout.write(_('%s: resumed after %d blocks\n') % (image, result.resumed))
+            if result.is_intact():
+                sys.stdout.write('%s: OK\n' % image)
+                continue
+            status = 1
+            if result.size_mismatch:
+                sys.stdout.write(_('%s: FAILED, size differs from the manifest\n') % image)
+            for start, end in result.damaged_ranges():
+                sys.stdout.write(_('%s: FAILED, bytes %d-%d are damaged\n') % (image, start, end - 1))
+    except KeyboardInterrupt:
+        # Verify keeps its progress so the next run resumes
+        cancelled.set()
+        sys.stderr.write(_('Interrupted\n'))
+        return 130
+    return status
+
+def convert_image(args):
+    import convert
+    output = args.output if args.output else os.path.splitext(args.image)[0] + '.iso'
+    if os.path.abspath(output) == os.path.abspath(args.image):
+        sys.stderr.write(_('%s: the output would overwrite the image\n') % args.image)
+        return 1
+    try:
+        convert.convert(args.image, output)
+    except (IOError, OSError, ValueError) as e:
+        sys.stderr.write('%s: %s\n' % (args.image, e))
+        return 1
+    except KeyboardInterrupt:
+        # The partly written ISO has already been removed
+        sys.stderr.write(_('Interrupted\n'))
+        return 130
+    sys.stdout.write('%s\n' % output)
+    return 0
+
+def benchmark_backends(args):
+    import json
+    import mountbenchmark
+    try:
+        names = args.backend if args.backend else mountbenchmark.candidates(args.image)
+    except OSError as e:
+        sys.stderr.write('%s: %s\n' % (args.image, e.strerror))
+        return 1
+    if not names:
+        sys.stderr.write(_('No installed mount backend can mount %s\n') % args.image)
+        return 1
+    results = []
+    for name in names:
+        try:
+            results.append(mountbenchmark.run(os.path.abspath(args.image), name))
+        except ValueError as e:
+            sys.stderr.write('%s\n' % e)
+            return 2
+    if args.json:
+        sys.stdout.write(json.dumps([result.as_dict() for result in results], indent=2) + '\n')
+    else:
+        sys.stdout.write(_('backend    entries  lstat (us)  sequential (MB/s)  random 4K (IOPS)\n'))
+        for result in results:
+            if result.error:
+                sys.stdout.write('%-10s %s\n' % (result.backend, result.error))
+                continue
+            sys.stdout.write('%-10s %7d  %10s  %17s  %16s\n' % (
+                result.backend, result.entries,
+                '%.1f' % (result.metadata_latency * 1e6) if result.metadata_latency is not None else '-',
+                '%.1f' % (result.sequential_rate / 1e6) if result.sequential_rate else '-',
+                '%.0f' % result.random_iops if result.random_iops else '-'))
+    if args.apply:
+        for kind, result in mountbenchmark.apply(results).items():
+            sys.stdout.write(_('%s mounts now use %s\n') % (kind, result.backend))
+    return 1 if all(result.error for result in results) else 0
+
+def verify_images(args):
+    import bulkverify
+    return bulkverify.run(args)
+
+def run_performance_suite(args):
+    import perfsuite
+    return perfsuite.run(args)
+
+def main(argv):
+    if not argv or argv[0] not in commands + ('-h', '--help'):
+        # No command: start the GUI, optionally mounting the given images.
+        # If a window is already open the images go to it instead, unless
+        # --new-instance asks for a separate one. --profile-startup prints
+        # how long each step of startup took.
+        if '--new-instance' in argv:
+            argv = [argument for argument in argv if argument != '--new-instance']
+        else:
+            import singleinstance
+            if singleinstance.hand_off([argument for argument in argv if argument != '--profile-startup']):
+                return 0
+        profile = None
+        if '--profile-startup' in argv:
+            import startupprofile
+            argv = [argument for argument in argv if argument != '--profile-startup']
+            profile = startupprofile.phases(started)
+            profile.mark('command line')
+        import main as gui
+        if profile is not None:
+            profile.mark('gtk import')
+        return gui.run(argv, profile)
+
+    gettext.textdomain(globals.assembly_name)
+    gettext.bindtextdomain(globals.assembly_name, globals.locale_directory)
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        build_parser().print_help()
+        return 2
+    try:
+        import settings
+        settings.ensure_settings()
+    except OSError as e:
+        sys.stderr.write(_('Error creating settings directory.\nOS error(%s): %s\n') % (e.errno, e.strerror))
+        return 1
+    return {
+        'mount': mount_images,
+        'unmount': unmount_images,
+        'list': list_images,
+        'ls': list_image_contents,
+        'index': index_images,
+        'search': search_images,
+        'checksum': checksum_images,
+        'verify': verify_images,
+        'manifest': manifest_images,
+        'convert': convert_image,
+        'benchmark': benchmark_backends,
+        'perf': run_performance_suite,
+    }[args.command](args)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import abc
+import base64
+import bisect
+import glob
+import json
+import lzma
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from gettext import gettext as _
+import atomicfile
+import globals
+import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Images stored compressed with gzip, xz or zstd (.iso.gz, .iso.xz,
+# .iso.zst), read without writing the decompressed image anywhere.
+#
+# A decoder turns the compressed file into the image's bytes from a
+# checkpoint onwards. Checkpoints are the places a decoder can start from
+# other than the beginning:
+#
+#   gzip  the start of every gzip member, and the byte-aligned block
+#         boundaries left by sync flushes (as pigz writes them), restarted as
+#         raw deflate with the preceding 32 KiB as dictionary. A plain
+#         single-member gzip without flushes can only be read from the start.
+#   xz    every block, from the index at the end of each stream; xz -T
+#         writes many blocks, plain xz only one
+#   zstd  every frame (needs the optional zstandard module)
+#
+# The checkpoints of an image, spaced at least [compressed_options]
+# index_spacing bytes apart, are its seek index. For xz the index is read
+# from the file itself; gzip and zstd indexes are collected while an image
+# is decoded and kept in index_directory. A checksum reads the whole image
+# and leaves a complete index; a listing leaves the checkpoints it passed,
+# which later listings start from and add to. compressed_source gives
+# isoreader random access through the nearest checkpoint and a cache of
+# recently decoded blocks, so listing an image only decodes the sectors the
+# listing needs.
+
+# Raised by the decoders for damaged data, besides OSError and ValueError
+errors = (zlib.error, lzma.LZMAError, EOFError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+magics = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+suffixes = ('.gz', '.xz', '.zst')
+index_version = 1
+index_directory = os.path.join(globals.settings_directory, 'compressed-index')
+default_spacing = 32 * 2**20
+deflate_window = 32768
+sync_marker = b'\x00\x00\xff\xff'
+# Compressed bytes read, and decompressed bytes produced, per step
+read_size = 2**18
+output_limit = 2**20
+block_size = 2**16
+cache_blocks = 256
+
+def compression_of(file):
+    # 'gzip', 'xz', 'zstd' or None, from the first bytes of file
+    with open(file, 'rb') as image_file:
+        head = image_file.read(6)
+    for magic, compression in magics:
+        if head.startswith(magic):
+            return compression
+    return None
+
+def is_supported(compression):
+    return compression in ('gzip', 'xz') or (compression == 'zstd' and zstandard is not None)
+
+def index_spacing():
+    return max(settings.get_int('compressed_options', 'index_spacing', default_spacing), block_size)
+
+class checkpoint():
+    def __init__(self, uoffset, coffset, state=b''):
+        # uoffset in the image, coffset in the compressed file. state is what
+        # the decoder needs besides the compressed bytes: the deflate window
+        # for a gzip flush point, the stream header for an xz block.
+        self.uoffset = uoffset
+        self.coffset = coffset
+        self.state = state
+
+class seek_index():
+    def __init__(self, compression, checkpoints=None, size=None, complete=False):
+        self.compression = compression
+        self.checkpoints = checkpoints if checkpoints else [checkpoint(0, 0)]
+        self.size = size
+        # Whether size and the checkpoints cover the whole image
+        self.complete = complete
+
+    def add(self, item):
+        position = bisect.bisect([point.uoffset for point in self.checkpoints], item.uoffset)
+        if position and self.checkpoints[position - 1].uoffset == item.uoffset:
+            return
+        self.checkpoints.insert(position, item)
+
+    def before(self, offset):
+        # The last checkpoint at or before offset
+        position = bisect.bisect([point.uoffset for point in self.checkpoints], offset)
+        return self.checkpoints[max(position - 1, 0)]
+
+    def as_dict(self):
+        return {
+            'version': index_version,
+            'compression': self.compression,
+            'size': self.size,
+            'complete': self.complete,
+            'checkpoints': [[point.uoffset, point.coffset, base64.b64encode(zlib.compress(point.state)).decode('ascii')]
+                            for point in self.checkpoints],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != index_version:
+            raise ValueError(_('Unknown seek index version'))
+        checkpoints = [checkpoint(uoffset, coffset, zlib.decompress(base64.b64decode(state)))
+                       for uoffset, coffset, state in data['checkpoints']]
+        return cls(data['compression'], checkpoints, data['size'], data.get('complete', True))
+
+def index_path(file):
+    status = os.stat(file)
+    return os.path.join(index_directory, '%s-%d-%d-%d.json' % (os.path.basename(file), status.st_dev, status.st_ino, status.st_mtime_ns))
+
+def load_index(file):
+    try:
+        with open(index_path(file), 'r') as index_file:
+            return seek_index.from_dict(json.load(index_file))
+    except (IOError, OSError, ValueError, KeyError, TypeError, zlib.error):
+        return None
+
+def save_index(file, index):
+    # Written atomically; indexes of earlier versions of the file go
+    path = index_path(file)
+    if not os.path.isdir(index_directory):
+        os.makedirs(index_directory)
+    with atomicfile.atomic_write(path) as index_file:
+        json.dump(index.as_dict(), index_file)
+    for other in glob.glob(glob.escape(path[:path.rindex('-')]) + '-*.json'):
+        if other != path:
+            os.remove(other)
+
+class decoder(abc.ABC):
+    # Produces the image's bytes from a checkpoint onwards through chunks().
+    # coffset and uoffset follow the position in the compressed file and in
+    # the image. When found is a seek_index, checkpoints passed on the way
+    # are added to it.
+    def __init__(self, descriptor, start, found=None, spacing=None):
+        self.descriptor = descriptor
+        self.coffset = start.coffset
+        self.uoffset = start.uoffset
+        self.start = start
+        self.found = found
+        self.spacing = spacing if spacing else index_spacing()
+        self.last_found = start.uoffset
+
+    def read(self, offset, length):
+        return os.pread(self.descriptor, length, offset)
+
+    def note(self, item):
+        if self.found is not None and item.uoffset - self.last_found >= self.spacing:
+            self.found.add(item)
+            self.last_found = item.uoffset
+
+    @abc.abstractmethod
+    def chunks(self):
+        # Yields the image's bytes from start onwards, in order
+        pass
+
+class gzip_decoder(decoder):
+    def chunks(self):
+        # Starting at a flush point means raw deflate until the member ends
+        raw = bool(self.start.state)
+        window = bytearray(self.start.state)
+        stream = zlib.decompressobj(-15, zdict=self.start.state) if raw else zlib.decompressobj(31)
+        # A flush point is only a checkpoint if decoding from it gives the
+        # same bytes, which is checked once enough output has followed
+        pending = None
+        while True:
+            data = self.read(self.coffset, read_size)
+            if not data:
+                return
+            for piece in self.split(data):
+                for output in self.inflate(stream, piece):
+                    if self.found is not None:
+                        window = bytearray(output[-deflate_window:]) if len(output) >= deflate_window else (window + output)[-deflate_window:]
+                        if pending is not None:
+                            pending = self.confirm(pending, output)
+                    self.uoffset += len(output)
+                    yield output
+                if stream.eof:
+                    # The next member starts after this one's trailer, which
+                    # raw deflate leaves unread
+                    self.coffset += len(piece) - len(stream.unused_data) + (8 if raw else 0)
+                    if self.read(self.coffset, 2) != magics[0][0]:
+                        return
+                    raw = False
+                    window = bytearray()
+                    pending = None
+                    stream = zlib.decompressobj(31)
+                    self.note(checkpoint(self.uoffset, self.coffset))
+                    break
+                self.coffset += len(piece)
+                if (self.found is not None and piece.endswith(sync_marker) and pending is None
+                        and self.uoffset - self.last_found >= self.spacing):
+                    pending = [checkpoint(self.uoffset, self.coffset, bytes(window)), bytearray()]
+
+    def split(self, data):
+        # Pieces of data ending at each sync flush marker, so the position
+        # just after a marker is seen between two pieces
+        if self.found is None:
+            return [data]
+        pieces = []
+        start = 0
+        while True:
+            position = data.find(sync_marker, start)
+            if position < 0:
+                break
+            pieces.append(data[start:position + len(sync_marker)])
+            start = position + len(sync_marker)
+        if start < len(data):
+            pieces.append(data[start:])
+        return pieces
+
+    def inflate(self, stream, piece):
+        output = stream.decompress(piece, output_limit)
+        while True:
+            if output:
+                yield output
+            if not stream.unconsumed_tail or stream.eof:
+                return
+            output = stream.decompress(stream.unconsumed_tail, output_limit)
+
+    def confirm(self, pending, output):
+        point, seen = pending
+        seen += output[:block_size - len(seen)]
+        if len(seen) < block_size:
+            return pending
+        try:
+            trial = zlib.decompressobj(-15, zdict=point.state)
+            result = trial.decompress(self.read(point.coffset, read_size), block_size)
+        except zlib.error:
+            return None
+        if result == bytes(seen):
+            self.note(point)
+        return None
+
+class xz_decoder(decoder):
+    # Decodes block by block, each on its own, so any block can be a start
+    def __init__(self, descriptor, start, found=None, spacing=None, blocks=None):
+        decoder.__init__(self, descriptor, start, found, spacing)
+        self.blocks = blocks if blocks is not None else xz_blocks(descriptor)
+
+    def chunks(self):
+        starts = [block.uoffset for block in self.blocks]
+        position = bisect.bisect(starts, self.uoffset) - 1
+        for block in self.blocks[max(position, 0):]:
+            stream = lzma.LZMADecompressor(lzma.FORMAT_XZ)
+            stream.decompress(block.state)
+            self.coffset = block.coffset
+            end = block.coffset + block.compressed_size
+            remaining = block.size
+            # Output before the start point is decoded and dropped
+            skip = max(self.uoffset - block.uoffset, 0)
+            while remaining:
+                data = b''
+                if stream.needs_input:
+                    data = self.read(self.coffset, min(read_size, end - self.coffset))
+                    if not data:
+                        raise lzma.LZMAError(_('Compressed data ends early'))
+                    self.coffset += len(data)
+                output = stream.decompress(data, min(output_limit, remaining))
+                remaining -= len(output)
+                if skip:
+                    dropped = min(skip, len(output))
+                    output = output[dropped:]
+                    skip -= dropped
+                if output:
+                    self.uoffset += len(output)
+                    yield output
+
+class xz_block(checkpoint):
+    def __init__(self, uoffset, coffset, header, compressed_size, size):
+        checkpoint.__init__(self, uoffset, coffset, header)
+        self.compressed_size = compressed_size
+        self.size = size
+
+def read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+def xz_blocks(descriptor):
+    # Every block of every stream, from the indexes at the end of the streams
+    end = os.fstat(descriptor).st_size
+    streams = []
+    while end > 0:
+        if os.pread(descriptor, 4, end - 4) == b'\x00' * 4:
+            # Stream padding after a stream
+            end -= 4
+            continue
+        footer = os.pread(descriptor, 12, end - 12)
+        if len(footer) < 12 or footer[10:] != b'YZ':
+            raise ValueError(_('Not an xz file'))
+        index_size = (struct.unpack('<I', footer[4:8])[0] + 1) * 4
+        index = os.pread(descriptor, index_size, end - 12 - index_size)
+        if not index or index[0] != 0:
+            raise ValueError(_('Damaged xz index'))
+        count, position = read_varint(index, 1)
+        records = []
+        for number in range(count):
+            unpadded, position = read_varint(index, position)
+            size, position = read_varint(index, position)
+            records.append((unpadded, size))
+        blocks_size = sum(unpadded + (-unpadded % 4) for unpadded, size in records)
+        start = end - 12 - index_size - blocks_size - 12
+        if start < 0:
+            raise ValueError(_('Damaged xz index'))
+        streams.append((start, records))
+        end = start
+    blocks = []
+    uoffset = 0
+    for start, records in reversed(streams):
+        header = os.pread(descriptor, 12, start)
+        coffset = start + 12
+        for unpadded, size in records:
+            padded = unpadded + (-unpadded % 4)
+            blocks.append(xz_block(uoffset, coffset, header, padded, size))
+            uoffset += size
+            coffset += padded
+    return blocks
+
+class zstd_decoder(decoder):
+    def chunks(self):
+        if zstandard is None:
+            raise ValueError(_('Reading zstd images needs the zstandard module'))
+        self.coffset = next_zstd_frame(self.descriptor, self.coffset)
+        while self.coffset is not None:
+            source = open(os.dup(self.descriptor), 'rb')
+            try:
+                source.seek(self.coffset)
+                reader = zstandard.ZstdDecompressor().stream_reader(source, read_across_frames=False)
+                while True:
+                    output = reader.read(output_limit)
+                    if not output:
+                        break
+                    self.uoffset += len(output)
+                    yield output
+            finally:
+                source.close()
+            # The reader reads ahead, so the next frame is found by walking
+            # this one's block headers
+            length, content_size, is_data = zstd_frame(self.descriptor, self.coffset)
+            self.coffset = next_zstd_frame(self.descriptor, self.coffset + length) if length else None
+            if self.coffset is not None:
+                self.note(checkpoint(self.uoffset, self.coffset))
+
+def zstd_frame(descriptor, coffset):
+    # (compressed length, content size or None, whether it holds data) of the
+    # frame at coffset, walked from its block headers; length is None if
+    # there is no frame there
+    header = os.pread(descriptor, 18, coffset)
+    if len(header) < 8:
+        return None, None, False
+    magic = struct.unpack('<I', header[:4])[0]
+    if magic & 0xfffffff0 == 0x184d2a50:
+        return 8 + struct.unpack('<I', header[4:8])[0], 0, False
+    if magic != 0xfd2fb528:
+        return None, None, False
+    flags = header[4]
+    single_segment = flags & 0x20
+    content_size_bytes = (1 if single_segment else 0, 2, 4, 8)[flags >> 6]
+    position = 5 + (0 if single_segment else 1) + (0, 1, 2, 4)[flags & 3]
+    content_size = None
+    if content_size_bytes:
+        content_size = int.from_bytes(header[position:position + content_size_bytes], 'little')
+        if content_size_bytes == 2:
+            content_size += 256
+    position += content_size_bytes
+    while True:
+        block = os.pread(descriptor, 3, coffset + position)
+        if len(block) < 3:
+            return None, None, False
+        value = int.from_bytes(block, 'little')
+        # Raw and compressed blocks hold `size` bytes, RLE blocks one
+        position += 3 + (1 if (value >> 1) & 3 == 1 else value >> 3)
+        if value & 1:
+            break
+    if flags & 4:
+        # Content checksum
+        position += 4
+    return position, content_size, True
+
+def zstd_frames(descriptor):
+    # (offset, content size or None) of every data frame in the file
+    end = os.fstat(descriptor).st_size
+    frames = []
+    coffset = 0
+    while coffset < end:
+        length, content_size, is_data = zstd_frame(descriptor, coffset)
+        if length is None:
+            break
+        if is_data:
+            frames.append((coffset, content_size))
+        coffset += length
+    return frames
+
+def next_zstd_frame(descriptor, coffset):
+    # The first data frame at or after coffset
+    while True:
+        length, content_size, is_data = zstd_frame(descriptor, coffset)
+        if length is None:
+            return None
+        if is_data:
+            return coffset
+        coffset += length
+
+decoders = {'gzip': gzip_decoder, 'xz': xz_decoder, 'zstd': zstd_decoder}
+
+def quick_index(file, descriptor, compression):
+    # The seek index that can be had without decoding the image: a saved
+    # one, xz's own, or zstd frames that all state their size
+    if compression != 'xz':
+        index = load_index(file)
+        if index is not None and index.compression == compression:
+            return index
+    if compression == 'xz':
+        blocks = xz_blocks(descriptor)
+        return seek_index('xz', blocks or None, sum(block.size for block in blocks), True)
+    if compression == 'zstd':
+        frames = zstd_frames(descriptor)
+        if frames and all(size is not None for coffset, size in frames):
+            index = seek_index('zstd', complete=True)
+            uoffset = 0
+            for coffset, size in frames:
+                index.add(checkpoint(uoffset, coffset))
+                uoffset += size
+            index.size = uoffset
+            return index
+    return seek_index(compression)
+
+def record_index(file, index, size=None):
+    # Keep the checkpoints found so far; with size, the read reached the end
+    # of the image and the index is complete. xz needs none: its index is
+    # part of the file.
+    if index.compression == 'xz':
+        return
+    if size is not None:
+        index.size = size
+        index.complete = True
+    try:
+        save_index(file, index)
+    except (IOError, OSError):
+        pass
+
+class compressed_source():
+    # A read(offset, length) view of the decompressed image for isoreader.
+    # size is None until the image has been read to the end once.
+    def __init__(self, file, compression=None):
+        self.file = file
+        self.compression = compression if compression else compression_of(file)
+        if not is_supported(self.compression):
+            raise ValueError(_('Unsupported compressed image: %s') % file)
+        self.descriptor = os.open(file, os.O_RDONLY)
+        try:
+            self.index = quick_index(file, self.descriptor, self.compression)
+        except:
+            os.close(self.descriptor)
+            raise
+        self.size = self.index.size
+        self.recorded = (len(self.index.checkpoints), self.index.complete)
+        self.blocks = OrderedDict()
+        self.cursor = None
+        self.position = 0
+        self.pending = bytearray()
+        self.lock = threading.Lock()
+
+    def decoder_at(self, offset):
+        start = self.index.before(offset)
+        # Flush points met on the way become checkpoints for later reads
+        found = None if self.index.complete else self.index
+        if self.compression == 'xz':
+            blocks = [point for point in self.index.checkpoints if isinstance(point, xz_block)]
+            return xz_decoder(self.descriptor, start, found, blocks=blocks or None)
+        return decoders[self.compression](self.descriptor, start, found)
+
+    def block(self, number):
+        # Decoded block `number` of block_size bytes, cached
+        cached = self.blocks.get(number)
+        if cached is not None:
+            self.blocks.move_to_end(number)
+            return cached
+        offset = number * block_size
+        # Carry on from where the last read stopped unless that is past the
+        # block or a checkpoint is nearer
+        if (self.cursor is None or self.position > offset
+                or self.index.before(offset).uoffset > self.position):
+            self.cursor = self.decoder_at(offset)
+            self.chunks = self.cursor.chunks()
+            self.position = self.cursor.uoffset
+            self.pending = bytearray()
+        # pending holds the decoded bytes from position onwards
+        while True:
+            if self.position < offset:
+                skipped = min(offset - self.position, len(self.pending))
+                del self.pending[:skipped]
+                self.position += skipped
+            if self.position + len(self.pending) >= offset + block_size:
+                break
+            try:
+                self.pending += next(self.chunks)
+            except StopIteration:
+                break
+        data = bytes(self.pending[:block_size])
+        del self.pending[:len(data)]
+        self.position += len(data)
+        if len(data) < block_size and self.size is None:
+            self.size = self.index.size = offset + len(data)
+        self.blocks[number] = data
+        while len(self.blocks) > cache_blocks:
+            self.blocks.popitem(last=False)
+        return data
+
+    def read(self, offset, length):
+        with self.lock:
+            if self.size is not None:
+                length = max(min(length, self.size - offset), 0)
+            pieces = []
+            position = offset
+            while length > 0:
+                data = self.block(position // block_size)
+                skip = position % block_size
+                piece = data[skip:skip + length]
+                if not piece:
+                    break
+                pieces.append(piece)
+                position += len(piece)
+                length -= len(piece)
+            return b''.join(pieces)
+
+    def close(self):
+        # Keep the checkpoints this view found, so that the next listing of
+        # the image starts from them instead of from the beginning
+        if (len(self.index.checkpoints), self.size is not None) != self.recorded:
+            record_index(self.file, self.index, self.size)
+        os.close(self.descriptor)
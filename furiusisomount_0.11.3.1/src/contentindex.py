@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+from gettext import gettext as _
+import globals
+import isoreader
+
+# On-disk index of the files inside each image, so a whole library can be
+# searched without mounting anything. Images are only re-read when their size
+# or modification time changed since they were last indexed.
+
+schema = '''
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    volume_id TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    is_directory INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_image ON files(image_id);
+'''
+
+class match():
+    def __init__(self, image, path, size, offset, is_directory):
+        self.image = image
+        self.path = path
+        self.size = size
+        self.offset = offset
+        self.is_directory = bool(is_directory)
+
+class index():
+    def __init__(self, path=None):
+        self.connection = sqlite3.connect(path if path else globals.content_index)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def is_current(self, image_file, status):
+        row = self.connection.execute('SELECT size, mtime_ns FROM images WHERE path = ?', (image_file,)).fetchone()
+        return row is not None and row == (status.st_size, status.st_mtime_ns)
+
+    def add(self, image_file, force=False):
+        # Returns True if the image was (re)indexed, False if it was current
+        image_file = os.path.abspath(image_file)
+        status = os.stat(image_file)
+        if not force and self.is_current(image_file, status):
+            return False
+        with isoreader.image(image_file) as image:
+            rows = [(path, item.size, item.extent * image.block_size, int(item.is_directory()))
+                    for path, item in image.walk()]
+            volume_id = image.volume_id
+        with self.connection:
+            self.connection.execute('DELETE FROM images WHERE path = ?', (image_file,))
+            cursor = self.connection.execute('INSERT INTO images (path, size, mtime_ns, volume_id) VALUES (?, ?, ?, ?)',
+                                             (image_file, status.st_size, status.st_mtime_ns, volume_id))
+            image_id = cursor.lastrowid
+            self.connection.executemany('INSERT INTO files (image_id, path, size, offset, is_directory) VALUES (?, ?, ?, ?, ?)',
+                                        [(image_id,) + row for row in rows])
+        return True
+
+    def remove(self, image_file):
+        with self.connection:
+            self.connection.execute('DELETE FROM images WHERE path = ?', (os.path.abspath(image_file),))
+
+    def prune(self):
+        # Drop images that no longer exist
+        missing = [path for (path,) in self.connection.execute('SELECT path FROM images') if not os.path.exists(path)]
+        for path in missing:
+            self.remove(path)
+        return missing
+
+    def images(self):
+        return [row[0] for row in self.connection.execute('SELECT path FROM images ORDER BY path')]
+
+    def search(self, pattern, use_glob=False, limit=None):
+        # Substring search is case-insensitive; glob patterns match the whole
+        # path inside the image (or just the file name if they have no '/')
+        if use_glob:
+            column = 'files.path' if '/' in pattern else "substr(files.path, length(rtrim(files.path, replace(files.path, '/', ''))) + 1)"
+            condition = '%s GLOB ?' % column
+            argument = pattern
+        else:
+            condition = "files.path LIKE ? ESCAPE '\\'"
+            argument = '%%%s%%' % pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = ('SELECT images.path, files.path, files.size, files.offset, files.is_directory '
+                 'FROM files JOIN images ON images.id = files.image_id WHERE %s '
+                 'ORDER BY images.path, files.path' % condition)
+        if limit:
+            query += ' LIMIT %d' % int(limit)
+        return [match(*row) for row in self.connection.execute(query, (argument,))]
+
+def image_files(paths):
+    # Expands directories into the files below them
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, directories, files in os.walk(path):
+                directories.sort()
+                for name in sorted(files):
+                    yield os.path.join(directory, name)
+        else:
+            yield path
+
+def update(paths, report=None, force=False):
+    # Index every image under paths; files that are not ISO9660 are skipped.
+    # report(path, status) is called with 'indexed', 'current' or an error.
+    with index() as content_index:
+        for path in image_files(paths):
+            try:
+                status = 'indexed' if content_index.add(path, force) else 'current'
+            except ValueError:
+                status = _('not an ISO9660 image')
+            except (IOError, OSError) as e:
+                status = e.strerror or str(e)
+            if report:
+                report(path, status)
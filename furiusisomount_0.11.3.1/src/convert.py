@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import glob
+import mmap
+import os
+import struct
+import threading
+from gettext import gettext as _
+import atomicfile
+import globals
+import imageformat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Plain 2048-byte-sector views of BIN, MDF and NRG images.
+#
+# The data track of an image is described as a sector_layout: where it
+# starts in the file, how big each stored sector is and where the 2048 bytes
+# of user data sit inside it. From that the cooked data can be read through
+# cooked_source (for isoreader), written out as an ISO by convert(), or
+# handed to a loop mount: tracks that already hold 2048-byte sectors are
+# mounted in place with an offset, the rest are converted once into
+# converted_directory. Sector headers and ECC are stripped a run of sectors
+# at a time, with NumPy when it is installed. A converted copy is removed
+# again only once no loop device, set up by this or any other process, is
+# still backed by it.
+
+cooked_sector = imageformat.cooked_sector
+# Sectors stripped per run; also the iovec count passed to one writev
+run_sectors = 1024
+converted_directory = os.path.join(globals.settings_directory, 'converted')
+conversion_lock = threading.Lock()
+
+class sector_layout():
+    def __init__(self, offset, sector_size, data_offset, count):
+        self.offset = offset
+        self.sector_size = sector_size
+        self.data_offset = data_offset
+        self.count = count
+
+    @property
+    def size(self):
+        # Size of the cooked view
+        return self.count * cooked_sector
+
+    def is_cooked(self):
+        # The track already holds plain 2048-byte sectors
+        return self.sector_size == cooked_sector
+
+    def is_plain(self):
+        # The whole file is usable as an ISO just as it is
+        return self.is_cooked() and self.offset == 0
+
+def raw_data_offset(descriptor, offset, sector_size):
+    # Mode 1 data follows the 16-byte header, mode 2 form 1 data follows the
+    # header and an 8-byte subheader; 2336-byte sectors have no header
+    if sector_size == 2336:
+        return 8
+    header = os.pread(descriptor, 16, offset)
+    return 24 if len(header) == 16 and header[15] == 2 else 16
+
+def nero_chunks(descriptor, footer):
+    # Yields (identifier, body) for each chunk in a Nero footer
+    version, position = footer
+    while True:
+        header = os.pread(descriptor, 8, position)
+        if len(header) < 8:
+            return
+        identifier, length = header[:4], struct.unpack('>I', header[4:])[0]
+        if identifier == b'END!':
+            return
+        yield identifier, os.pread(descriptor, length, position + 8)
+        position += 8 + length
+
+def nero_track_sector_size(descriptor, offset, length):
+    # TAO entries only give a mode, so the sector size is read from the data
+    if os.pread(descriptor, 12, offset) == imageformat.raw_sync:
+        return 2448 if length % 2448 == 0 and length % 2352 else 2352
+    if length % cooked_sector == 0:
+        return cooked_sector
+    return 2336 if length % 2336 == 0 else 2352
+
+def nero_layout(descriptor, footer):
+    # The first data track of the first session, from a DAO (DAOX/DAOI) or
+    # TAO (ETN2/ETNF) description
+    for identifier, body in nero_chunks(descriptor, footer):
+        if identifier in (b'DAOX', b'DAOI'):
+            wide = identifier == b'DAOX'
+            block = 42 if wide else 30
+            for position in range(22, len(body) - block + 1, block):
+                sector_size = struct.unpack('>H', body[position + 12:position + 14])[0]
+                if wide:
+                    start, end = struct.unpack('>QQ', body[position + 26:position + 42])
+                else:
+                    start, end = struct.unpack('>II', body[position + 22:position + 30])
+                if sector_size in (cooked_sector, 2336, 2352, 2448) and end > start:
+                    return sector_layout(start, sector_size, raw_data_offset(descriptor, start, sector_size) if sector_size != cooked_sector else 0,
+                                         (end - start) // sector_size)
+        elif identifier in (b'ETN2', b'ETNF'):
+            block = 32 if identifier == b'ETN2' else 20
+            for position in range(0, len(body) - block + 1, block):
+                if identifier == b'ETN2':
+                    start, length = struct.unpack('>QQ', body[position:position + 16])
+                else:
+                    start, length = struct.unpack('>II', body[position:position + 8])
+                if length:
+                    sector_size = nero_track_sector_size(descriptor, start, length)
+                    return sector_layout(start, sector_size, raw_data_offset(descriptor, start, sector_size) if sector_size != cooked_sector else 0,
+                                         length // sector_size)
+    raise ValueError(_('No data track found in the Nero image'))
+
+def layout_of(file):
+    image_format = imageformat.detect(file)
+    size = os.stat(file).st_size
+    if image_format.format == 'raw':
+        return sector_layout(0, image_format.sector_size, image_format.data_offset, size // image_format.sector_size)
+    if image_format.format == 'nrg':
+        descriptor = os.open(file, os.O_RDONLY)
+        try:
+            return nero_layout(descriptor, image_format.footer)
+        finally:
+            os.close(descriptor)
+    # Anything else is taken as it is
+    return sector_layout(0, cooked_sector, 0, size // cooked_sector)
+
+def strip(raw, count, layout):
+    # The user data of count stored sectors in raw, as a list of buffers
+    # that concatenate to count * 2048 bytes
+    if layout.is_cooked():
+        return [raw[:count * cooked_sector]]
+    if numpy is not None:
+        sectors = numpy.frombuffer(raw, dtype=numpy.uint8, count=count * layout.sector_size).reshape(count, layout.sector_size)
+        return [numpy.ascontiguousarray(sectors[:, layout.data_offset:layout.data_offset + cooked_sector]).data]
+    start = layout.data_offset
+    step = layout.sector_size
+    return [raw[position:position + cooked_sector] for position in range(start, start + count * step, step)]
+
+class cooked_source():
+    # A read(offset, length) view of the cooked sectors of an image, usable
+    # as an isoreader source
+    def __init__(self, file, layout=None):
+        self.file = file
+        self.layout = layout if layout else layout_of(file)
+        self.size = self.layout.size
+        self.file_stream = open(file, 'rb')
+        self.map = None
+        if os.fstat(self.file_stream.fileno()).st_size:
+            self.map = mmap.mmap(self.file_stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, offset, length):
+        if self.map is None:
+            return b''
+        length = max(min(length, self.size - offset), 0)
+        if not length:
+            return b''
+        layout = self.layout
+        first = offset // cooked_sector
+        last = (offset + length - 1) // cooked_sector
+        start = layout.offset + first * layout.sector_size
+        raw = memoryview(self.map)[start:start + (last - first + 1) * layout.sector_size]
+        try:
+            data = b''.join(strip(raw, last - first + 1, layout))
+        finally:
+            raw.release()
+        skip = offset - first * cooked_sector
+        return data[skip:skip + length]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file_stream.close()
+
+def write_all(descriptor, buffers):
+    # os.writev may write less than asked; finish off with plain writes
+    written = os.writev(descriptor, buffers)
+    total = sum(len(buffer) for buffer in buffers)
+    if written < total:
+        remainder = memoryview(b''.join(buffers))[written:]
+        while remainder:
+            remainder = remainder[os.write(descriptor, remainder):]
+
+def convert(file, output, layout=None, progress=None, cancelled=None):
+    # Write the cooked sectors of file to output as a plain ISO. progress is
+    # called with (sectors done, sectors total). Returns False if cancelled.
+    layout = layout if layout else layout_of(file)
+    temporary = atomicfile.temporary_path(output)
+    source = os.open(file, os.O_RDONLY)
+    target = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        with mmap.mmap(source, 0, access=mmap.ACCESS_READ) as image_map:
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                image_map.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(image_map)
+            try:
+                for first in range(0, layout.count, run_sectors):
+                    if cancelled is not None and cancelled.is_set():
+                        break
+                    count = min(run_sectors, layout.count - first)
+                    start = layout.offset + first * layout.sector_size
+                    raw = view[start:start + count * layout.sector_size]
+                    buffers = strip(raw, count, layout)
+                    write_all(target, buffers)
+                    del buffers
+                    raw.release()
+                    if progress:
+                        progress(first + count, layout.count)
+            finally:
+                view.release()
+        os.close(target)
+        target = None
+        if cancelled is not None and cancelled.is_set():
+            os.remove(temporary)
+            return False
+        os.replace(temporary, output)
+        return True
+    except:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    finally:
+        os.close(source)
+        if target is not None:
+            os.close(target)
+
+def converted_path(file):
+    status = os.stat(file)
+    name = os.path.splitext(os.path.basename(file))[0]
+    return os.path.join(converted_directory, '%s-%d-%d-%d.iso' % (name, status.st_dev, status.st_ino, status.st_mtime_ns))
+
+def needs_conversion(file):
+    # loop_source(file) would have to write a converted copy first
+    return not layout_of(file).is_cooked() and not os.path.exists(converted_path(file))
+
+def loop_source(file):
+    # Returns (file, offset, size) to attach to a loop device. Cooked tracks
+    # are used in place; raw ones are converted once and the ISO reused.
+    layout = layout_of(file)
+    if layout.is_cooked():
+        return file, layout.offset, layout.size
+    output = converted_path(file)
+    with conversion_lock:
+        if not os.path.exists(output):
+            if not os.path.isdir(converted_directory):
+                os.makedirs(converted_directory)
+            convert(file, output, layout)
+    return output, 0, layout.size
+
+def loop_backing_files():
+    # The files behind every loop device in use
+    backing = set()
+    for path in glob.glob('/sys/block/loop*/loop/backing_file'):
+        try:
+            with open(path, 'r') as backing_file:
+                backing.add(backing_file.read().strip())
+        except (IOError, OSError):
+            pass
+    return backing
+
+def release(file):
+    # Remove the converted copy of file once it is no longer mounted. The
+    # caller's own mount list cannot tell whether another mount of the same
+    # image, made elsewhere, still uses the copy; the kernel's loop devices
+    # can, so the copy stays while any of them is backed by it.
+    try:
+        output = converted_path(file)
+    except OSError:
+        return
+    with conversion_lock:
+        if os.path.exists(output) and os.path.realpath(output) not in loop_backing_files():
+            os.remove(output)
@@ -17,47 +17,259 @@
 
 import hashlib
 import os
+import queue
+import threading
+import time
+import zlib
+import chunkio
+import compressedimage
+import hashcache
+import iosched
+import metrics
+import settings
 from gettext import gettext as _
 
-class checksum():
+# Algorithms understood by checksum.compute
+supported_algorithms = ('md5', 'sha1', 'sha256', 'sha512', 'blake2b', 'crc32')
+# Appended to the algorithm name of cached digests of a decompressed image
+decompressed_suffix = '+decompressed'
+
+class crc32():
+    # Minimal hashlib-style wrapper so crc32 can share the digest workers
+    name = 'crc32'
+
     def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self):
+        return '%08x' % (self.value & 0xffffffff)
+
+def new_hash(algorithm):
+    if algorithm == 'crc32':
+        return crc32()
+    if algorithm not in supported_algorithms:
+        raise ValueError(_('Unsupported checksum algorithm: %s') % algorithm)
+    return hashlib.new(algorithm)
+
+class shared_chunk():
+    # A chunk handed to several digest workers; the reader gets its buffer
+    # back once the last worker is done with it
+    def __init__(self, reader, view, token, users):
+        self.reader = reader
+        self.view = view
+        self.token = token
+        self.users = users
+        self.lock = threading.Lock()
+
+    def done(self):
+        with self.lock:
+            self.users -= 1
+            if self.users:
+                return
+        self.reader.release(self.token)
+
+class digest_worker(threading.Thread):
+    # Feeds one algorithm from a queue of chunks. hashlib and zlib release the
+    # GIL on large buffers, so several workers hash the same read in parallel.
+    def __init__(self, algorithm):
+        threading.Thread.__init__(self, daemon=True)
+        self.hash = new_hash(algorithm)
+        self.chunks = queue.Queue()
+        self.error = None
+
+    def run(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            try:
+                if self.error is None:
+                    self.hash.update(chunk.view)
+            except Exception as e:
+                self.error = e
+            finally:
+                chunk.done()
+
+class checksum():
+    def __init__(self, cancelled=None):
+        # cancelled is an optional threading.Event checked before every read
         self.hash = _('Calculating, please wait...')
+        self.hashes = {}
         self.progress = 0.0
+        self.bytes_done = 0
+        self.size = 0
+        self.cancelled = cancelled if cancelled is not None else threading.Event()
 
-    def computemd5(self, file, CHUNK=2**16):
+    def compute(self, file, algorithms=('md5',), strategy=None, buffer_size=None, use_cache=True, cache_mode=None, decompress=None, depth=None):
+        # Read the file once and feed every requested algorithm from the same
+        # buffers. self.hash holds the first algorithm's digest for callers
+        # that only asked for one; self.hashes maps every algorithm to its
+        # digest. Reader strategy, buffer size and count and page cache mode
+        # default to settings.cfg. Compressed images are hashed as the image
+        # they hold unless decompress ([checksum_options] decompress) is False.
+        # Digests of an unchanged file are answered from the checksum cache.
         self.hash = _('Calculating, please wait...')
+        self.hashes = {}
         self.progress = 0.0
+        self.bytes_done = 0
+        started = time.perf_counter()
         try:
-            with open(file, 'rb') as file_stream:
-                hash = hashlib.md5()
-                size = os.stat(file).st_size
-                total = 0
-                for chunk in iter(lambda: file_stream.read(CHUNK), b''):
-                    hash.update(chunk)
-                    total += len(chunk)
-                    self.progress = float(total) / float(size)
-        except IOError:
+            identity = hashcache.file_identity(file)
+        except (IOError, OSError):
             self.hash = _('Error reading file')
+            metrics.record('checksum', time.perf_counter() - started, 'error')
             return
-
+        if decompress is None:
+            decompress = settings.get_boolean('checksum_options', 'decompress', True)
+        try:
+            decompress = decompress and compressedimage.compression_of(file) is not None
+        except (IOError, OSError):
+            decompress = False
+        # Digests of the decompressed image are cached under their own names
+        cache_names = dict((algorithm, algorithm + decompressed_suffix if decompress else algorithm) for algorithm in algorithms)
+        if use_cache:
+            cached = hashcache.lookup(identity, list(cache_names.values()))
+            self.hashes = dict((algorithm, cached[name]) for algorithm, name in cache_names.items() if name in cached)
+        missing = [algorithm for algorithm in algorithms if algorithm not in self.hashes]
+        if missing:
+            computed = self.digest(file, missing, strategy, buffer_size, cache_mode, decompress, depth)
+            if self.cancelled.is_set():
+                self.hashes = {}
+                self.hash = _('No Checksum Generated')
+                metrics.record('checksum', time.perf_counter() - started, 'cancelled', self.bytes_done)
+                return
+            if computed is None:
+                self.hash = _('Error reading file')
+                metrics.record('checksum', time.perf_counter() - started, 'error', self.bytes_done)
+                return
+            self.hashes.update(computed)
+            # Only remember digests of a file that did not change while hashing
+            if use_cache and hashcache.file_identity(file) == identity:
+                hashcache.store(identity, dict((cache_names[algorithm], digest) for algorithm, digest in computed.items()))
+            metrics.record('checksum', time.perf_counter() - started, 'ok', self.bytes_done)
+        else:
+            metrics.record('checksum', time.perf_counter() - started, 'cached')
         self.progress = 1.0
-        self.hash = hash.hexdigest()
+        self.hash = self.hashes[algorithms[0]]
 
-    def computesha1(self, file, CHUNK=2**16):
-        self.hash = _('Calculating, please wait...')
-        self.progress = 0.0
+    def digest(self, file, algorithms, strategy=None, buffer_size=None, cache_mode=None, decompress=False, depth=None):
+        workers = [digest_worker(algorithm) for algorithm in algorithms]
         try:
-            with open(file, 'rb') as file_stream:
-                hash = hashlib.sha1()
-                size = os.stat(file).st_size
-                total = 0
-                for chunk in iter(lambda: file_stream.read(CHUNK), b''):
-                    hash.update(chunk)
-                    total += len(chunk)
-                    self.progress = float(total) / float(size)
-        except IOError:
-            self.hash = _('Error reading file')
-            return
+            with chunkio.open_reader(file, strategy, buffer_size, depth, cache_mode, decompress) as reader:
+                self.size = reader.size
+                for worker in workers:
+                    worker.start()
+                try:
+                    for view, token in reader.chunks():
+                        chunk = shared_chunk(reader, view, token, len(workers))
+                        for worker in workers:
+                            worker.chunks.put(chunk)
+                        self.bytes_done += len(view)
+                        self.progress = reader.fraction(self.bytes_done)
+                        # Stop reading as soon as the job is cancelled
+                        if self.cancelled.is_set():
+                            return None
+                finally:
+                    # Workers must let go of every buffer before the reader closes
+                    for worker in workers:
+                        worker.chunks.put(None)
+                    for worker in workers:
+                        worker.join()
+        except (IOError, OSError, ValueError) + compressedimage.errors:
+            return None
 
-        self.progress = 1.0
-        self.hash = hash.hexdigest()
+        digests = {}
+        for algorithm, worker in zip(algorithms, workers):
+            if worker.error is not None:
+                return None
+            digests[algorithm] = worker.hash.hexdigest()
+        return digests
+
+    def computemd5(self, file, CHUNK=None):
+        self.compute(file, ('md5',), buffer_size=CHUNK)
+
+    def computesha1(self, file, CHUNK=None):
+        self.compute(file, ('sha1',), buffer_size=CHUNK)
+
+class job():
+    # A checksum queued on the I/O scheduler for the image's disk that can be
+    # cancelled and polled for progress, throughput and time remaining
+    def __init__(self, file, algorithms=('md5',), use_cache=True, priority='normal', scheduler=None):
+        self.file = file
+        self.algorithms = algorithms
+        self.use_cache = use_cache
+        self.priority = priority
+        self.scheduler = scheduler if scheduler else iosched.shared()
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self.checksum = checksum(self.cancelled)
+        self.task = None
+        self.started = None
+        self.ended = None
+
+    def start(self):
+        self.task = self.scheduler.submit(self.file, self.run, priority=self.priority,
+                                          description=_('Checksum of %s') % os.path.basename(self.file),
+                                          progress=lambda: self.progress)
+        return self
+
+    def run(self):
+        self.started = time.monotonic()
+        try:
+            self.checksum.compute(self.file, self.algorithms, use_cache=self.use_cache)
+        finally:
+            self.ended = time.monotonic()
+            self.finished.set()
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.task is not None and self.task.cancel():
+            # Still queued, so run() will never be called
+            self.ended = time.monotonic()
+            self.finished.set()
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def is_queued(self):
+        return self.task is not None and self.task.state == 'queued'
+
+    def is_finished(self):
+        return self.finished.is_set()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    @property
+    def progress(self):
+        return self.checksum.progress
+
+    @property
+    def hash(self):
+        return self.checksum.hash
+
+    @property
+    def hashes(self):
+        return self.checksum.hashes
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.ended if self.ended is not None else time.monotonic()) - self.started
+
+    def rate(self):
+        # Bytes per second read so far
+        elapsed = self.elapsed()
+        return self.checksum.bytes_done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        # Seconds remaining, or None until the rate is known. Worked out from
+        # the progress, which for compressed images follows the compressed
+        # file rather than the bytes hashed.
+        progress = self.progress
+        if not progress or not self.rate():
+            return None
+        return self.elapsed() * max(1.0 - progress, 0.0) / progress
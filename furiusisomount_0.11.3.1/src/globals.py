@@ -46,3 +46,6 @@ history_list = os.path.join(settings_directory, 'FuriusMountHistory.txt')
 image_burn_button = os.path.join(image_directory, 'imageburn.png')
 image_checksum_button = os.path.join(image_directory, 'imagechecksum.png')
 settings_file = os.path.join(settings_directory, 'settings.cfg')
+checksum_cache = os.path.join(settings_directory, 'FuriusChecksumCache.sqlite')
+content_index = os.path.join(settings_directory, 'FuriusContentIndex.sqlite')
+metrics_summary = os.path.join(settings_directory, 'FuriusMetrics.json')
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+import time
+from gettext import gettext as _
+import globals
+import log
+import settings
+
+# Persistent digest cache. Entries are keyed by the file's (st_dev, st_ino)
+# and remember the size and mtime_ns the digests were computed for; a lookup
+# that finds a different size or mtime drops the entry. The least recently
+# used files are evicted once the cache holds more than cache_entries files.
+#
+# The cache is an SQLite database like the content index, so a lookup reads
+# one row instead of the whole cache, concurrent verify workers do not wait
+# on each other, and the window and the command line can share it.
+
+default_capacity = 1000
+# Seconds to wait for another process writing the cache
+busy_timeout = 10.0
+
+schema = '''
+CREATE TABLE IF NOT EXISTS files (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    used INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS digests (
+    key TEXT NOT NULL REFERENCES files(key) ON DELETE CASCADE,
+    algorithm TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (key, algorithm)
+);
+CREATE INDEX IF NOT EXISTS files_used ON files(used);
+'''
+
+def file_identity(file):
+    status = os.stat(file)
+    return (status.st_dev, status.st_ino, status.st_size, status.st_mtime_ns)
+
+def identity_key(identity):
+    return '%d:%d' % (identity[0], identity[1])
+
+class cache():
+    def __init__(self, path=None, capacity=None):
+        self.path = path if path else globals.checksum_cache
+        if capacity is None:
+            capacity = settings.get_int('checksum_options', 'cache_entries', default_capacity)
+        self.capacity = max(capacity, 0)
+        self.connection = sqlite3.connect(self.path, timeout=busy_timeout)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def is_current(self, key, identity):
+        # Drops the entry for key if the file changed since it was hashed
+        row = self.connection.execute('SELECT size, mtime_ns FROM files WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return False
+        if row != (identity[2], identity[3]):
+            self.connection.execute('DELETE FROM files WHERE key = ?', (key,))
+            return False
+        return True
+
+    def lookup(self, identity, algorithms):
+        # Returns the cached digests for algorithms, skipping any not cached
+        key = identity_key(identity)
+        with self.connection:
+            if not self.is_current(key, identity):
+                return {}
+            found = dict(self.connection.execute('SELECT algorithm, digest FROM digests WHERE key = ? AND algorithm IN (%s)'
+                                                 % ', '.join('?' * len(algorithms)), [key] + list(algorithms)))
+            if found:
+                self.connection.execute('UPDATE files SET used = ? WHERE key = ?', (time.time_ns(), key))
+        return found
+
+    def store(self, identity, digests):
+        if not self.capacity:
+            return
+        key = identity_key(identity)
+        with self.connection:
+            self.is_current(key, identity)
+            self.connection.execute('INSERT INTO files (key, size, mtime_ns, used) VALUES (?, ?, ?, ?) '
+                                    'ON CONFLICT(key) DO UPDATE SET used = excluded.used',
+                                    (key, identity[2], identity[3], time.time_ns()))
+            self.connection.executemany('INSERT OR REPLACE INTO digests (key, algorithm, digest) VALUES (?, ?, ?)',
+                                        [(key, algorithm, digest) for algorithm, digest in digests.items()])
+            self.connection.execute('DELETE FROM files WHERE key IN (SELECT key FROM files ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                                    (self.capacity,))
+
+def lookup(identity, algorithms):
+    # A missing or damaged cache is simply treated as empty
+    if not os.path.isdir(os.path.dirname(globals.checksum_cache)):
+        return {}
+    try:
+        with cache() as digest_cache:
+            return digest_cache.lookup(identity, algorithms)
+    except sqlite3.Error as e:
+        log.write(globals.mount_log, _('Error reading checksum cache.\nUnexpected error: %s' % str(e)))
+        return {}
+
+def store(identity, digests):
+    if not os.path.isdir(os.path.dirname(globals.checksum_cache)):
+        return
+    try:
+        with cache() as digest_cache:
+            digest_cache.store(identity, digests)
+    except sqlite3.Error as e:
+        log.write(globals.mount_log, _('Error saving checksum cache.\nUnexpected error: %s' % str(e)))
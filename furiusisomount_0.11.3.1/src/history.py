@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import os
+from collections import OrderedDict
+import atomicfile
+import globals
+import settings
+
+# Most recently used images, persisted to FuriusMountHistory.txt with the
+# newest image first.
+#
+# The images are kept in an OrderedDict with the newest last, so promoting an
+# image already listed is O(1). A sorted copy of the names answers prefix
+# queries with a binary search. Keeping that copy sorted makes adding a new
+# image or evicting the oldest O(n), a shift of the list, which for a history
+# of even a few thousand names costs far less than the save that follows.
+# When a storage (a Gtk.ListStore) is attached, each change is applied to it
+# as a single row insert, move or removal instead of rebuilding the list.
+#
+# save() merges with the file under a lock, so images another process (the
+# command line, say) added since the last load or save are kept; images
+# added here become the newest, and ones dropped here stay dropped.
+
+default_size = 10
+
+class history():
+    def __init__(self, path=None, size=None):
+        self.path = path if path else globals.history_list
+        self.size = max(size if size else settings.get_int('history_options', 'size', default_size), 1)
+        self.images = OrderedDict()
+        self.sorted_images = []
+        self.storage = None
+        self.rows = {}
+        # Images in the file as of the last load or save, and images added
+        # here since, oldest first
+        self.saved = set()
+        self.added = []
+
+    def __len__(self):
+        return len(self.images)
+
+    def __iter__(self):
+        # Newest first
+        return reversed(list(self.images))
+
+    def __contains__(self, image_file):
+        return image_file in self.images
+
+    def read(self):
+        # The images in the file, newest last
+        images = OrderedDict()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8', errors='surrogateescape') as history_file:
+                lines = [line.strip() for line in history_file if line.strip()]
+            for image_file in reversed(lines[:self.size]):
+                images[image_file] = None
+                images.move_to_end(image_file)
+        return images
+
+    def load(self):
+        self.replace(self.read())
+        self.saved = set(self.images)
+        self.added = []
+        return self
+
+    def replace(self, images):
+        self.images = images
+        self.sorted_images = sorted(self.images)
+        if self.storage is not None:
+            self.attach(self.storage)
+
+    def save(self):
+        with atomicfile.locked(self.path):
+            merged = self.read()
+            for image_file in list(merged):
+                if image_file in self.saved and image_file not in self.images:
+                    del merged[image_file]
+            for image_file in self.added:
+                if image_file in self.images:
+                    merged[image_file] = None
+                    merged.move_to_end(image_file)
+            while len(merged) > self.size:
+                merged.popitem(last=False)
+            with atomicfile.atomic_write(self.path, encoding='utf-8', errors='surrogateescape') as history_file:
+                history_file.writelines('%s\n' % image_file for image_file in reversed(merged))
+        if list(merged) != list(self.images):
+            self.replace(merged)
+        self.saved = set(merged)
+        self.added = []
+
+    def attach(self, storage):
+        # Fill storage (one column of image names) and keep it in step
+        self.storage = storage
+        storage.clear()
+        self.rows = dict((image_file, storage.append([image_file])) for image_file in self)
+
+    def add(self, image_file):
+        # Make image_file the newest entry, evicting the oldest past size
+        self.added.append(image_file)
+        if image_file in self.images:
+            self.images.move_to_end(image_file)
+            if self.storage is not None:
+                self.storage.move_after(self.rows[image_file], None)
+        else:
+            self.images[image_file] = None
+            bisect.insort(self.sorted_images, image_file)
+            if self.storage is not None:
+                self.rows[image_file] = self.storage.prepend([image_file])
+            while len(self.images) > self.size:
+                self.discard(next(iter(self.images)))
+
+    def discard(self, image_file):
+        if image_file not in self.images:
+            return
+        del self.images[image_file]
+        del self.sorted_images[bisect.bisect_left(self.sorted_images, image_file)]
+        if self.storage is not None:
+            self.storage.remove(self.rows.pop(image_file))
+
+    def matching(self, prefix, limit=None):
+        # Images starting with prefix, in name order
+        matches = []
+        index = bisect.bisect_left(self.sorted_images, prefix)
+        while index < len(self.sorted_images) and self.sorted_images[index].startswith(prefix):
+            matches.append(self.sorted_images[index])
+            if limit and len(matches) >= limit:
+                break
+            index += 1
+        return matches
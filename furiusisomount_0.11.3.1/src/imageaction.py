@@ -16,151 +16,125 @@
 # along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
-import locale
-import gettext
 from gettext import gettext as _
-import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, Gdk, GLib, Pango
 import os
 import subprocess
+import chunkio
+import convert
 import globals
-import filehash
-import time
-import threading
-import messagebox
-import aboutbox
 import log
-from configparser import ConfigParser
+import metrics
+import mountbackend
+import mountengine
+import settings
 
+# Mount, unmount, burn and browse actions. Nothing here depends on Gtk: the
+# storage arguments only need append/remove/clear, so the GUI passes its
+# ListStores and the command line passes plain lists of rows. When a
+# mountregistry is given it is updated and saved alongside the storage;
+# mount_history is a history.history, which keeps any storage attached to it
+# in step by itself.
 
+def mount(image_file, image_storage, mount_history, is_fuse, registry=None):
+    # Mount a single image, raising OSError if the mount could not be confirmed.
+    # This blocks until the mount table confirms it, after converting a raw
+    # image for a loop mount, so the GUI only ever mounts from a worker thread.
+    outcome = mountengine.mount_batch([image_file], is_fuse)[0]
+    return record_mount(outcome, image_storage, mount_history, registry)
 
-def mount(image_file, image_storage, history_storage, history_array, is_fuse):
-    image_name = os.path.basename(image_file)
-
-    # Get the mount root point
-    config = ConfigParser()
+def record_mount(outcome, image_storage, mount_history, registry=None):
+    # Log the result of a mountengine operation and, on success, add the mount
+    # to image_storage and the image to the history. Returns the new row's iter.
+    metrics.record('mount', outcome.duration, 'ok' if outcome.ok else 'error')
+    if not outcome.ok:
+        log.write(globals.mount_log, _('Error mounting image.\nUnexpected error: %s' % (outcome.error)),
+                  operation='mount', image=outcome.image_file, duration=round(outcome.duration, 3), outcome='error')
+        raise OSError(outcome.error)
+    remove_command = mountbackend.get(outcome.backend).unmount_hint(outcome.mount_location)
+    # Write an entry with instructions on how to remove manually if needed
+    log.write(globals.mount_log,
+              _('%s successfully mounted @ %s. If required, run the following commands to remove:\n  :%s\n  :rmdir %s'
+                % (outcome.image_file, outcome.mount_location, remove_command, outcome.mount_location)),
+              operation='mount', image=outcome.image_file, mount_point=outcome.mount_location,
+              duration=round(outcome.duration, 3), outcome='ok')
+    # Add mount point and image to image_storage
+    row = image_storage.append([outcome.mount_location, outcome.image_file, str(outcome.is_fuse)])
     try:
-        config.read(globals.settings_file)
-        mount_root = config.get("mount_options", "mount_point")
-    except:
-        log.write(globals.mount_log, _('Error mounting image.\nUnexpected error: %s' % (sys.exc_info()[0])))
-        log.write(globals.mount_log, _('Defaulting to home directory for mounting.'))
-        mount_root = globals.home_directory
-    # Replace any characters that could screw us up.
-    mount_location = os.path.join(mount_root, image_name.replace(' ', '_'))
-    mount_location = mount_location.replace('.', '_')
-
-    try:
-        # If an image is already mounted this will throw an IOError
-        if os.path.exists(mount_location):
-            os.rmdir(mount_location)
-        os.mkdir(mount_location)
-        if is_fuse:
-            # Mount the image, writing the executed command to the log
-            mount_command = "fuseiso '%s' '%s'" % (image_file, mount_location)
-            log.write(globals.mount_log, mount_command)
-            try:
-                mount_process = subprocess.Popen(mount_command, shell=True)
-                # Write an entry with instructions on how to remove manually if needed
-                log.write(globals.mount_log,
-                          _('%s successfully mounted @ %s. If required, run the following commands to remove:\n  :fusermount -u %s\n  :rmdir %s'
-                            % (image_file, mount_location, mount_location, mount_location)))
-            except:
-                log.write(globals.mount_log, _('Error mounting image.\nUnexpected error: %s' % (sys.exc_info()[0])))
-                raise
-        else:  # loop back
-            mount_command = "gksu -u root \"mount -t auto -o loop '%s' '%s'\"" % (image_file, mount_location)
-            log.write(globals.mount_log, mount_command)
-            try:
-                mount_process = subprocess.Popen(mount_command, shell=True)
-                log.write(globals.mount_log,
-                          _('%s successfully mounted @ %s. If required, run the following commands to remove:\n  :gksu -u root umount %s\n  :rmdir %s'
-                            % (image_file, mount_location, mount_location, mount_location)))
-            except:
-                log.write(globals.mount_log, _('Error mounting image.\nUnexpected error: %s' % (sys.exc_info()[0])))
-                raise
-        # Add mount point and image to image_storage
-        image_storage.append([mount_location, image_file, str(is_fuse)])
-        # Add the image to the history_storage
-        add_item_to_history(image_file, history_storage, history_array)
-    except IOError as e:
-        (errno, strerror) = e.args
-        log.write(globals.mount_log, _('Error mounting image.\nOS error(%s): %s' % (errno, strerror)))
-        raise
+        if registry is not None:
+            registry.add(outcome.mount_location, outcome.image_file, outcome.is_fuse, outcome.backend)
+            registry.save()
+        # Make the image the newest history entry
+        mount_history.add(outcome.image_file)
+        mount_history.save()
     except:
         log.write(globals.mount_log, _('Error mounting image.\nUnexpected error: %s' % (sys.exc_info()[0])))
         raise
+    return row
 
-def add_item_to_history(image_file, history_storage, history_array):
-    # Clear the history_storage
-    history_storage.clear()
-    # If the image already exists in the list, remove it. We'll be adding it
-    # to the top of the list.
-    for string in history_array:
-        if string == image_file:
-            history_array.remove(string)
-    # Add the image to the top
-    history_array.insert(0, image_file)
-    # If we've hit our history length max, drop the last entry
-    if len(history_array) > 10:
-        history_array.remove(history_array[10])
-    # Rebuild the storage
-    try:
-        history_file = open(globals.history_list, 'w')
-        for string in history_array:
-            history_storage.append([string])
-            history_file.write('%s\n' % (string))
-    except IOError as e:
-        (errno, strerror) = e.args
-        log.write(globals.mount_log, _('Error saving history to file.\nOS error(%s): %s' % (errno, strerror)))
-        raise
-    except:
-        log.write(globals.mount_log, _('Error saving history to file\nUnexpected error: %s' % (sys.exc_info()[0])))
-        raise
-    finally:
-        history_file.close()
-
-def unmount(mount_location, is_mounted_image_fuse, image_storage, iter, is_shutdown=False):
+def unmount(mount_location, is_mounted_image_fuse, image_storage, iter, is_shutdown=False, registry=None):
     # If the directory doesn't exist, it may have been
     # unmounted externally so just remove the TreeIter
-    # from the TreeStore
-    try:
-        if os.path.exists(mount_location):
-            if is_mounted_image_fuse == 'True':
-                unmount_command = "fusermount -u '%s'" % (mount_location)
-            else:
-                unmount_command = "gksu -u root \"umount '%s'\"" % (mount_location)
-            log.write(globals.mount_log, unmount_command)
-            unmount_process = subprocess.Popen(unmount_command, shell=True)
-            unmount_process.wait()
-            os.rmdir(mount_location)
-        # The iter should not be removed on shutdown or it will screw up the gtk.TreeModel.foreach function
-        if not is_shutdown:
-            image_storage.remove(iter)
-        log.write(globals.mount_log, _('%s successfully unmounted.' % (mount_location)))
-    except:
-        log.write(globals.mount_log, _('Error unmounting image.\nUnexpected error: %s' % (sys.exc_info()[0])))
-        raise
+    # from the TreeStore. Like mount() this blocks until the mount table
+    # confirms it, so the GUI only ever unmounts from a worker thread.
+    mounted = registry.get(mount_location) if registry is not None else None
+    backend = mounted.backend if mounted is not None else None
+    outcome = mountengine.unmount_batch([(mount_location, is_mounted_image_fuse == 'True', backend)])[0]
+    record_unmount(outcome, image_storage, iter, is_shutdown, registry)
+
+def record_unmount(outcome, image_storage, iter, is_shutdown=False, registry=None):
+    mounted = registry.get(outcome.mount_location) if registry is not None else None
+    image_file = mounted.image_file if mounted is not None else None
+    metrics.record('unmount', outcome.duration, 'ok' if outcome.ok else 'error')
+    if not outcome.ok:
+        log.write(globals.mount_log, _('Error unmounting image.\nUnexpected error: %s' % (outcome.error)),
+                  operation='unmount', image=image_file, mount_point=outcome.mount_location,
+                  duration=round(outcome.duration, 3), outcome='error')
+        raise OSError(outcome.error)
+    if registry is not None:
+        registry.remove(outcome.mount_location)
+        registry.save()
+        # Drop a converted copy made for a loop mount once nothing uses it
+        if image_file is not None and not registry.mounts_of(image_file):
+            convert.release(image_file)
+    # The iter should not be removed on shutdown or it will screw up the gtk.TreeModel.foreach function
+    if not is_shutdown:
+        image_storage.remove(iter)
+    log.write(globals.mount_log, _('%s successfully unmounted.' % (outcome.mount_location)),
+              operation='unmount', image=image_file, mount_point=outcome.mount_location,
+              duration=round(outcome.duration, 3), outcome='ok')
 
 def burn(image_file, is_brasero=True):
+    # Only the launch of the burning program is timed
     try:
-        if is_brasero:
-            burn_command = "brasero --image '%s'" % (image_file)
-        else:
-            burn_command = "nautilus-cd-burner --source-iso='%s'" % (image_file)
-        subprocess.Popen(burn_command, shell=True)
+        with metrics.timed('burn'):
+            if is_brasero:
+                burn_command = "brasero --image '%s'" % (image_file)
+            else:
+                burn_command = "nautilus-cd-burner --source-iso='%s'" % (image_file)
+            subprocess.Popen(burn_command, shell=True)
         log.write(globals.mount_log, burn_command)
     except:
         log.write(globals.mount_log, _('Error burning image.\nUnexpected error: %s' % (sys.exc_info()[0])))
         raise
 
-def browse(mount_location):
+def browse(mount_location, registry=None):
     browse_command = "nautilus --browser '%s'" % (mount_location)
     try:
         if os.path.exists(mount_location):
+            warm(mount_location, registry)
             subprocess.Popen(browse_command, shell=True)
             log.write(globals.mount_log, browse_command)
     except:
         log.write(globals.mount_log, _('Error launching nautilus.\nUnexpected error: %s' % (sys.exc_info()[0])))
         raise
+
+def warm(mount_location, registry=None):
+    # With [mount_options] warm_on_browse set, start reading the image into
+    # the page cache so the file manager finds it there
+    mounted = registry.get(mount_location) if registry is not None else None
+    if mounted is None or not settings.get_boolean('mount_options', 'warm_on_browse', False):
+        return
+    try:
+        chunkio.warm(mounted.image_file)
+    except OSError as e:
+        log.write(globals.mount_log, _('Error reading image ahead.\nOS error(%s): %s' % (e.errno, e.strerror)))
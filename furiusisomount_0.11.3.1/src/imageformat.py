@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import struct
+import threading
+from collections import OrderedDict
+from gettext import gettext as _
+import compressedimage
+import hashcache
+
+# Works out what an image file really is from a few positioned reads rather
+# than from its extension, and which way of mounting it suits it best:
+#
+#   iso9660  CD001 in the volume descriptor at sector 16
+#   udf      BEA01/NSR02/NSR03 in the volume recognition sequence, no ISO9660
+#   raw      2352 (or 2448) byte CD sectors, as in BIN and MDF images
+#   nrg      Nero images, NER5 (v2) or NERO (v1) footer at the end
+#   fat      a filesystem boot sector, as in floppy .img files
+#   filesystem  an ext2/3/4, squashfs, XFS or Btrfs superblock; also any
+#            other .img file, which the original loop mounted with
+#            mount -t auto and so still goes to a loop mount
+#   mbr/gpt  a partitioned disk image, which cannot be mounted as a whole
+#   gzip/xz/zstd  a compressed image; it cannot be mounted, but can be
+#            hashed and listed through compressedimage
+#
+# Raw and Nero images can be loop mounted through convert.loop_source().
+#
+# Verdicts are cached by file identity, so asking again about an unchanged
+# file costs one stat.
+
+cooked_sector = 2048
+raw_sync = b'\x00' + b'\xff' * 10 + b'\x00'
+# (sector size, offset of the user data in a sector)
+raw_layouts = ((2352, 16), (2352, 24), (2448, 16), (2448, 24))
+cache_capacity = 1024
+# (offset, magic, name) of filesystems a loop mount can read whole
+superblocks = (
+    (1080, b'\x53\xef', 'ext2/3/4'),
+    (0, b'hsqs', 'squashfs'),
+    (0, b'XFSB', 'XFS'),
+    (65600, b'_BHRfS_M', 'Btrfs'),
+)
+# Extensions of images that are loop mounted even when not recognised
+loop_extensions = ('.img',)
+
+verdicts = OrderedDict()
+verdicts_lock = threading.Lock()
+
+class verdict():
+    def __init__(self, format, description, backends=(), sector_size=cooked_sector, data_offset=0, footer=None, compression=None):
+        self.format = format
+        self.description = description
+        # Mount methods that can handle the image, best first
+        self.backends = tuple(backends)
+        self.sector_size = sector_size
+        self.data_offset = data_offset
+        # (version, first chunk offset) for Nero images
+        self.footer = footer
+        self.compression = compression
+
+    def is_mountable(self):
+        return bool(self.backends)
+
+    def supports_fuse(self):
+        return 'fuse' in self.backends
+
+    def supports_loop(self):
+        return 'loop' in self.backends
+
+    def is_compressed(self):
+        return self.compression is not None
+
+    def preferred_backend(self):
+        return self.backends[0] if self.backends else None
+
+def read_at(descriptor, offset, length):
+    return os.pread(descriptor, length, offset) if offset >= 0 else b''
+
+def volume_descriptors(descriptor):
+    # Standard identifiers of the volume recognition sequence from sector 16,
+    # which ends at the first sector without a known identifier
+    known = (b'CD001', b'BEA01', b'NSR02', b'NSR03', b'TEA01', b'BOOT2', b'CDW02')
+    identifiers = set()
+    for sector in range(16, 32):
+        identifier = read_at(descriptor, sector * cooked_sector, 6)[1:6]
+        if identifier not in known:
+            break
+        identifiers.add(identifier)
+    return identifiers
+
+def nero_footer(descriptor, size):
+    if size >= 12:
+        tail = read_at(descriptor, size - 12, 12)
+        if tail[:4] == b'NER5':
+            return 2, struct.unpack('>Q', tail[4:])[0]
+        if tail[8:] == b'NERO':
+            return 1, struct.unpack('>I', tail[4:8])[0]
+    return None
+
+def raw_layout(descriptor):
+    for sector_size, data_offset in raw_layouts:
+        header = read_at(descriptor, 16 * sector_size, data_offset + 6)
+        if header[:12] == raw_sync and header[data_offset + 1:data_offset + 6] == b'CD001':
+            return sector_size, data_offset
+    return None
+
+def sniff(descriptor, size):
+    head = read_at(descriptor, 0, 6)
+    for magic, compression in compressedimage.magics:
+        if head.startswith(magic):
+            if not compressedimage.is_supported(compression):
+                return verdict(compression, _('%s compressed image (needs the zstandard module)') % compression)
+            return verdict(compression, _('%s compressed image') % compression, compression=compression)
+
+    footer = nero_footer(descriptor, size)
+    if footer is not None:
+        return verdict('nrg', _('Nero image'), ('fuse', 'loop'), footer=footer)
+
+    identifiers = volume_descriptors(descriptor)
+    if b'CD001' in identifiers:
+        description = _('ISO9660/UDF image') if identifiers & set((b'NSR02', b'NSR03')) else _('ISO9660 image')
+        return verdict('iso9660', description, ('fuse', 'loop'))
+    if identifiers & set((b'NSR02', b'NSR03')):
+        # fuseiso only understands ISO9660
+        return verdict('udf', _('UDF image'), ('loop',))
+
+    layout = raw_layout(descriptor)
+    if layout is not None:
+        return verdict('raw', _('Raw CD image (%d byte sectors)') % layout[0], ('fuse', 'loop'),
+                       sector_size=layout[0], data_offset=layout[1])
+
+    for offset, magic, name in superblocks:
+        if read_at(descriptor, offset, len(magic)) == magic:
+            return verdict('filesystem', _('%s filesystem image') % name, ('loop',))
+
+    boot = read_at(descriptor, 0, 512)
+    if len(boot) == 512 and boot[510:512] == b'\x55\xaa':
+        if boot[54:59] in (b'FAT12', b'FAT16') or boot[82:87] == b'FAT32' or boot[3:11] == b'NTFS    ':
+            return verdict('fat', _('Filesystem image'), ('loop',))
+        if read_at(descriptor, 512, 8) == b'EFI PART' or read_at(descriptor, 4096, 8) == b'EFI PART':
+            return verdict('gpt', _('Partitioned disk image (GPT)'))
+        return verdict('mbr', _('Partitioned disk image (MBR)'))
+    return verdict('unknown', _('Unrecognised image format'))
+
+def detect(file):
+    # Returns the verdict for file, from the cache while it is unchanged
+    identity = hashcache.file_identity(file)
+    with verdicts_lock:
+        cached = verdicts.get(identity)
+        if cached is not None:
+            verdicts.move_to_end(identity)
+            return by_extension(file, cached)
+    descriptor = os.open(file, os.O_RDONLY)
+    try:
+        result = sniff(descriptor, identity[2])
+    finally:
+        os.close(descriptor)
+    with verdicts_lock:
+        verdicts[identity] = result
+        while len(verdicts) > cache_capacity:
+            verdicts.popitem(last=False)
+    return by_extension(file, result)
+
+def by_extension(file, result):
+    # An unrecognised .img is left for mount -t auto to work out, as before
+    # formats were detected; the cache keeps the verdict on the contents
+    if result.format == 'unknown' and file.lower().endswith(loop_extensions):
+        return verdict('filesystem', _('Disk image'), ('loop',))
+    return result
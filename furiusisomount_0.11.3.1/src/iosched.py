@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from gettext import gettext as _
+import settings
+
+# Schedules disk-heavy work (checksums, verification, BIN/NRG conversion)
+# by the device the image lives on. Each device has its own queue and its
+# own limit on how many jobs run at once: [scheduler_options]
+# rotational_limit (default 1, so a spinning disk reads one image at a time
+# instead of seeking between several), solid_state_limit for SSD and NVMe
+# and other_limit for network and virtual filesystems. Jobs on different
+# devices run side by side, and a scheduler may also cap the total.
+#
+# Whether a device spins is read from /sys/dev/block/MAJOR:MINOR, or from
+# the disk a partition belongs to. Filesystems with anonymous device
+# numbers (btrfs, for one) are traced to their block device through
+# /proc/self/mountinfo.
+#
+# Within a device, jobs run by priority ('high', 'normal', 'low') and then in
+# the order they were submitted. A queued job can be cancelled or given a
+# new priority; a running one is left to its own cancellation.
+
+priorities = {'high': 0, 'normal': 1, 'low': 2}
+default_rotational_limit = 1
+default_solid_state_limit = 4
+default_other_limit = 2
+# Finished tasks kept for the queue view
+history_length = 50
+
+def device_of(file):
+    # st_dev of file, or of its directory when it does not exist (yet)
+    for path in (file, os.path.dirname(os.path.abspath(file))):
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            pass
+    return None
+
+def backing_device(device):
+    # The block device behind a filesystem with an anonymous device number
+    if device is None or os.major(device) != 0:
+        return device
+    wanted = '%d:%d' % (os.major(device), os.minor(device))
+    try:
+        with open('/proc/self/mountinfo') as mountinfo:
+            for line in mountinfo:
+                fields = line.split()
+                if len(fields) < 3 or fields[2] != wanted or ' - ' not in line:
+                    continue
+                source = line.split(' - ', 1)[1].split()[1]
+                if source.startswith('/dev/'):
+                    return os.stat(source).st_rdev
+    except (IOError, OSError, IndexError):
+        pass
+    return device
+
+def sysfs_directory(device):
+    if device is None or os.major(device) == 0:
+        return None
+    path = os.path.realpath('/sys/dev/block/%d:%d' % (os.major(device), os.minor(device)))
+    # Partitions have no queue of their own; the disk above them does
+    for directory in (path, os.path.dirname(path)):
+        if os.path.isdir(os.path.join(directory, 'queue')):
+            return directory
+    return None
+
+def is_rotational(device):
+    # True for spinning disks, False for SSD/NVMe, None when unknown
+    directory = sysfs_directory(backing_device(device))
+    if directory is None:
+        return None
+    try:
+        with open(os.path.join(directory, 'queue', 'rotational')) as rotational:
+            return rotational.read().strip() == '1'
+    except (IOError, OSError):
+        return None
+
+def device_name(device):
+    if device is None:
+        return _('unknown')
+    directory = sysfs_directory(backing_device(device))
+    if directory is not None:
+        return os.path.basename(directory)
+    return '%d:%d' % (os.major(device), os.minor(device))
+
+def limit_for(rotational):
+    if rotational:
+        return max(settings.get_int('scheduler_options', 'rotational_limit', default_rotational_limit), 1)
+    if rotational is False:
+        return max(settings.get_int('scheduler_options', 'solid_state_limit', default_solid_state_limit), 1)
+    return max(settings.get_int('scheduler_options', 'other_limit', default_other_limit), 1)
+
+def priority_value(priority):
+    if priority not in priorities:
+        raise ValueError(_('Unknown priority: %s') % priority)
+    return priorities[priority]
+
+class task():
+    # One job waiting for or running on its device. state is 'queued',
+    # 'running', 'done', 'failed' or 'cancelled'.
+    def __init__(self, owner, file, queue, action, args, priority, description, progress):
+        self.owner = owner
+        self.file = file
+        self.device = queue.device
+        self.device_name = queue.name
+        self.action = action
+        self.args = args
+        self.priority = priority
+        self.description = description if description else file
+        self.progress_of = progress
+        self.state = 'queued'
+        self.value = None
+        self.error = None
+        self.finished = threading.Event()
+        self.queued = time.monotonic()
+        self.started = None
+        self.ended = None
+
+    @property
+    def priority_name(self):
+        return next(name for name, value in priorities.items() if value == self.priority)
+
+    def progress(self):
+        if self.state == 'done':
+            return 1.0
+        return self.progress_of() if self.progress_of is not None and self.state == 'running' else 0.0
+
+    def cancel(self):
+        # True when the task was still queued and will now never run
+        return self.owner.cancel(self)
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def result(self, timeout=None):
+        # What action returned, re-raising what it raised
+        if not self.finished.wait(timeout):
+            raise TimeoutError(_('%s has not finished') % self.description)
+        if self.state == 'cancelled':
+            raise InterruptedError(_('%s was cancelled') % self.description)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+class device_queue():
+    def __init__(self, device):
+        self.device = device
+        self.name = device_name(device)
+        self.rotational = is_rotational(device)
+        self.limit = limit_for(self.rotational)
+        self.running = 0
+        # (priority, sequence, task); entries left behind by cancel and
+        # reprioritise are skipped when they come up
+        self.heap = []
+
+    def head(self):
+        while self.heap:
+            priority, sequence, item = self.heap[0]
+            if item.state == 'queued' and item.priority == priority:
+                return self.heap[0]
+            heapq.heappop(self.heap)
+        return None
+
+    def waiting(self):
+        return len(set(id(item) for priority, sequence, item in self.heap if item.state == 'queued'))
+
+class scheduler():
+    def __init__(self, total_limit=None):
+        self.total_limit = total_limit
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.sequence = itertools.count()
+        self.running = 0
+        self.tasks = []
+
+    def submit(self, file, action, *args, priority='normal', description=None, progress=None):
+        # Queue action(*args) on the device holding file
+        value = priority_value(priority)
+        queue = self.queue_for(device_of(file))
+        item = task(self, file, queue, action, args, value, description, progress)
+        with self.lock:
+            heapq.heappush(queue.heap, (value, next(self.sequence), item))
+            self.tasks.append(item)
+            self.dispatch()
+        return item
+
+    def call(self, file, action, *args, priority='normal', description=None):
+        # submit() and wait for the result
+        return self.submit(file, action, *args, priority=priority, description=description).result()
+
+    def queue_for(self, device):
+        # Devices are looked up outside the lock: sysfs reads can be slow
+        with self.lock:
+            queue = self.devices.get(device)
+        if queue is None:
+            queue = device_queue(device)
+            with self.lock:
+                queue = self.devices.setdefault(device, queue)
+        return queue
+
+    def cancel(self, item):
+        with self.lock:
+            if item.state != 'queued':
+                return False
+            item.state = 'cancelled'
+            item.ended = time.monotonic()
+        item.finished.set()
+        return True
+
+    def reprioritise(self, item, priority):
+        # Move a queued task within its device's queue
+        value = priority_value(priority)
+        with self.lock:
+            if item.state != 'queued':
+                return False
+            item.priority = value
+            heapq.heappush(self.devices[item.device].heap, (value, next(self.sequence), item))
+            self.dispatch()
+        return True
+
+    def dispatch(self):
+        # Start the most urgent queued task of any device with a free slot
+        # until the devices or the total limit are full. Called with the lock.
+        while self.total_limit is None or self.running < self.total_limit:
+            heads = [(queue.head(), queue) for queue in self.devices.values() if queue.running < queue.limit]
+            heads = [(head, queue) for head, queue in heads if head is not None]
+            if not heads:
+                return
+            (priority, sequence, item), queue = min(heads, key=lambda pair: pair[0][:2])
+            heapq.heappop(queue.heap)
+            item.state = 'running'
+            item.started = time.monotonic()
+            queue.running += 1
+            self.running += 1
+            threading.Thread(target=self.run, args=(item, queue), daemon=True).start()
+
+    def run(self, item, queue):
+        try:
+            item.value = item.action(*item.args)
+            item.state = 'done'
+        except Exception as e:
+            item.error = e
+            item.state = 'failed'
+        item.ended = time.monotonic()
+        with self.lock:
+            queue.running -= 1
+            self.running -= 1
+            self.forget_finished()
+            self.dispatch()
+        item.finished.set()
+
+    def forget_finished(self):
+        finished = [item for item in self.tasks if item.ended is not None]
+        if len(finished) > history_length:
+            dropped = set(id(item) for item in finished[:len(finished) - history_length])
+            self.tasks = [item for item in self.tasks if id(item) not in dropped]
+
+    def snapshot(self):
+        # Tasks for the queue view: unfinished ones first, in the order they
+        # will run, then the most recent finished ones
+        with self.lock:
+            tasks = list(self.tasks)
+        order = {'running': 0, 'queued': 1}
+        active = sorted((item for item in tasks if item.state in order),
+                        key=lambda item: (order[item.state], item.priority, item.queued))
+        return active + [item for item in reversed(tasks) if item.state not in order]
+
+    def device_summary(self):
+        # (name, rotational, limit, running, waiting) for each device seen
+        with self.lock:
+            return [(queue.name, queue.rotational, queue.limit, queue.running, queue.waiting()) for queue in self.devices.values()]
+
+shared_scheduler = None
+shared_lock = threading.Lock()
+
+def shared():
+    # The scheduler used by everything in this process
+    global shared_scheduler
+    with shared_lock:
+        if shared_scheduler is None:
+            shared_scheduler = scheduler()
+        return shared_scheduler
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import calendar
+import errno
+import io
+import mmap
+import os
+import stat
+import struct
+from gettext import gettext as _
+import compressedimage
+import convert
+import imageformat
+
+# Read-only access to the files inside an ISO9660 image without mounting it.
+#
+# The image is memory-mapped and only the sectors that are needed are touched:
+# the volume descriptors, the path table and the directory extents on the way
+# to the requested path. Rock Ridge names are preferred, then Joliet, then
+# plain ISO9660 names.
+#
+# Images are read through a source object with a size attribute and a
+# read(offset, length) method, so other container formats can present a
+# plain 2048-byte-sector view to the same reader.
+
+sector_size = 2048
+descriptor_start = 16
+joliet_escapes = (b'%/@', b'%/C', b'%/E')
+
+class mapped_source():
+    def __init__(self, file):
+        self.file = file
+        self.file_stream = open(file, 'rb')
+        self.size = os.fstat(self.file_stream.fileno()).st_size
+        self.map = None
+        if self.size:
+            self.map = mmap.mmap(self.file_stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, offset, length):
+        if self.map is None:
+            return b''
+        return self.map[offset:offset + length]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file_stream.close()
+
+class entry():
+    def __init__(self, name, extent, size, flags, mtime):
+        self.name = name
+        self.extent = extent
+        self.size = size
+        self.flags = flags
+        self.mtime = mtime
+        self.mode = None
+        self.link = None
+        self.nlink = 1
+        self.extents = [(extent, size)]
+
+    def is_directory(self):
+        return bool(self.flags & 0x02)
+
+    def is_symlink(self):
+        return self.link is not None
+
+    @property
+    def st_mode(self):
+        if self.mode is not None:
+            return self.mode
+        if self.is_directory():
+            return stat.S_IFDIR | 0o555
+        return stat.S_IFREG | 0o444
+
+    @property
+    def st_size(self):
+        return self.size
+
+    @property
+    def st_mtime(self):
+        return self.mtime
+
+def both_endian_32(data, offset):
+    return struct.unpack_from('<I', data, offset)[0]
+
+def record_time(data, offset):
+    # Seven byte directory record date, with the GMT offset in 15 minute steps
+    year, month, day, hour, minute, second, gmt_offset = struct.unpack_from('<6Bb', data, offset)
+    if not month or not day:
+        return 0
+    try:
+        return calendar.timegm((1900 + year, month, day, hour, minute, second)) - gmt_offset * 15 * 60
+    except (ValueError, OverflowError):
+        return 0
+
+class file_reader(io.RawIOBase):
+    # Read-only, seekable view of one file's extents
+    def __init__(self, source, extents, block_size):
+        io.RawIOBase.__init__(self)
+        self.source = source
+        self.extents = [(extent * block_size, size) for extent, size in extents]
+        self.size = sum(size for extent, size in extents)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        self.position = max(self.position, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        wanted = min(len(view), self.size - self.position)
+        done = 0
+        start = 0
+        for offset, size in self.extents:
+            if wanted <= done:
+                break
+            position = self.position + done
+            if position < start + size:
+                count = min(wanted - done, start + size - position)
+                data = self.source.read(offset + position - start, count)
+                view[done:done + len(data)] = data
+                done += len(data)
+                if len(data) < count:
+                    break
+            start += size
+        self.position += done
+        return done
+
+class image():
+    def __init__(self, file_or_source):
+        if isinstance(file_or_source, (str, bytes, os.PathLike)):
+            # BIN, MDF and NRG images are read through their cooked sectors,
+            # compressed ones through their seek index
+            image_format = imageformat.detect(file_or_source)
+            if image_format.is_compressed():
+                self.source = compressedimage.compressed_source(file_or_source, image_format.compression)
+            else:
+                layout = convert.layout_of(file_or_source)
+                self.source = mapped_source(file_or_source) if layout.is_plain() else convert.cooked_source(file_or_source, layout)
+        else:
+            self.source = file_or_source
+        self.block_size = sector_size
+        self.rock_ridge_skip = None
+        self.joliet = False
+        self.directories = {}
+        self.path_table = {}
+        try:
+            self.read_volume_descriptors()
+        except:
+            # A truncated or non-ISO file must not leave its source open
+            self.source.close()
+            raise
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read_volume_descriptors(self):
+        primary = None
+        supplementary = None
+        for index in range(descriptor_start, descriptor_start + 64):
+            descriptor = self.source.read(index * sector_size, sector_size)
+            if len(descriptor) < sector_size or descriptor[1:6] != b'CD001':
+                break
+            kind = descriptor[0]
+            if kind == 255:
+                break
+            if kind == 1 and primary is None:
+                primary = descriptor
+            elif kind == 2 and supplementary is None and descriptor[88:91] in joliet_escapes:
+                supplementary = descriptor
+        if primary is None:
+            raise ValueError(_('Not an ISO9660 image'))
+
+        self.block_size = struct.unpack_from('<H', primary, 128)[0] or sector_size
+        self.volume_id = primary[40:72].decode('ascii', 'replace').strip()
+        self.root = self.parse_record(primary, 156, False)[0]
+        # Rock Ridge is announced by an SP entry in the root's '.' record
+        self.detect_rock_ridge()
+        if self.rock_ridge_skip is None and supplementary is not None:
+            self.joliet = True
+            self.root = self.parse_record(supplementary, 156, True)[0]
+            self.volume_id = supplementary[40:72].decode('utf-16-be', 'replace').strip()
+            descriptor = supplementary
+        else:
+            descriptor = primary
+        self.root.name = ''
+        if self.rock_ridge_skip is None:
+            self.read_path_table(descriptor)
+
+    def detect_rock_ridge(self):
+        data = self.source.read(self.root.extent * self.block_size, self.block_size)
+        if not data or not data[0]:
+            return
+        length = data[0]
+        name_length = data[32]
+        system_use = 33 + name_length + (1 - name_length % 2)
+        if data[system_use:system_use + 2] == b'SP' and data[system_use + 4:system_use + 6] == b'\xbe\xef':
+            self.rock_ridge_skip = data[system_use + 6]
+
+    def read_path_table(self, descriptor):
+        # The path table lists every directory's extent, so directories can be
+        # found without reading their parents
+        table_size = both_endian_32(descriptor, 132)
+        table_location = both_endian_32(descriptor, 140)
+        data = self.source.read(table_location * self.block_size, table_size)
+        names = []
+        offset = 0
+        while offset + 8 <= len(data):
+            name_length, attribute_length, extent, parent = struct.unpack_from('<BBIH', data, offset)
+            if not name_length:
+                break
+            raw_name = data[offset + 8:offset + 8 + name_length]
+            offset += 8 + name_length + (name_length % 2)
+            if not names:
+                names.append('')
+                self.path_table[''] = extent
+                continue
+            if self.joliet:
+                name = raw_name.decode('utf-16-be', 'replace')
+            else:
+                name = raw_name.decode('ascii', 'replace')
+            if parent < 1 or parent > len(names):
+                break
+            path = (names[parent - 1] + '/' + name).lstrip('/')
+            names.append(path)
+            self.path_table[path] = extent
+
+    def parse_record(self, data, offset, joliet):
+        # Returns (entry, record length) for the directory record at offset
+        length = data[offset]
+        extent = both_endian_32(data, offset + 2)
+        size = both_endian_32(data, offset + 10)
+        mtime = record_time(data, offset + 18)
+        flags = data[offset + 25]
+        name_length = data[offset + 32]
+        raw_name = data[offset + 33:offset + 33 + name_length]
+        if raw_name in (b'\x00', b'\x01'):
+            name = raw_name.decode('ascii')
+        elif joliet:
+            name = raw_name.decode('utf-16-be', 'replace')
+        else:
+            name = raw_name.decode('ascii', 'replace')
+        if not flags & 0x02:
+            name = name.split(';')[0]
+            if name.endswith('.') and not joliet:
+                name = name[:-1]
+        item = entry(name, extent, size, flags, mtime)
+        if self.rock_ridge_skip is not None and not joliet:
+            system_use = offset + 33 + name_length + (1 - name_length % 2) + self.rock_ridge_skip
+            self.parse_rock_ridge(item, data[system_use:offset + length])
+        return item, length
+
+    def parse_rock_ridge(self, item, area):
+        alternate_name = None
+        link_parts = None
+        pending = [area]
+        while pending:
+            area = pending.pop()
+            offset = 0
+            while offset + 4 <= len(area):
+                signature = area[offset:offset + 2]
+                length = area[offset + 2]
+                if length < 4:
+                    break
+                body = area[offset + 4:offset + length]
+                if signature == b'NM':
+                    if body and not body[0] & 0x06:
+                        alternate_name = (alternate_name or b'') + body[1:]
+                elif signature == b'PX' and len(body) >= 8:
+                    item.mode = both_endian_32(body, 0)
+                    item.nlink = both_endian_32(body, 8) if len(body) >= 12 else 1
+                elif signature == b'SL' and body:
+                    link_parts = (link_parts or []) + self.parse_symlink(body[1:])
+                elif signature == b'CE' and len(body) >= 24:
+                    # The system use area continues in another sector
+                    location = both_endian_32(body, 0)
+                    continuation_offset = both_endian_32(body, 8)
+                    continuation_length = both_endian_32(body, 16)
+                    pending.append(self.source.read(location * self.block_size + continuation_offset, continuation_length))
+                elif signature == b'ST':
+                    break
+                offset += length
+        if alternate_name is not None:
+            item.name = alternate_name.decode('utf-8', 'surrogateescape')
+        if link_parts is not None:
+            item.link = '/'.join(link_parts).replace('//', '/') if link_parts != [''] else '/'
+
+    def parse_symlink(self, body):
+        parts = []
+        offset = 0
+        while offset + 2 <= len(body):
+            flags, length = body[offset], body[offset + 1]
+            component = body[offset + 2:offset + 2 + length]
+            if flags & 0x02:
+                parts.append('.')
+            elif flags & 0x04:
+                parts.append('..')
+            elif flags & 0x08:
+                parts.append('')
+            else:
+                parts.append(component.decode('utf-8', 'surrogateescape'))
+            offset += 2 + length
+        return parts
+
+    def read_directory(self, directory):
+        # Returns {name: entry} for a directory, cached by extent
+        if directory.extent in self.directories:
+            return self.directories[directory.extent]
+        data = self.source.read(directory.extent * self.block_size, directory.size)
+        children = {}
+        offset = 0
+        previous = None
+        while offset < len(data):
+            if not data[offset]:
+                # Records never cross a sector boundary; skip the padding
+                offset = (offset // self.block_size + 1) * self.block_size
+                continue
+            item, length = self.parse_record(data, offset, self.joliet)
+            offset += length
+            if item.name in ('\x00', '\x01'):
+                continue
+            if previous is not None and previous.flags & 0x80 and previous.name == item.name:
+                # Multi-extent file: later records continue the same file
+                previous.extents.append((item.extent, item.size))
+                previous.size += item.size
+                previous.flags = item.flags
+                continue
+            children[item.name] = item
+            previous = item
+        self.directories[directory.extent] = children
+        return children
+
+    def lookup(self, path):
+        parts = [part for part in path.split('/') if part and part != '.']
+        key = '/'.join(parts)
+        if key in self.path_table and key:
+            # Directory known from the path table; its size is in its '.' record
+            extent = self.path_table[key]
+            data = self.source.read(extent * self.block_size, 34)
+            item = self.parse_record(data, 0, self.joliet)[0]
+            item.name = parts[-1]
+            return item
+        current = self.root
+        for index, part in enumerate(parts):
+            if not current.is_directory():
+                raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), '/'.join(parts[:index]))
+            children = self.read_directory(current)
+            if part not in children:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+            current = children[part]
+        return current
+
+    def stat(self, path):
+        return self.lookup(path)
+
+    def listdir(self, path='/'):
+        item = self.lookup(path)
+        if not item.is_directory():
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        return sorted(self.read_directory(item))
+
+    def scandir(self, path='/'):
+        item = self.lookup(path)
+        if not item.is_directory():
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        return [child for name, child in sorted(self.read_directory(item).items())]
+
+    def walk(self, path='/'):
+        # Yields (path, entry) for everything below path, depth first
+        pending = [(path.rstrip('/'), self.lookup(path))]
+        while pending:
+            directory_path, directory = pending.pop()
+            for child in sorted(self.read_directory(directory).values(), key=lambda child: child.name, reverse=True):
+                child_path = '%s/%s' % (directory_path, child.name)
+                yield child_path, child
+                if child.is_directory() and not child.is_symlink():
+                    pending.append((child_path, child))
+
+    def open(self, path):
+        item = self.lookup(path)
+        if item.is_directory():
+            raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+        return io.BufferedReader(file_reader(self.source, item.extents, self.block_size))
@@ -15,16 +15,130 @@
 # You should have received a copy of the GNU General Public License
 # along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
 
-import time
+import atexit
 import io
+import json
+import os
+import queue
+import threading
+import time
+import settings
+
+# Log entries are queued and written by one background thread per log file.
+# The thread drains everything queued since its last write and appends it in
+# a single batch, so a burst of messages costs one open and one write. When
+# the file would grow past max_bytes it is rotated to log.1, log.2, ... and
+# only backup_count old files are kept.
+#
+# [log_options] in settings.cfg:
+#   format: text (the original layout) or json (one object per line)
+#   max_bytes: rotation size, 0 to never rotate
+#   backup_count: rotated files to keep
+
+default_format = 'text'
+default_max_bytes = 1024 * 1024
+default_backup_count = 3
+batch_limit = 512
 
-def write(log, message):
-    now = time.asctime(time.localtime())
+writers = {}
+writers_lock = threading.Lock()
+
+def format_text(record):
     log_entry = io.StringIO()
-    log_entry.write(' %s\n' % now)
+    log_entry.write(' %s\n' % time.asctime(time.localtime(record['time'])))
     log_entry.write('    :\n')
-    log_entry.write('    :%s\n' % message)
+    log_entry.write('    :%s\n' % record['message'])
     log_entry.write('-------------------------------\n')
-    with open(log, 'a') as log_object:
-        log_object.write(log_entry.getvalue())
-    log_entry.close()
+    return log_entry.getvalue()
+
+def format_json(record):
+    record = dict(record)
+    record['time'] = time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(record['time']))
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+def backup_path(log, number):
+    return '%s.%d' % (log, number)
+
+def rotate(log, backup_count):
+    if backup_count <= 0:
+        os.remove(log)
+        return
+    if os.path.exists(backup_path(log, backup_count)):
+        os.remove(backup_path(log, backup_count))
+    for number in range(backup_count - 1, 0, -1):
+        if os.path.exists(backup_path(log, number)):
+            os.replace(backup_path(log, number), backup_path(log, number + 1))
+    os.replace(log, backup_path(log, 1))
+
+class writer():
+    def __init__(self, log):
+        self.log = log
+        self.format = format_json if settings.get('log_options', 'format', default_format).strip().lower() == 'json' else format_text
+        self.max_bytes = settings.get_int('log_options', 'max_bytes', default_max_bytes)
+        self.backup_count = settings.get_int('log_options', 'backup_count', default_backup_count)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='log writer', daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        self.queue.put(record)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < batch_limit:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write_batch(''.join(self.format(record) for record in batch))
+            except Exception:
+                # Logging must never take the application down
+                pass
+            finally:
+                for record in batch:
+                    self.queue.task_done()
+
+    def write_batch(self, text):
+        data = text.encode('utf-8', 'surrogateescape')
+        if self.max_bytes > 0:
+            try:
+                if os.path.getsize(self.log) + len(data) > self.max_bytes:
+                    rotate(self.log, self.backup_count)
+            except OSError:
+                pass
+        with open(self.log, 'ab') as log_object:
+            log_object.write(data)
+
+    def flush(self):
+        self.queue.join()
+
+def writer_for(log):
+    with writers_lock:
+        if log not in writers:
+            writers[log] = writer(log)
+        return writers[log]
+
+def write(log, message, **details):
+    # details (operation, image, duration, outcome, ...) are only recorded by
+    # the json format; the text format shows the message as before
+    record = {'time': time.time(), 'message': message}
+    record.update(details)
+    writer_for(log).put(record)
+
+def flush(log=None):
+    # Wait until everything queued so far is on disk
+    with writers_lock:
+        pending = [writers[log]] if log in writers else [] if log else list(writers.values())
+    for log_writer in pending:
+        log_writer.flush()
+
+def delete(log):
+    # Remove a log and its rotated copies
+    flush(log)
+    for path in [log] + [backup_path(log, number) for number in range(1, max(writer_for(log).backup_count, 0) + 1)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+atexit.register(flush)
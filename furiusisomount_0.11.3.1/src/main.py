@@ -10,41 +10,84 @@ gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gdk, GLib, Pango
 import globals
 import filehash
-import time
 import threading
 import messagebox
 import aboutbox
 import log
 import os
 import subprocess
+import convert
 import imageaction
+import mountengine
+import mountregistry
+import history
+import imageformat
+import settings
+import mountwatcher
+import mountlifecycle
+import singleinstance
+import iosched
+import queuewindow
+
+history_match_limit = 50
+# Seconds before looking again for a mount another process is recording
+adoption_retry = 2
+
+def needs_conversion(image):
+    # Whether a loop mount of image has to write a converted copy first
+    try:
+        return convert.needs_conversion(image)
+    except (OSError, ValueError):
+        return False
 
 class MainWindow:
     drop_targets = [('text/plain', 0, 3)]
     
-    def __init__(self, parameter):
+    def __init__(self, images=(), profile=None):
+        # Only what the first frame needs is done here; the history, the
+        # mount list, the mount table watcher and the button images are
+        # loaded from idle callbacks once the window is on screen
+        self.profile = profile
+
         # Localization
         locale.setlocale(locale.LC_ALL, '')
         gettext.textdomain(globals.assembly_name)
         gettext.bindtextdomain(globals.assembly_name, globals.locale_directory)
 
+        self.checksum_job = None
+        self.queue_window = None
+        self.mount_watcher = None
+        self.instance_server = None
+        self.mount_batches = 0
+        self.idle_unmounts_running = False
+
         # Set the Glade file
         self.builder = Gtk.Builder()
         self.builder.add_from_file(globals.application_interface)
+        self.mark('interface')
         self.create_settings_directory()
         self.create_settings_file()
         log.write(globals.mount_log, _('Application started...'))
+        self.mark('settings')
         self.set_storage_lists()
         self.set_history_entry()
         self.set_mounted_image_treeview()
         self.set_icons_and_text()
-        self.load_mount_history()
-        self.load_previously_mounted_images()
+        self.set_mount_method()
+        # Usable straight away, filled in when the deferred steps run
+        self.history = history.history()
+        self.history.attach(self.history_storage)
+        self.registry = mountregistry.registry()
+        # mount point -> Gtk.TreeIter of its row in image_storage; ListStore
+        # iters stay valid while their row exists
+        self.mount_rows = {}
+        self.lifecycle = mountlifecycle.manager(self.registry)
 
         self.builder.connect_signals({
             'button_checksum_clicked': self.button_checksum_clicked,
             'button_browse_clicked': self.button_browse_clicked,
             'button_about_clicked': self.button_about_clicked,
+            'button_queue_clicked': self.button_queue_clicked,
             'button_view_log_clicked': self.button_view_log_clicked,
             'button_delete_log_clicked': self.button_delete_log_clicked,
             'button_mount_clicked': self.button_mount_clicked,
@@ -57,42 +100,179 @@ class MainWindow:
             'treeview_mounted_images_row_activated': self.treeview_mounted_images_row_activated,
             'destroy': self.destroy
         })
-        if parameter:
-            try:
-                imageaction.mount(parameter, self.image_storage, self.history_storage, self.history_array, self.builder.get_object('radiobutton_fuse').get_active())
-            except OSError as e:
-                messagebox.show(self.builder.get_object('main_window'), _('Error mounting image.\nOS error: ') + str(e), Gtk.MessageType.ERROR)
-            except Exception as e:
-                messagebox.show(self.builder.get_object('main_window'), _('Error mounting image.\nUnexpected error: ') + str(e), Gtk.MessageType.ERROR)
+        self.listen_for_instances()
+        self.mark('widgets')
+
+        if self.profile is not None:
+            main_window = self.builder.get_object('main_window')
+            self.first_frame_handler = main_window.connect_after('draw', self.main_window_first_draw)
+        # Idle callbacks run after pending redraws, so one step at a time
+        # keeps the window responsive while they load
+        self.deferred_steps = [
+            ('history', self.load_mount_history),
+            ('mount list', self.load_previously_mounted_images),
+            ('mount table watcher', self.watch_mount_table),
+            ('idle mount check', self.watch_idle_mounts),
+            ('button images', self.set_button_images),
+        ]
+        if images:
+            self.deferred_steps.append(('mount arguments', lambda: self.open_images(images)))
+        GLib.idle_add(self.run_deferred_step)
+
+    def mark(self, phase):
+        if self.profile is not None:
+            self.profile.mark(phase)
+
+    def main_window_first_draw(self, widget, context):
+        widget.disconnect(self.first_frame_handler)
+        self.mark('first frame')
+        return False
+
+    def run_deferred_step(self):
+        phase, step = self.deferred_steps.pop(0)
+        step()
+        self.mark(phase)
+        if self.deferred_steps:
+            return True
+        if self.profile is not None:
+            self.profile.report()
+        return False
+
+    def listen_for_instances(self):
+        # Later launches hand their images to this window instead of
+        # starting a process of their own
+        try:
+            self.instance_server = singleinstance.server()
+            self.instance_server.attach(self.open_images)
+        except (IOError, OSError) as e:
+            log.write(globals.mount_log, _('Error listening for other instances.\nOS error(%s): %s' % (e.errno, e.strerror)))
+
+    def open_images(self, images):
+        # Mount images given on the command line or by another launch
+        self.builder.get_object('main_window').present()
+        mountable = []
+        for image in images:
+            # verify_image may switch the mount method to one the image supports
+            if self.verify_image(image):
+                mountable.append((image, self.builder.get_object('radiobutton_fuse').get_active()))
+        if mountable:
+            self.mount_images(mountable)
 
     # Function definitions for each of the handlers listed above
     def load_previously_mounted_images(self):
-        if os.path.exists(globals.mount_list):
+        # Mounts left by earlier sessions or the command line, checked against
+        # the kernel's mount table so vanished mounts are dropped
+        try:
+            self.registry.load()
+            dropped, adopted = self.registry.reconcile(self.history)
+            if dropped or adopted:
+                self.registry.save()
+            self.sync_mount_rows()
+        except IOError as e:
+            log.write(globals.mount_log, _('Error loading history.\nOS error(%s): %s' % (e.errno, e.strerror)))
+        except Exception as e:
+            log.write(globals.mount_log, _('Error loading history.\nUnexpected error: %s' % str(e)))
+
+    def watch_mount_table(self):
+        # Follow mounts and unmounts made outside the application as they
+        # happen; the watcher only wakes up when the kernel's table changes
+        try:
+            self.mount_watcher = mountwatcher.watcher()
+            self.mount_watcher.attach(self.mount_table_changed)
+        except (IOError, OSError) as e:
+            log.write(globals.mount_log, _('Error watching mount table.\nOS error(%s): %s' % (e.errno, e.strerror)))
+
+    def watch_idle_mounts(self):
+        # Unmount images left idle past idle_timeout, and the least recently
+        # used idle ones beyond max_mounts
+        GLib.timeout_add_seconds(mountlifecycle.check_interval(), self.unmount_idle_mounts)
+
+    def unmount_idle_mounts(self, keep=()):
+        # Picking the mounts to let go scans every process in /proc and
+        # confirming an unmount can take seconds, so both run on a worker
+        # thread. Only mounts shown in the window as of now are picked, and
+        # never those in keep (ones just mounted).
+        if self.idle_unmounts_running:
+            return True
+        self.idle_unmounts_running = True
+        shown = set(self.mount_rows)
+        def unmount_batch():
             try:
-                with open(globals.mount_list, 'r') as file_previous_images:
-                    previous_image_history = file_previous_images.readlines()
-                    for line in previous_image_history:
-                        previous_image = line.strip().split(',')
-                        self.image_storage.append([previous_image[0], previous_image[1], previous_image[2]])
-                os.remove(globals.mount_list)
-            except IOError as e:
-                log.write(globals.mount_log, _('Error loading history.\nOS error(%s): %s' % (e.errno, e.strerror)))
+                expired = [item for item in self.lifecycle.expired(keep=keep) if item.mount_point in shown]
             except Exception as e:
-                log.write(globals.mount_log, _('Error loading history.\nUnexpected error: %s' % str(e)))
+                log.write(globals.mount_log, _('Error checking for idle mounts.\nUnexpected error: %s' % str(e)))
+                expired = []
+            outcomes = mountengine.unmount_batch([(item.mount_point, item.is_fuse, item.backend) for item in expired]) if expired else []
+            GLib.idle_add(self.unmount_idle_mounts_finished, outcomes)
+        threading.Thread(target=unmount_batch, daemon=True).start()
+        return True
+
+    def unmount_idle_mounts_finished(self, outcomes):
+        self.idle_unmounts_running = False
+        for outcome in outcomes:
+            try:
+                # The row goes with the registry entry in sync_mount_rows
+                imageaction.record_unmount(outcome, self.image_storage, None, True, self.registry)
+            except Exception as e:
+                log.write(globals.mount_log, _('Error unmounting idle image.\nUnexpected error: %s' % str(e)))
+                continue
+            log.write(globals.mount_log, _('%s was unmounted after being idle.' % (outcome.mount_location)))
+        self.sync_mount_rows()
+        return False
 
-    def load_mount_history(self):
-        self.history_array = []
-        if os.path.exists(globals.history_list):
+    def mount_table_changed(self, added, removed):
+        self.reconcile_mount_table(adopt=bool(added), save=True)
+        if added:
+            # The command line records a mount just after the kernel lists
+            # it, so look again once it has had time to
+            GLib.timeout_add_seconds(adoption_retry, self.reconcile_mount_table)
+
+    def reconcile_mount_table(self, adopt=True, save=False):
+        # Drop mounts that vanished and, as at startup, adopt mounts of known
+        # images made outside the window, such as by "furiusisomount mount";
+        # saving merges in whatever other processes recorded meanwhile
+        known = set(self.history)
+        try:
+            known.update(self.history.read())
+        except (IOError, OSError):
+            pass
+        dropped, adopted = self.registry.reconcile(known, table=self.mount_watcher.entries(), adopt=adopt)
+        for item in dropped:
+            log.write(globals.mount_log, _('%s was unmounted externally.' % (item.mount_point)))
+            # Tidy the empty mount point left behind
+            try:
+                os.rmdir(item.mount_point)
+            except OSError:
+                pass
+        if save or dropped or adopted:
             try:
-                with open(globals.history_list, 'r') as file_history:
-                    self.mount_history = file_history.readlines()
-                    for line in self.mount_history:
-                        self.history_storage.append([line.strip()])
-                        self.history_array.append(line.strip())
-            except IOError as e:
-                log.write(globals.mount_log, _('Error loading history.\nOS error(%s): %s' % (e.errno, e.strerror)))
+                self.registry.save()
             except Exception as e:
-                log.write(globals.mount_log, _('Error loading history.\nUnexpected error: %s' % str(e)))
+                log.write(globals.mount_log, _('Error saving mount list.\nUnexpected error: %s' % str(e)))
+        self.sync_mount_rows()
+        return False
+
+    def sync_mount_rows(self):
+        # Bring the mounted image list in line with the registry, which a
+        # save may have changed with mounts made or removed by other
+        # processes, such as the command line
+        label_selected_mount_point = self.builder.get_object('label_selected_mount_point')
+        for mount_point in [mount_point for mount_point in self.mount_rows if mount_point not in self.registry]:
+            self.image_storage.remove(self.mount_rows.pop(mount_point))
+            if label_selected_mount_point.get_label() == mount_point:
+                label_selected_mount_point.set_label(_('No Mount Point Selected'))
+                self.builder.get_object('button_unmount').set_sensitive(False)
+        for item in self.registry:
+            if item.mount_point not in self.mount_rows:
+                self.mount_rows[item.mount_point] = self.image_storage.append(item.row())
+
+    def load_mount_history(self):
+        try:
+            self.history.load()
+        except IOError as e:
+            log.write(globals.mount_log, _('Error loading history.\nOS error(%s): %s' % (e.errno, e.strerror)))
+        except Exception as e:
+            log.write(globals.mount_log, _('Error loading history.\nUnexpected error: %s' % str(e)))
 
     def create_settings_directory(self):
         # Create settings directory if not present
@@ -122,28 +302,12 @@ class MainWindow:
         main_window = self.builder.get_object('main_window')
         main_window.set_title(f'{globals.assembly_title} {globals.assembly_version}')
 
-        # Set button images and labels
-        browse_button = self.builder.get_object('button_browse')
-        browse_button.set_image(Gtk.Image.new_from_icon_name("document-open", Gtk.IconSize.MENU))
-        browse_button.set_label(_('Browse...'))
-
-        mount_button = self.builder.get_object('button_mount')
-        mount_button.set_image(Gtk.Image.new_from_icon_name("drive-harddisk", Gtk.IconSize.MENU))
-        mount_button.set_label(_('Mount'))
-
-        checksum_button = self.builder.get_object('button_checksum')
-        checksum_image = Gtk.Image.new_from_file(globals.image_checksum_button)
-        checksum_button.set_image(checksum_image)
-        checksum_button.set_label(_('Checksum'))
-
-        burn_button = self.builder.get_object('button_burn')
-        burn_image = Gtk.Image.new_from_file(globals.image_burn_button)
-        burn_button.set_image(burn_image)
-        burn_button.set_label(_('Burn'))
-
-        unmount_button = self.builder.get_object('button_unmount')
-        unmount_button.set_image(Gtk.Image.new_from_icon_name("process-stop", Gtk.IconSize.MENU))
-        unmount_button.set_label(_('Unmount'))
+        # Set button labels; the images follow in set_button_images
+        self.builder.get_object('button_browse').set_label(_('Browse...'))
+        self.builder.get_object('button_mount').set_label(_('Mount'))
+        self.builder.get_object('button_checksum').set_label(_('Checksum'))
+        self.builder.get_object('button_burn').set_label(_('Burn'))
+        self.builder.get_object('button_unmount').set_label(_('Unmount'))
 
         # Set labels
         self.builder.get_object('button_view_log').set_label(_('View Log'))
@@ -162,6 +326,20 @@ class MainWindow:
         self.builder.get_object('label_selected_mount_point').modify_font(pango_desc)
         self.builder.get_object('label_drag_prompt').modify_font(pango_desc)
 
+    def set_button_images(self):
+        # Theme icons and the images shipped with the application are read
+        # from disk, so they are set after the window has been drawn
+        self.builder.get_object('button_browse').set_image(Gtk.Image.new_from_icon_name("document-open", Gtk.IconSize.MENU))
+        self.builder.get_object('button_mount').set_image(Gtk.Image.new_from_icon_name("drive-harddisk", Gtk.IconSize.MENU))
+        self.builder.get_object('button_checksum').set_image(Gtk.Image.new_from_file(globals.image_checksum_button))
+        self.builder.get_object('button_burn').set_image(Gtk.Image.new_from_file(globals.image_burn_button))
+        self.builder.get_object('button_unmount').set_image(Gtk.Image.new_from_icon_name("process-stop", Gtk.IconSize.MENU))
+
+    def set_mount_method(self):
+        # Start with the method the backend benchmark found fastest
+        if settings.get('mount_options', 'preferred_method', 'fuse').strip() == 'loop':
+            self.builder.get_object('radiobutton_loop').set_active(True)
+
     def set_mounted_image_treeview(self):
         # Set treeview for images
         self.treeview = self.builder.get_object('treeview_mounted_images')
@@ -201,6 +379,14 @@ class MainWindow:
         comboentry_image = self.builder.get_object('comboentry_image')
         comboentry_image.set_model(self.history_storage)
         comboentry_image.set_entry_text_column(0)
+        # Typed text is completed from the history; the completion model is
+        # refilled with the prefix matches so every row in it matches
+        self.history_matches = Gtk.ListStore(str)
+        completion = Gtk.EntryCompletion()
+        completion.set_model(self.history_matches)
+        completion.set_text_column(0)
+        completion.set_match_func(lambda completion, key, iter, data: True, None)
+        comboentry_image.get_child().set_completion(completion)
 
     def set_storage_lists(self):
         # Set storage
@@ -215,40 +401,67 @@ class MainWindow:
     def comboentry_image_changed(self, comboentry):
         if self.builder.get_object('comboentry_image').get_active() != -1:
             self.verify_image()
+        else:
+            self.history_matches.clear()
+            text = comboentry.get_child().get_text()
+            if text:
+                for image_file in self.history.matching(text, history_match_limit):
+                    self.history_matches.append([image_file])
 
     def button_browse_clicked(self, button):
         self.select_and_verify_image()
 
     def button_checksum_clicked(self, button):
-        # Compute the checksum on an independent thread
-        self.abort = False
-        if self.builder.get_object('button_checksum').get_label() == _('Checksum'):
+        # Compute the checksum as a cancellable job on an independent thread
+        if self.checksum_job is None:
             selected_image = self.builder.get_object('label_selected_image').get_label()
-            self.builder.get_object('button_checksum').set_label(_('Cancel'))
-
-            GLib.idle_add(self.gtk_iteration)
-            checksum = filehash.checksum()
-            log.write(globals.mount_log, _('Checksum generation started...'))
             if self.builder.get_object('radiobutton_md5').get_active():
-                threading.Thread(target=checksum.computemd5, args=(selected_image,)).start()
+                algorithm = 'md5'
             else:
-                threading.Thread(target=checksum.computesha1, args=(selected_image,)).start()
-
-            while checksum.hash == _('Calculating, please wait...'):
-                if self.abort:
-                    self.builder.get_object('progressbar_hash').set_text(_('No Checksum Generated'))
-                    self.builder.get_object('progressbar_hash').set_fraction(0)
-                    break
-                GLib.idle_add(self.gtk_iteration)
-                time.sleep(0.1)
-                self.builder.get_object('progressbar_hash').set_fraction(checksum.progress)
-                self.builder.get_object('progressbar_hash').set_text(checksum.hash)
-            if not self.abort:
-                log.write(globals.mount_log, _('%s:%s' % (selected_image, checksum.hash)))
+                algorithm = 'sha1'
+            self.builder.get_object('button_checksum').set_label(_('Cancel'))
+            log.write(globals.mount_log, _('Checksum generation started...'))
+            self.checksum_job = filehash.job(selected_image, (algorithm,)).start()
+            GLib.timeout_add(100, self.update_checksum_progress)
         else:  # Cancel
-            self.abort = True
-            log.write(globals.mount_log, _('Checksum generation aborted!'))
-            self.builder.get_object('button_checksum').set_label(_('Checksum'))
+            self.checksum_job.cancel()
+
+    def update_checksum_progress(self):
+        # Called from the main loop until the checksum job finishes
+        job = self.checksum_job
+        progressbar_hash = self.builder.get_object('progressbar_hash')
+        if job is None:
+            return False
+        if not job.is_finished():
+            progressbar_hash.set_fraction(job.progress)
+            eta = job.eta()
+            if job.is_queued():
+                progressbar_hash.set_text(_('Waiting for other work on the same disk...'))
+            elif eta is None:
+                progressbar_hash.set_text(_('Calculating, please wait...'))
+            else:
+                progressbar_hash.set_text(_('%.1f MB/s, %d:%02d remaining') % (job.rate() / 1e6, eta // 60, eta % 60))
+            return True
+
+        self.checksum_job = None
+        self.builder.get_object('button_checksum').set_label(_('Checksum'))
+        if job.is_cancelled():
+            progressbar_hash.set_text(_('No Checksum Generated'))
+            progressbar_hash.set_fraction(0)
+            log.write(globals.mount_log, _('Checksum generation aborted!'),
+                      operation='checksum', image=job.file, duration=round(job.elapsed(), 3), outcome='cancelled')
+        elif not job.hashes:
+            # job.hash holds the reason, such as an unreadable file
+            progressbar_hash.set_text(job.hash)
+            progressbar_hash.set_fraction(0)
+            log.write(globals.mount_log, _('Error generating checksum of %s.\nUnexpected error: %s' % (job.file, job.hash)),
+                      operation='checksum', image=job.file, duration=round(job.elapsed(), 3), outcome='error', error=job.hash)
+        else:
+            progressbar_hash.set_fraction(job.progress)
+            progressbar_hash.set_text(job.hash)
+            log.write(globals.mount_log, _('%s:%s' % (job.file, job.hash)),
+                      operation='checksum', image=job.file, duration=round(job.elapsed(), 3), outcome='ok')
+        return False
 
     def select_and_verify_image(self):
         if self.select_image():
@@ -288,23 +501,36 @@ class MainWindow:
             self.builder.get_object('button_burn').set_sensitive(False)
             return False
 
-        # Next, ensure it's a supported image
-        if selected_file.lower().endswith(('.iso', '.img', '.bin', '.mdf', '.nrg')):
+        # Next, ensure it's a supported image, judged by its contents
+        try:
+            image_format = imageformat.detect(selected_file)
+        except OSError as e:
+            image_format = imageformat.verdict('unknown', e.strerror)
+        if image_format.is_mountable():
             self.builder.get_object('label_selected_image').set_label(selected_file)
             self.builder.get_object('button_mount').set_sensitive(True)
             self.builder.get_object('button_checksum').set_sensitive(True)
             self.builder.get_object('button_burn').set_sensitive(True)
 
-            # Loop method only supports ISO and IMG, so...
-            if selected_file.lower().endswith(('.iso', '.img')):
-                self.builder.get_object('radiobutton_loop').set_sensitive(True)
-            else:
-                self.builder.get_object('radiobutton_loop').set_sensitive(False)
-                self.builder.get_object('radiobutton_fuse').set_active(True)
+            # Offer only the methods that can mount this format, best first
+            radiobutton_fuse = self.builder.get_object('radiobutton_fuse')
+            radiobutton_loop = self.builder.get_object('radiobutton_loop')
+            radiobutton_fuse.set_sensitive(image_format.supports_fuse())
+            radiobutton_loop.set_sensitive(image_format.supports_loop())
+            if not (radiobutton_fuse if radiobutton_fuse.get_active() else radiobutton_loop).get_sensitive():
+                (radiobutton_fuse if image_format.preferred_backend() == 'fuse' else radiobutton_loop).set_active(True)
 
             return True
 
-        messagebox.show(self.builder.get_object('main_window'), _('File does not appear to be a compatible Image. \nPlease check source.'), Gtk.MessageType.ERROR)
+        if image_format.is_compressed():
+            # Compressed images can be hashed as they are, but not mounted
+            self.builder.get_object('label_selected_image').set_label(selected_file)
+            self.builder.get_object('button_mount').set_sensitive(False)
+            self.builder.get_object('button_checksum').set_sensitive(True)
+            self.builder.get_object('button_burn').set_sensitive(False)
+            return False
+
+        messagebox.show(self.builder.get_object('main_window'), _('File does not appear to be a compatible Image (%s). \nPlease check source.') % image_format.description, Gtk.MessageType.ERROR)
         self.builder.get_object('label_selected_image').set_label(_('No Image Selected'))
         self.builder.get_object('button_mount').set_sensitive(False)
         self.builder.get_object('button_checksum').set_sensitive(False)
@@ -312,31 +538,91 @@ class MainWindow:
         return False
 
     def button_view_log_clicked(self, button):
+        log.flush(globals.mount_log)
         if os.path.exists(globals.mount_log):
             subprocess.Popen(['xdg-open', globals.mount_log])
         else:
             messagebox.show(self.builder.get_object('main_window'), _('%s not found.' % globals.mount_log), Gtk.MessageType.INFO)
 
     def button_delete_log_clicked(self, button):
+        log.flush(globals.mount_log)
         if os.path.exists(globals.mount_log):
             response = messagebox.show(self.builder.get_object('main_window'), _('Are you sure you wish to delete the log?'), Gtk.MessageType.QUESTION, Gtk.ButtonsType.YES_NO)
             if response == Gtk.ResponseType.YES:
                 try:
-                    os.remove(globals.mount_log)
+                    log.delete(globals.mount_log)
                 except OSError as e:
                     log.write(globals.mount_log, _('Error deleting log.\nOS error(%s): %s' % (e.errno, e.strerror)))
                 except Exception as e:
                     log.write(globals.mount_log, _('Error deleting log.\nUnexpected error: %s' % str(e)))
 
     def button_mount_clicked(self, button):
-        try:
-            label_selected_image = self.builder.get_object('label_selected_image').get_label()
-            radiobutton_fuse = self.builder.get_object('radiobutton_fuse').get_active()
-            imageaction.mount(label_selected_image, self.image_storage, self.history_storage, self.history_array, radiobutton_fuse)
-        except OSError as e:
-            messagebox.show(self.builder.get_object('main_window'), _('Error mounting image.\nOS error(%s): %s' % (e.errno, e.strerror)), Gtk.MessageType.ERROR)
-        except Exception as e:
-            messagebox.show(self.builder.get_object('main_window'), _('Error mounting image.\nUnexpected error: %s' % str(e)), Gtk.MessageType.ERROR)
+        # Mounting waits for the mount table, so it runs off the GUI thread
+        # like every other mount; errors are shown when the batch finishes
+        label_selected_image = self.builder.get_object('label_selected_image').get_label()
+        radiobutton_fuse = self.builder.get_object('radiobutton_fuse').get_active()
+        self.mount_images([(label_selected_image, radiobutton_fuse)])
+
+    def mount_images(self, images):
+        # Mount a batch of (image, is fuse) pairs concurrently off the GUI
+        # thread; the results are added to the storage from the main loop.
+        # Loop mounts of BIN, MDF and NRG images convert the whole image
+        # first, after whatever the disk queue is already reading, so none of
+        # this may ever run from a Gtk handler.
+        self.mount_batches += 1
+        self.set_mount_button_busy(_('Mounting...'))
+        def mount_batch():
+            outcomes = []
+            for is_fuse in (True, False):
+                group = [image for image, image_is_fuse in images if image_is_fuse == is_fuse]
+                if not group:
+                    continue
+                if not is_fuse and any(needs_conversion(image) for image in group):
+                    GLib.idle_add(self.set_mount_button_busy, _('Converting...'))
+                outcomes.extend(mountengine.mount_batch(group, is_fuse))
+            GLib.idle_add(self.mount_images_finished, outcomes)
+        threading.Thread(target=mount_batch, daemon=True).start()
+
+    def set_mount_button_busy(self, label):
+        button_mount = self.builder.get_object('button_mount')
+        button_mount.set_label(label)
+        button_mount.set_sensitive(False)
+        return False
+
+    def mount_images_finished(self, outcomes):
+        self.mount_batches -= 1
+        if not self.mount_batches:
+            button_mount = self.builder.get_object('button_mount')
+            button_mount.set_label(_('Mount'))
+            selected_image = self.builder.get_object('label_selected_image').get_label()
+            try:
+                button_mount.set_sensitive(os.path.isfile(selected_image) and imageformat.detect(selected_image).is_mountable())
+            except OSError:
+                button_mount.set_sensitive(False)
+        errors = []
+        for outcome in outcomes:
+            # The mount table watcher may have adopted the mount already
+            adopted = self.mount_rows.pop(outcome.mount_location, None)
+            if adopted is not None:
+                self.image_storage.remove(adopted)
+            try:
+                self.mount_rows[outcome.mount_location] = imageaction.record_mount(outcome, self.image_storage, self.history, self.registry)
+            except Exception as e:
+                errors.append('%s: %s' % (outcome.image_file, str(e)))
+        self.sync_mount_rows()
+        self.mounted([self.registry.get(outcome.mount_location) for outcome in outcomes if outcome.ok])
+        if errors:
+            messagebox.show(self.builder.get_object('main_window'), _('Error mounting image.\nOS error: ') + '\n'.join(errors), Gtk.MessageType.ERROR)
+        return False
+
+    def mounted(self, items):
+        # New mounts count as just used; making room for them may unmount
+        # idle ones if max_mounts is set
+        for item in items:
+            if item is not None:
+                self.lifecycle.touch(item.mount_point)
+        if mountlifecycle.max_mounts():
+            self.unmount_idle_mounts(keep=[item.mount_point for item in items if item is not None])
 
     def treeview_mounted_images_cursor_changed(self, treeview):
         # First get the tree view selection
@@ -350,13 +636,37 @@ class MainWindow:
         self.builder.get_object('button_unmount').set_sensitive(True)
 
     def button_unmount_clicked(self, button):
-        try:
+        # Unmounting waits for the mount table too, so it runs on a worker
+        # thread and the row goes once the result is back on the main loop
+        label_selected_mount_point = self.builder.get_object('label_selected_mount_point').get_label()
+        if label_selected_mount_point not in self.mount_rows:
+            return
+        self.builder.get_object('button_unmount').set_sensitive(False)
+        mounts = [self.unmount_request(label_selected_mount_point, self.is_mounted_image_fuse)]
+        def unmount_batch():
+            outcomes = mountengine.unmount_batch(mounts)
+            GLib.idle_add(self.unmount_images_finished, outcomes)
+        threading.Thread(target=unmount_batch, daemon=True).start()
+
+    def unmount_request(self, mount_point, is_fuse):
+        # (mount point, is fuse, backend) for mountengine.unmount_batch
+        mounted = self.registry.get(mount_point)
+        return (mount_point, is_fuse == 'True', mounted.backend if mounted is not None else None)
+
+    def unmount_images_finished(self, outcomes):
+        errors = []
+        for outcome in outcomes:
+            try:
+                # The row goes with the registry entry in sync_mount_rows
+                imageaction.record_unmount(outcome, self.image_storage, None, True, self.registry)
+            except Exception as e:
+                errors.append(str(e))
+        self.sync_mount_rows()
+        if errors:
             label_selected_mount_point = self.builder.get_object('label_selected_mount_point').get_label()
-            imageaction.unmount(label_selected_mount_point, self.is_mounted_image_fuse, self.image_storage, self.iter)
-            self.builder.get_object('label_selected_mount_point').set_label(_('No Mount Point Selected'))
-            self.builder.get_object('button_unmount').set_sensitive(False)
-        except Exception as e:
-            messagebox.show(self.builder.get_object('main_window'), _('Error unmounting image.\nUnexpected error: %s' % str(e)), Gtk.MessageType.ERROR)
+            self.builder.get_object('button_unmount').set_sensitive(label_selected_mount_point in self.mount_rows)
+            messagebox.show(self.builder.get_object('main_window'), _('Error unmounting image.\nUnexpected error: %s' % '\n'.join(errors)), Gtk.MessageType.ERROR)
+        return False
 
     def button_burn_clicked(self, button):
         try:
@@ -369,8 +679,14 @@ class MainWindow:
     def button_about_clicked(self, button):
         aboutbox.show(self.builder.get_object('main_window'))
 
+    def button_queue_clicked(self, button):
+        if self.queue_window is None:
+            self.queue_window = queuewindow.queue_window(self.builder.get_object('main_window'), iosched.shared())
+        self.queue_window.present()
+
     def treeview_mounted_images_drag_data_recieved(self, widget, context, x, y, selection, info, timestamp):
         files = selection.get_data().decode().split('\n')
+        images = []
         for file in files:
             if not file:
                 continue
@@ -378,49 +694,52 @@ class MainWindow:
             file = file.strip().replace('%20', ' ')
             if file.startswith('file:///') and os.path.isfile(file[7:]):
                 if self.verify_image(file[7:]):
-                    try:
-                        label_selected_image = self.builder.get_object('label_selected_image').get_label()
-                        radiobutton_fuse = self.builder.get_object('radiobutton_fuse').get_active()
-                        imageaction.mount(label_selected_image, self.image_storage, self.history_storage, self.history_array, radiobutton_fuse)
-                    except OSError as e:
-                        messagebox.show(self.builder.get_object('main_window'), _('Error mounting image.\nOS error(%s): %s' % (e.errno, e.strerror)), Gtk.MessageType.ERROR)
-                    except Exception as e:
-                        messagebox.show(self.builder.get_object('main_window'), _('Error mounting image.\nUnexpected error: %s' % str(e)), Gtk.MessageType.ERROR)
+                    radiobutton_fuse = self.builder.get_object('radiobutton_fuse').get_active()
+                    images.append((file[7:], radiobutton_fuse))
+        if images:
+            self.mount_images(images)
 
     def treeview_mounted_images_row_activated(self, treeview, path, column):
         label_selected_mount_point = self.builder.get_object('label_selected_mount_point').get_label()
-        imageaction.browse(label_selected_mount_point)
+        imageaction.browse(label_selected_mount_point, self.registry)
 
     def destroy(self, window):
+        if self.mount_watcher is not None:
+            self.mount_watcher.close()
+        if self.instance_server is not None:
+            self.instance_server.close()
+        # The images the user chose to unmount go in one batch on a worker
+        # thread; the main loop keeps running until it is done
+        self.shutdown_unmounts = []
         self.image_storage.foreach(self.clean_up)
-        log.write(globals.mount_log, _('Application closed!'))
-        Gtk.main_quit()
+        if not self.shutdown_unmounts:
+            self.shutdown_unmounts_finished([])
+            return
+        def unmount_batch():
+            outcomes = mountengine.unmount_batch(self.shutdown_unmounts)
+            GLib.idle_add(self.shutdown_unmounts_finished, outcomes)
+        threading.Thread(target=unmount_batch, daemon=True).start()
 
     def clean_up(self, model, path, iter):
         response = messagebox.show(self.builder.get_object('main_window'), _('%s is still mounted.\nDo you wish to unmount it before exiting?' % model.get_value(iter, 1)), Gtk.MessageType.QUESTION, Gtk.ButtonsType.YES_NO)
         if response == Gtk.ResponseType.YES:
+            self.shutdown_unmounts.append(self.unmount_request(model.get_value(iter, 0), model.get_value(iter, 2)))
+        # Images left mounted stay in the registry file for loading later
+        return False
+
+    def shutdown_unmounts_finished(self, outcomes):
+        for outcome in outcomes:
             try:
-                imageaction.unmount(model.get_value(iter, 0), model.get_value(iter, 2), self.image_storage, iter, True)
+                imageaction.record_unmount(outcome, self.image_storage, None, True, self.registry)
             except Exception as e:
                 log.write(globals.mount_log, _('Error unmounting image.\nUnexpected error: %s' % str(e)))
-        else: # Write the history to file for loading later
-            try:
-                with open(globals.mount_list, 'a') as mount_file:
-                    string = '%s,%s,%s' % (model.get_value(iter, 0), model.get_value(iter, 1), model.get_value(iter, 2))
-                    mount_file.write('%s\n' % string)
-            except IOError as e:
-                log.write(globals.mount_log, _('Error saving unmounted images to file.\nOS error(%s): %s' % (e.errno, e.strerror)))
-            except Exception as e:
-                log.write(globals.mount_log, _('Error saving unmounted images to file\nUnexpected error: %s' % str(e)))
+        log.write(globals.mount_log, _('Application closed!'))
+        Gtk.main_quit()
         return False
 
-def gtk_iteration():
-    while Gtk.events_pending():
-        Gtk.main_iteration_do(False)
+def run(argv, profile=None):
+    app = MainWindow(argv, profile)
+    Gtk.main()
 
 if __name__ == '__main__':
-    parameter = ''
-    if len(sys.argv) > 1:
-        parameter = sys.argv[1]
-    app = MainWindow(parameter)
-    Gtk.main()
+    run(sys.argv[1:])
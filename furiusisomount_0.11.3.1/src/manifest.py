@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from gettext import gettext as _
+import atomicfile
+import settings
+
+# Block manifests stored next to an image as <image>.fmanifest.
+#
+# The image is split into fixed-size blocks, each block is hashed on its own
+# and the block digests are combined into a Merkle root. Blocks are hashed in
+# parallel, a verify that is interrupted keeps its progress in
+# <image>.fmanifest.progress and resumes from there, and a mismatch names the
+# byte ranges of the damaged blocks.
+
+manifest_version = 1
+manifest_suffix = '.fmanifest'
+progress_suffix = '.fmanifest.progress'
+default_block_size = 4 * 2**20
+default_algorithm = 'sha256'
+progress_interval = 2.0
+
+def manifest_path(image_file):
+    return image_file + manifest_suffix
+
+def progress_path(image_file):
+    return image_file + progress_suffix
+
+def block_size_setting():
+    return settings.get_int('checksum_options', 'manifest_block_size', default_block_size)
+
+def worker_count():
+    return max(settings.get_int('checksum_options', 'manifest_workers', os.cpu_count() or 1), 1)
+
+def merkle_root(block_digests, algorithm=default_algorithm):
+    # Leaves and inner nodes are prefixed differently so a leaf can never be
+    # mistaken for an inner node; an odd node is carried up unchanged
+    level = [hashlib.new(algorithm, b'\x00' + bytes.fromhex(digest)).digest() for digest in block_digests]
+    if not level:
+        return hashlib.new(algorithm, b'').hexdigest()
+    while len(level) > 1:
+        following = []
+        for index in range(0, len(level) - 1, 2):
+            following.append(hashlib.new(algorithm, b'\x01' + level[index] + level[index + 1]).digest())
+        if len(level) % 2:
+            following.append(level[-1])
+        level = following
+    return level[0].hex()
+
+def write_json(path, data):
+    with atomicfile.atomic_write(path) as json_file:
+        json.dump(data, json_file)
+
+def ranges(indexes):
+    # [1, 2, 3, 7] -> [[1, 4], [7, 8]]
+    merged = []
+    for index in sorted(indexes):
+        if merged and merged[-1][1] == index:
+            merged[-1][1] = index + 1
+        else:
+            merged.append([index, index + 1])
+    return merged
+
+def expand(index_ranges):
+    indexes = set()
+    for start, end in index_ranges:
+        indexes.update(range(start, end))
+    return indexes
+
+class block_hasher():
+    # Hashes blocks of an open image on a thread pool. pread and hashlib both
+    # release the GIL, so blocks are read and hashed on several cores at once.
+    def __init__(self, image_file, block_size, algorithm, workers=None, cancelled=None):
+        self.image_file = image_file
+        self.block_size = block_size
+        self.algorithm = algorithm
+        self.workers = workers or worker_count()
+        self.cancelled = cancelled if cancelled is not None else threading.Event()
+
+    def hash_block(self, descriptor, index):
+        if self.cancelled.is_set():
+            return index, None
+        data = os.pread(descriptor, self.block_size, index * self.block_size)
+        return index, hashlib.new(self.algorithm, data).hexdigest()
+
+    def run(self, indexes, done):
+        # Calls done(index, digest) for every block as it completes; only
+        # workers * 2 blocks are queued at once to keep memory bounded
+        descriptor = os.open(self.image_file, os.O_RDONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                pending = []
+                for index in indexes:
+                    if self.cancelled.is_set():
+                        break
+                    pending.append(pool.submit(self.hash_block, descriptor, index))
+                    if len(pending) >= self.workers * 2:
+                        done(*pending.pop(0).result())
+                for future in pending:
+                    done(*future.result())
+        finally:
+            os.close(descriptor)
+
+def create(image_file, block_size=None, algorithm=default_algorithm, workers=None, cancelled=None):
+    block_size = block_size or block_size_setting()
+    size = os.stat(image_file).st_size
+    count = (size + block_size - 1) // block_size
+    digests = [None] * count
+
+    def done(index, digest):
+        digests[index] = digest
+
+    hasher = block_hasher(image_file, block_size, algorithm, workers, cancelled)
+    hasher.run(range(count), done)
+    if hasher.cancelled.is_set():
+        return None
+    manifest = {
+        'version': manifest_version,
+        'image': os.path.basename(image_file),
+        'size': size,
+        'block_size': block_size,
+        'algorithm': algorithm,
+        'blocks': digests,
+        'root': merkle_root(digests, algorithm),
+    }
+    write_json(manifest_path(image_file), manifest)
+    return manifest
+
+def load(image_file):
+    with open(manifest_path(image_file), 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('version') != manifest_version:
+        raise ValueError(_('Unsupported manifest version'))
+    if merkle_root(manifest['blocks'], manifest['algorithm']) != manifest['root']:
+        raise ValueError(_('Manifest is damaged: block digests do not match the Merkle root'))
+    return manifest
+
+class verification():
+    def __init__(self, image_file, manifest):
+        self.image_file = image_file
+        self.manifest = manifest
+        self.verified = set()
+        self.damaged = set()
+        self.resumed = 0
+        self.complete = False
+        self.size_mismatch = False
+
+    def damaged_ranges(self):
+        # Byte ranges [start, end) of damaged blocks, adjacent blocks merged
+        block_size = self.manifest['block_size']
+        size = self.manifest['size']
+        return [(start * block_size, min(end * block_size, size)) for start, end in ranges(self.damaged)]
+
+    def is_intact(self):
+        return self.complete and not self.damaged and not self.size_mismatch
+
+def load_progress(image_file, manifest, status):
+    try:
+        with open(progress_path(image_file), 'r') as progress_file:
+            progress = json.load(progress_file)
+    except (IOError, OSError, ValueError):
+        return set(), set()
+    # Progress is only trusted for the same manifest and an unchanged image
+    if (progress.get('root') != manifest['root'] or progress.get('size') != status.st_size
+            or progress.get('mtime_ns') != status.st_mtime_ns):
+        return set(), set()
+    return expand(progress.get('verified', [])), expand(progress.get('damaged', []))
+
+def save_progress(image_file, manifest, status, verified, damaged):
+    write_json(progress_path(image_file), {
+        'root': manifest['root'],
+        'size': status.st_size,
+        'mtime_ns': status.st_mtime_ns,
+        'verified': ranges(verified),
+        'damaged': ranges(damaged),
+    })
+
+def verify(image_file, workers=None, resume=True, cancelled=None, progress=None):
+    # Verify an image against its manifest. progress(done, total) is called as
+    # blocks complete. Returns a verification; complete is False if cancelled.
+    manifest = load(image_file)
+    status = os.stat(image_file)
+    result = verification(image_file, manifest)
+    result.size_mismatch = status.st_size != manifest['size']
+    count = len(manifest['blocks'])
+    if resume:
+        result.verified, result.damaged = load_progress(image_file, manifest, status)
+        result.resumed = len(result.verified) + len(result.damaged)
+    remaining = [index for index in range(count) if index not in result.verified and index not in result.damaged]
+    lock = threading.Lock()
+    last_saved = [time.monotonic()]
+
+    def done(index, digest):
+        if digest is None:
+            return
+        with lock:
+            if digest == manifest['blocks'][index]:
+                result.verified.add(index)
+            else:
+                result.damaged.add(index)
+            if progress:
+                progress(len(result.verified) + len(result.damaged), count)
+            if time.monotonic() - last_saved[0] >= progress_interval:
+                save_progress(image_file, manifest, status, result.verified, result.damaged)
+                last_saved[0] = time.monotonic()
+
+    hasher = block_hasher(image_file, manifest['block_size'], manifest['algorithm'], workers, cancelled)
+    try:
+        hasher.run(remaining, done)
+    finally:
+        result.complete = len(result.verified) + len(result.damaged) == count
+        if result.complete:
+            if os.path.exists(progress_path(image_file)):
+                os.remove(progress_path(image_file))
+        else:
+            save_progress(image_file, manifest, status, result.verified, result.damaged)
+    return result
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import atexit
+import getpass
+import json
+import math
+import os
+import threading
+import time
+from gettext import gettext as _
+import atomicfile
+import globals
+import log
+import settings
+
+# Counts and timings of mount, unmount, burn and checksum operations.
+#
+# record() keeps what happened in this process in memory; flush() adds it to
+# the totals in FuriusMetrics.json under an exclusive lock, so the GUI and any
+# number of command line runs add up instead of overwriting one another, and
+# then writes the totals again as a Prometheus textfile-collector file. The
+# summary lives in the settings directory; the .prom file goes to
+# [metrics_options] textfile_directory (the settings directory by default),
+# which can point at node-exporter's --collector.textfile.directory. Flushes
+# happen flush_interval seconds after the first unflushed record and at exit.
+#
+# Every operation has a count per outcome (ok, error, cancelled, cached), a
+# duration histogram and, where bytes were read, a byte total and a
+# throughput histogram.
+
+summary_version = 1
+metric_prefix = 'furiusisomount'
+duration_buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+throughput_buckets = tuple(rate * 2**20 for rate in (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+default_flush_interval = 10.0
+
+class histogram():
+    def __init__(self, bounds, counts=None, total=0.0):
+        self.bounds = tuple(bounds)
+        # One count per bound plus the +Inf bucket, not cumulative
+        self.counts = list(counts) if counts else [0] * (len(self.bounds) + 1)
+        self.total = total
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the quantile, as Prometheus would
+        # estimate it without interpolation
+        wanted = math.ceil(self.count * fraction)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if wanted and seen >= wanted:
+                return self.bounds[index] if index < len(self.bounds) else None
+        return None
+
+    def as_dict(self):
+        return {'bounds': list(self.bounds), 'counts': self.counts, 'sum': self.total}
+
+    @classmethod
+    def from_dict(cls, data, bounds):
+        # Totals written with other bucket bounds are started afresh
+        if tuple(data.get('bounds', ())) != tuple(bounds) or len(data.get('counts', ())) != len(bounds) + 1:
+            return cls(bounds)
+        return cls(bounds, data['counts'], data.get('sum', 0.0))
+
+class operation_totals():
+    def __init__(self):
+        self.outcomes = {}
+        self.duration = histogram(duration_buckets)
+        self.bytes = 0
+        self.throughput = histogram(throughput_buckets)
+
+    def merge(self, other):
+        for outcome, count in other.outcomes.items():
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + count
+        self.duration.merge(other.duration)
+        self.bytes += other.bytes
+        self.throughput.merge(other.throughput)
+
+    def as_dict(self):
+        count = self.duration.count
+        return {
+            'outcomes': self.outcomes,
+            'count': sum(self.outcomes.values()),
+            'errors': self.outcomes.get('error', 0),
+            'duration_seconds': self.duration.as_dict(),
+            'mean_seconds': self.duration.total / count if count else None,
+            'p95_seconds': self.duration.quantile(0.95),
+            'bytes': self.bytes,
+            'throughput_bytes_per_second': self.throughput.as_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        totals = cls()
+        totals.outcomes = dict((str(outcome), int(count)) for outcome, count in data.get('outcomes', {}).items())
+        totals.duration = histogram.from_dict(data.get('duration_seconds', {}), duration_buckets)
+        totals.bytes = int(data.get('bytes', 0))
+        totals.throughput = histogram.from_dict(data.get('throughput_bytes_per_second', {}), throughput_buckets)
+        return totals
+
+pending = {}
+lock = threading.Lock()
+flush_timer = None
+# Cleared by runs that must not count towards the totals, such as the
+# performance suite
+recording = True
+
+def enabled():
+    return recording and settings.get_boolean('metrics_options', 'enabled', True)
+
+def record(operation, duration, outcome='ok', byte_count=None):
+    # Note one finished operation; byte_count is the amount of data it read
+    global flush_timer
+    if not enabled():
+        return
+    with lock:
+        totals = pending.setdefault(operation, operation_totals())
+        totals.outcomes[outcome] = totals.outcomes.get(outcome, 0) + 1
+        totals.duration.observe(duration)
+        if byte_count:
+            totals.bytes += byte_count
+            if duration > 0:
+                totals.throughput.observe(byte_count / duration)
+        if flush_timer is None:
+            interval = settings.get_float('metrics_options', 'flush_interval', default_flush_interval)
+            flush_timer = threading.Timer(max(interval, 0.0), flush)
+            flush_timer.daemon = True
+            flush_timer.start()
+
+class timed():
+    # with metrics.timed('burn'): ... records the time taken, and an error
+    # if the block raises
+    def __init__(self, operation):
+        self.operation = operation
+        self.byte_count = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        record(self.operation, time.perf_counter() - self.started, 'ok' if kind is None else 'error', self.byte_count)
+        return False
+
+def load_summary(summary_file):
+    try:
+        summary_file.seek(0)
+        data = json.load(summary_file)
+        if data.get('version') != summary_version:
+            return {}
+        return dict((operation, operation_totals.from_dict(totals)) for operation, totals in data.get('operations', {}).items())
+    except (ValueError, TypeError, AttributeError):
+        # A damaged summary is started afresh
+        return {}
+
+def write_atomically(path, text):
+    with atomicfile.atomic_write(path) as output_file:
+        output_file.write(text)
+
+def flush(path=None, textfile_directory=None):
+    # Add everything recorded since the last flush to the shared totals and
+    # rewrite the summary and the textfile. Returns the merged totals.
+    global flush_timer
+    path = path if path else globals.metrics_summary
+    with lock:
+        batch = dict(pending)
+        pending.clear()
+        if flush_timer is not None:
+            flush_timer.cancel()
+            flush_timer = None
+    if not batch:
+        return None
+    if not os.path.isdir(os.path.dirname(path)):
+        return None
+    try:
+        with atomicfile.locked(path):
+            try:
+                with open(path, 'r') as summary_file:
+                    totals = load_summary(summary_file)
+            except (IOError, OSError):
+                totals = {}
+            for operation, recorded in batch.items():
+                totals.setdefault(operation, operation_totals()).merge(recorded)
+            write_atomically(path, json.dumps(summary(totals), indent=1, sort_keys=True) + '\n')
+            directory = textfile_directory if textfile_directory else settings.get('metrics_options', 'textfile_directory', os.path.dirname(path))
+            write_atomically(textfile_path(directory.strip()), prometheus(totals))
+    except (IOError, OSError) as e:
+        log.write(globals.mount_log, _('Error writing metrics.\nOS error(%s): %s' % (e.errno, e.strerror)))
+        return None
+    return totals
+
+def summary(totals):
+    return {
+        'version': summary_version,
+        'updated': time.time(),
+        'operations': dict((operation, recorded.as_dict()) for operation, recorded in totals.items()),
+    }
+
+def textfile_path(directory):
+    # One file per user, so several users can share a collector directory
+    return os.path.join(directory, '%s-%s.prom' % (metric_prefix, getpass.getuser()))
+
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def bound_text(bound):
+    # The shortest text that reads back as exactly bound; '%g' would round
+    # 1048576 to 1.04858e+06
+    return repr(float(bound))
+
+def histogram_lines(name, labels, values):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(values.bounds + ('+Inf',), values.counts):
+        cumulative += count
+        bucket = bound if bound == '+Inf' else bound_text(bound)
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bucket, cumulative))
+    lines.append('%s_sum{%s} %r' % (name, labels, float(values.total)))
+    lines.append('%s_count{%s} %d' % (name, labels, cumulative))
+    return lines
+
+def prometheus(totals):
+    # The text exposition format read by node-exporter's textfile collector
+    user = 'user="%s"' % label_value(getpass.getuser())
+    operations = sorted(totals.items())
+    lines = [
+        '# HELP %s_operations_total Image operations finished, by outcome.' % metric_prefix,
+        '# TYPE %s_operations_total counter' % metric_prefix,
+    ]
+    for operation, recorded in operations:
+        for outcome, count in sorted(recorded.outcomes.items()):
+            lines.append('%s_operations_total{%s,operation="%s",outcome="%s"} %d'
+                         % (metric_prefix, user, label_value(operation), label_value(outcome), count))
+    lines += [
+        '# HELP %s_operation_duration_seconds Time taken by image operations.' % metric_prefix,
+        '# TYPE %s_operation_duration_seconds histogram' % metric_prefix,
+    ]
+    for operation, recorded in operations:
+        lines += histogram_lines('%s_operation_duration_seconds' % metric_prefix,
+                                 '%s,operation="%s"' % (user, label_value(operation)), recorded.duration)
+    lines += [
+        '# HELP %s_operation_bytes_total Bytes read by image operations.' % metric_prefix,
+        '# TYPE %s_operation_bytes_total counter' % metric_prefix,
+    ]
+    for operation, recorded in operations:
+        lines.append('%s_operation_bytes_total{%s,operation="%s"} %d' % (metric_prefix, user, label_value(operation), recorded.bytes))
+    lines += [
+        '# HELP %s_operation_throughput_bytes_per_second Read rate of image operations.' % metric_prefix,
+        '# TYPE %s_operation_throughput_bytes_per_second histogram' % metric_prefix,
+    ]
+    for operation, recorded in operations:
+        if recorded.throughput.count:
+            lines += histogram_lines('%s_operation_throughput_bytes_per_second' % metric_prefix,
+                                     '%s,operation="%s"' % (user, label_value(operation)), recorded.throughput)
+    return '\n'.join(lines) + '\n'
+
+atexit.register(flush)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import abc
+import asyncio
+import os
+import shlex
+import shutil
+from gettext import gettext as _
+import globals
+import log
+import mounttable
+import settings
+
+# The programs that actually mount and unmount images.
+#
+# Every backend mounts either the way fuseiso does ('fuse', the original
+# image, no privileges) or as a loop mount ('loop', a plain ISO view from
+# convert.loop_source). mountengine asks for_kind() which backend to use; the
+# choice comes from [mount_options] fuse_backend / loop_backend, and
+# otherwise the first available backend of that kind in the order below.
+#
+#   fuseiso  fuseiso and fusermount
+#   udisks   udisksctl loop-setup and mount, no password; udisks chooses
+#            the mount point under /media or /run/media
+#   loop     mount -o loop as root, through pkexec (or gksu where it still
+#            exists) unless already running as root
+#   fake     records mounts in memory and runs nothing, for trying out the
+#            rest of the application; only used when chosen in settings.cfg
+
+async def run_process(argv):
+    # Returns (exit status, stdout text, stderr text); a missing program is
+    # reported as 127
+    log.write(globals.mount_log, shlex.join(argv))
+    try:
+        process = await asyncio.create_subprocess_exec(*argv, stdin=asyncio.subprocess.DEVNULL,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE)
+    except OSError as e:
+        return 127, '', '%s: %s' % (argv[0], e.strerror)
+    stdout, stderr = await process.communicate()
+    return process.returncode, stdout.decode(errors='replace').strip(), stderr.decode(errors='replace').strip()
+
+async def run_checked(argv):
+    # Returns stdout, raising OSError with the program's complaint on failure
+    status, stdout, stderr = await run_process(argv)
+    if status != 0:
+        raise OSError(stderr or _('%s exited with status %d') % (argv[0], status))
+    return stdout
+
+class backend(abc.ABC):
+    name = None
+    kind = None
+    programs = ()
+    # Formats from imageformat this backend can mount
+    formats = ()
+    privileged = False
+    chooses_mount_point = False
+
+    def available(self):
+        return all(shutil.which(program) for program in self.programs)
+
+    def capabilities(self):
+        return {
+            'kind': self.kind,
+            'formats': self.formats,
+            'privileged': self.privileged,
+            'chooses_mount_point': self.chooses_mount_point,
+            'available': self.available(),
+        }
+
+    def is_mounted(self, mount_location):
+        return mounttable.is_mounted(mount_location)
+
+    @abc.abstractmethod
+    async def mount(self, image_file, mount_location, offset=0, sizelimit=None):
+        # Mount image_file, returning the mount point actually used
+        pass
+
+    @abc.abstractmethod
+    async def unmount(self, mount_location):
+        pass
+
+    def unmount_hint(self, mount_location):
+        # Command a user can run to remove the mount by hand
+        return 'umount %s' % shlex.quote(mount_location)
+
+class fuseiso_backend(backend):
+    name = 'fuseiso'
+    kind = 'fuse'
+    programs = ('fuseiso', 'fusermount')
+    formats = ('iso9660', 'raw', 'nrg')
+
+    async def mount(self, image_file, mount_location, offset=0, sizelimit=None):
+        await run_checked(['fuseiso', image_file, mount_location])
+        return mount_location
+
+    async def unmount(self, mount_location):
+        await run_checked(['fusermount', '-u', mount_location])
+
+    def unmount_hint(self, mount_location):
+        return 'fusermount -u %s' % shlex.quote(mount_location)
+
+class udisks_backend(backend):
+    name = 'udisks'
+    kind = 'loop'
+    programs = ('udisksctl',)
+    formats = ('iso9660', 'udf', 'raw', 'nrg', 'fat', 'filesystem')
+    chooses_mount_point = True
+
+    async def mount(self, image_file, mount_location, offset=0, sizelimit=None):
+        argv = ['udisksctl', 'loop-setup', '--no-user-interaction', '--read-only', '--file', image_file]
+        if offset or sizelimit:
+            argv += ['--offset', str(offset), '--size', str(sizelimit)]
+        # "Mapped file IMAGE as /dev/loop7."
+        device = (await run_checked(argv)).rstrip('.').split()[-1]
+        try:
+            output = await run_checked(['udisksctl', 'mount', '--no-user-interaction', '--block-device', device])
+        except OSError:
+            # udisks may already have mounted it on its own
+            mounted = [entry.mount_point for entry in mounttable.read() if entry.source == device]
+            if not mounted:
+                await run_process(['udisksctl', 'loop-delete', '--no-user-interaction', '--block-device', device])
+                raise
+            return mounted[0]
+        # "Mounted /dev/loop7 at /media/user/LABEL"
+        return output.split(' at ', 1)[1].rstrip('.') if ' at ' in output else mount_location
+
+    async def unmount(self, mount_location):
+        location = mounttable.normalise(mount_location)
+        devices = [entry.source for entry in mounttable.read() if entry.mount_point == location]
+        if not devices:
+            return
+        await run_checked(['udisksctl', 'unmount', '--no-user-interaction', '--block-device', devices[0]])
+        # Loop devices set up with autoclear are already gone
+        await run_process(['udisksctl', 'loop-delete', '--no-user-interaction', '--block-device', devices[0]])
+
+    def unmount_hint(self, mount_location):
+        return 'udisksctl unmount --block-device $(findmnt -no SOURCE %s)' % shlex.quote(mount_location)
+
+class privileged_loop_backend(backend):
+    name = 'loop'
+    kind = 'loop'
+    programs = ('mount',)
+    formats = ('iso9660', 'udf', 'raw', 'nrg', 'fat', 'filesystem')
+    privileged = True
+
+    def available(self):
+        return backend.available(self) and (os.geteuid() == 0 or bool(shutil.which('pkexec') or shutil.which('gksu')))
+
+    def as_root(self, argv):
+        if os.geteuid() == 0:
+            return argv
+        if shutil.which('pkexec'):
+            return ['pkexec'] + argv
+        return ['gksu', '-u', 'root', shlex.join(argv)]
+
+    async def mount(self, image_file, mount_location, offset=0, sizelimit=None):
+        options = 'loop,ro'
+        if offset or sizelimit:
+            options += ',offset=%d,sizelimit=%d' % (offset, sizelimit)
+        await run_checked(self.as_root(['mount', '-t', 'auto', '-o', options, image_file, mount_location]))
+        return mount_location
+
+    async def unmount(self, mount_location):
+        await run_checked(self.as_root(['umount', mount_location]))
+
+    def unmount_hint(self, mount_location):
+        return shlex.join(self.as_root(['umount', mount_location]))
+
+class fake_backend(backend):
+    name = 'fake'
+    kind = 'fuse'
+    formats = ('iso9660', 'udf', 'raw', 'nrg', 'fat', 'filesystem')
+
+    def __init__(self, kind='fuse', delay=0.0, fail=False):
+        self.kind = kind
+        self.delay = delay
+        self.fail = fail
+        self.mounted = {}
+
+    def is_mounted(self, mount_location):
+        return mount_location in self.mounted
+
+    async def mount(self, image_file, mount_location, offset=0, sizelimit=None):
+        await asyncio.sleep(self.delay)
+        if self.fail or not os.path.exists(image_file):
+            raise OSError(_('%s could not be mounted') % image_file)
+        self.mounted[mount_location] = image_file
+        return mount_location
+
+    async def unmount(self, mount_location):
+        await asyncio.sleep(self.delay)
+        self.mounted.pop(mount_location, None)
+
+backends = dict((item.name, item) for item in (fuseiso_backend(), udisks_backend(), privileged_loop_backend(), fake_backend()))
+default_order = {
+    'fuse': ('fuseiso',),
+    'loop': ('udisks', 'loop'),
+}
+
+def get(name):
+    if name not in backends:
+        raise ValueError(_('Unknown mount backend: %s') % name)
+    return backends[name]
+
+def available(kind=None):
+    return [item for item in backends.values() if item.name != 'fake' and item.available() and kind in (None, item.kind)]
+
+def for_kind(is_fuse):
+    # The configured backend for fuse or loop mounts, else the first one that
+    # is installed, else the first in the default order so the error names it
+    kind = 'fuse' if is_fuse else 'loop'
+    configured = settings.get('mount_options', '%s_backend' % kind, None)
+    if configured:
+        return get(configured.strip())
+    for name in default_order[kind]:
+        if backends[name].available():
+            return backends[name]
+    return backends[default_order[kind][0]]
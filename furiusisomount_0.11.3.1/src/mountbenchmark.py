@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+import tempfile
+import time
+from gettext import gettext as _
+import chunkio
+import imageformat
+import mountbackend
+import mountengine
+import settings
+
+# Measures how fast an image reads through each mount backend: metadata
+# latency (lstat of every entry), sequential throughput (whole files, largest
+# first) and random 4 KiB reads in the largest file. The image is mounted in
+# a temporary directory and unmounted again afterwards. The image's page
+# cache is dropped before each backend so none of them reads what an earlier
+# one left in memory.
+
+sequential_buffer = 2**20
+sequential_limit = 256 * 2**20
+random_block = 4096
+random_reads = 2000
+random_seed = 2008
+
+class measurement():
+    def __init__(self, backend):
+        self.backend = backend
+        self.error = None
+        self.entries = 0
+        self.metadata_latency = None
+        self.sequential_rate = None
+        self.random_rate = None
+        self.random_iops = None
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+def measure_metadata(root, result):
+    files = []
+    elapsed = 0.0
+    for directory, directories, names in os.walk(root):
+        for name in directories + names:
+            path = os.path.join(directory, name)
+            started = time.perf_counter()
+            status = os.lstat(path)
+            elapsed += time.perf_counter() - started
+            result.entries += 1
+            if name in names and status.st_size:
+                files.append((status.st_size, path))
+    if result.entries:
+        result.metadata_latency = elapsed / result.entries
+    return sorted(files, reverse=True)
+
+def measure_sequential(files, result):
+    buffer = bytearray(sequential_buffer)
+    total = 0
+    started = time.perf_counter()
+    for size, path in files:
+        with open(path, 'rb', buffering=0) as image_file:
+            while True:
+                count = image_file.readinto(buffer)
+                if not count:
+                    break
+                total += count
+        if total >= sequential_limit:
+            break
+    elapsed = time.perf_counter() - started
+    if total and elapsed > 0:
+        result.sequential_rate = total / elapsed
+
+def measure_random(files, result):
+    size, path = files[0]
+    blocks = max(size // random_block, 1)
+    generator = random.Random(random_seed)
+    offsets = [generator.randrange(blocks) * random_block for index in range(random_reads)]
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        started = time.perf_counter()
+        for offset in offsets:
+            os.pread(descriptor, random_block, offset)
+        elapsed = time.perf_counter() - started
+    finally:
+        os.close(descriptor)
+    if elapsed > 0:
+        result.random_iops = random_reads / elapsed
+        result.random_rate = random_reads * random_block / elapsed
+
+def run(image_file, backend_name):
+    # Mount image_file with one backend, measure it and unmount it again
+    result = measurement(backend_name)
+    backend = mountbackend.get(backend_name)
+    root = tempfile.mkdtemp(prefix='furiusisomount-benchmark-')
+    try:
+        try:
+            chunkio.drop(image_file)
+        except OSError:
+            # Mounting reports a missing or unreadable image
+            pass
+        outcome = mountengine.mount_batch([image_file], backend.kind == 'fuse', backend=backend_name, root=root)[0]
+        if not outcome.ok:
+            result.error = outcome.error
+            return result
+        try:
+            files = measure_metadata(outcome.mount_location, result)
+            if files:
+                measure_sequential(files, result)
+                measure_random(files, result)
+        finally:
+            unmounted = mountengine.unmount_batch([(outcome.mount_location, outcome.is_fuse, backend_name)])[0]
+            if not unmounted.ok and result.error is None:
+                result.error = unmounted.error
+    finally:
+        # Only ever an empty directory: never delete through a live mount
+        try:
+            os.rmdir(root)
+        except OSError:
+            pass
+    return result
+
+def candidates(image_file):
+    # Installed backends that can mount this image's format
+    image_format = imageformat.detect(image_file)
+    return [backend.name for backend in mountbackend.available()
+            if image_format.format in backend.formats]
+
+def fastest(results):
+    # The backend with the best sequential rate for each kind
+    best = {}
+    for result in results:
+        if result.error is None and result.sequential_rate:
+            kind = mountbackend.get(result.backend).kind
+            if kind not in best or result.sequential_rate > best[kind].sequential_rate:
+                best[kind] = result
+    return best
+
+def apply(results):
+    # Make the fastest backends the defaults in settings.cfg
+    best = fastest(results)
+    for kind, result in best.items():
+        settings.set_option('mount_options', '%s_backend' % kind, result.backend)
+    if best:
+        winner = max(best.values(), key=lambda result: result.sequential_rate)
+        settings.set_option('mount_options', 'preferred_method', mountbackend.get(winner.backend).kind)
+    return best
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+from gettext import gettext as _
+import convert
+import globals
+import iosched
+import log
+import mountbackend
+import settings
+
+# Runs mount and unmount operations concurrently through the backends in
+# mountbackend. Each outcome is confirmed with the backend (for real mounts,
+# the kernel's mount table) before it is reported.
+
+default_parallel = 4
+confirm_timeout = 5.0
+confirm_interval = 0.05
+
+class result():
+    def __init__(self, image_file, mount_location, is_fuse, backend=None):
+        self.image_file = image_file
+        self.mount_location = mount_location
+        self.is_fuse = is_fuse
+        self.backend = backend
+        self.ok = False
+        self.error = None
+        self.duration = 0.0
+
+def mount_root():
+    mount_root = settings.get('mount_options', 'mount_point', None)
+    if mount_root is None:
+        log.write(globals.mount_log, _('Defaulting to home directory for mounting.'))
+        mount_root = globals.home_directory
+    return mount_root
+
+def mount_location_for(image_file, root=None):
+    image_name = os.path.basename(image_file)
+    # Replace any characters that could screw us up.
+    mount_location = os.path.join(root if root else mount_root(), image_name.replace(' ', '_'))
+    return mount_location.replace('.', '_')
+
+def parallel_limit():
+    return max(settings.get_int('mount_options', 'max_parallel_mounts', default_parallel), 1)
+
+def backend_for(outcome):
+    if outcome.backend:
+        return mountbackend.get(outcome.backend)
+    return mountbackend.for_kind(outcome.is_fuse)
+
+def loop_source(image_file):
+    # Converting a BIN or NRG image reads and writes the whole image, so it
+    # waits its turn on the image's disk, ahead of checksums
+    if not convert.needs_conversion(image_file):
+        return convert.loop_source(image_file)
+    return iosched.shared().call(image_file, convert.loop_source, image_file, priority='high',
+                                 description=_('Conversion of %s') % os.path.basename(image_file))
+
+async def wait_for_mount_state(backend, mount_location, mounted, timeout=confirm_timeout):
+    # FUSE daemons may return before the kernel lists the mount, so give the
+    # table a moment to catch up
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        if backend.is_mounted(mount_location) == mounted:
+            return True
+        if loop.time() >= deadline:
+            return False
+        await asyncio.sleep(confirm_interval)
+
+def prepare_mount_location(mount_location):
+    # If an image is already mounted here rmdir fails and the error is reported
+    if os.path.exists(mount_location):
+        os.rmdir(mount_location)
+    os.mkdir(mount_location)
+
+async def mount_now(outcome):
+    try:
+        backend = backend_for(outcome)
+        prepare_mount_location(outcome.mount_location)
+    except ValueError as e:
+        outcome.error = str(e)
+        return outcome
+    except OSError as e:
+        outcome.error = _('OS error(%s): %s') % (e.errno, e.strerror)
+        return outcome
+    outcome.backend = backend.name
+    try:
+        if backend.kind == 'fuse':
+            mount_point = await backend.mount(outcome.image_file, outcome.mount_location)
+        else:
+            # Loop backends get a plain ISO view of raw and Nero images
+            source, offset, size = await asyncio.to_thread(loop_source, outcome.image_file)
+            plain = offset == 0 and size == os.stat(source).st_size
+            mount_point = await backend.mount(source, outcome.mount_location, offset, None if plain else size)
+        if not await wait_for_mount_state(backend, mount_point, True):
+            raise OSError(_('%s did not appear in the mount table') % mount_point)
+    except (OSError, ValueError) as e:
+        outcome.error = str(e)
+        try:
+            os.rmdir(outcome.mount_location)
+        except OSError:
+            pass
+        if backend.kind == 'loop':
+            convert.release(outcome.image_file)
+        return outcome
+    if mount_point != outcome.mount_location:
+        # The backend chose its own mount point
+        os.rmdir(outcome.mount_location)
+        outcome.mount_location = mount_point
+    outcome.ok = True
+    return outcome
+
+async def unmount_now(outcome):
+    try:
+        backend = backend_for(outcome)
+    except ValueError as e:
+        outcome.error = str(e)
+        return outcome
+    outcome.backend = backend.name
+    if backend.is_mounted(outcome.mount_location):
+        try:
+            await backend.unmount(outcome.mount_location)
+        except OSError as e:
+            outcome.error = str(e)
+            return outcome
+        if not await wait_for_mount_state(backend, outcome.mount_location, False):
+            outcome.error = _('%s is still in the mount table') % outcome.mount_location
+            return outcome
+    # If the directory doesn't exist, it may have been unmounted externally;
+    # mount points chosen by the backend are removed by the backend
+    if os.path.exists(outcome.mount_location) and not backend.chooses_mount_point:
+        try:
+            os.rmdir(outcome.mount_location)
+        except OSError as e:
+            outcome.error = _('OS error(%s): %s') % (e.errno, e.strerror)
+            return outcome
+    outcome.ok = True
+    return outcome
+
+async def timed(action, outcome, semaphore):
+    # Run action(outcome) under the semaphore, recording how long it took
+    async with semaphore:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            return await action(outcome)
+        finally:
+            outcome.duration = loop.time() - started
+
+async def mount_one(outcome, semaphore):
+    return await timed(mount_now, outcome, semaphore)
+
+async def unmount_one(outcome, semaphore):
+    return await timed(unmount_now, outcome, semaphore)
+
+async def mount_many(images, is_fuse, limit=None, backend=None, root=None):
+    semaphore = asyncio.Semaphore(limit or parallel_limit())
+    root = root if root else mount_root()
+    outcomes = []
+    reserved = set()
+    for image_file in images:
+        mount_location = mount_location_for(image_file, root)
+        # Two images with the same name in one batch get distinct mount points
+        candidate, suffix = mount_location, 2
+        while candidate in reserved:
+            candidate = '%s_%d' % (mount_location, suffix)
+            suffix += 1
+        reserved.add(candidate)
+        outcomes.append(result(image_file, candidate, is_fuse, backend))
+    return await asyncio.gather(*[mount_one(outcome, semaphore) for outcome in outcomes])
+
+async def unmount_many(mounts, limit=None):
+    # mounts is a sequence of (mount location, is fuse) or (mount location,
+    # is fuse, backend name) tuples
+    semaphore = asyncio.Semaphore(limit or parallel_limit())
+    outcomes = [result(None, *mount) for mount in mounts]
+    return await asyncio.gather(*[unmount_one(outcome, semaphore) for outcome in outcomes])
+
+def mount_batch(images, is_fuse, limit=None, backend=None, root=None):
+    return asyncio.run(mount_many(images, is_fuse, limit, backend, root))
+
+def unmount_batch(mounts, limit=None):
+    return asyncio.run(unmount_many(mounts, limit))
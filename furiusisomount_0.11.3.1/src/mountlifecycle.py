@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import mountbackend
+import settings
+
+# Decides which mounts can go: those nobody has touched for
+# [mount_options] idle_timeout seconds, and, once more than max_mounts images
+# are mounted, the least recently used idle ones. Both are off (0) unless set.
+#
+# A mount is in use while any process has its working directory, root or an
+# open file below the mount point; only processes we may inspect are seen,
+# which for an ordinary user means their own. In-use mounts are never picked.
+# The last access is the later of when the mount was first seen (or touched,
+# as on mounting) and when it was last seen in use; the /proc scan and touch()
+# are the only signals. The root directory's access time is not one: fuseiso
+# and read-only ISO 9660 mounts do not keep it, relatime and noatime hold it
+# back, and reads deeper in the tree never change it.
+#
+# Mounts whose backend would have to ask for a password to unmount them
+# (loop mounts through pkexec) are only ever unmounted when the user asks.
+
+default_check_interval = 60
+
+def idle_timeout():
+    return max(settings.get_float('mount_options', 'idle_timeout', 0), 0)
+
+def max_mounts():
+    return max(settings.get_int('mount_options', 'max_mounts', 0), 0)
+
+def check_interval():
+    return max(settings.get_int('mount_options', 'idle_check_interval', default_check_interval), 1)
+
+def is_below(path, mount_point):
+    return path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+
+def process_references():
+    # Every path a process is using as cwd, root or open file
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        base = os.path.join('/proc', pid)
+        for link in ('cwd', 'root'):
+            try:
+                yield os.readlink(os.path.join(base, link))
+            except OSError:
+                pass
+        try:
+            descriptors = os.listdir(os.path.join(base, 'fd'))
+        except OSError:
+            continue
+        for descriptor in descriptors:
+            try:
+                yield os.readlink(os.path.join(base, 'fd', descriptor))
+            except OSError:
+                pass
+
+def busy_mounts(mount_points):
+    # The subset of mount_points some process is using
+    real = dict((os.path.realpath(mount_point), mount_point) for mount_point in mount_points)
+    busy = set()
+    for path in process_references():
+        if not path.startswith('/'):
+            continue
+        for real_mount_point, mount_point in real.items():
+            if mount_point not in busy and is_below(path, real_mount_point):
+                busy.add(mount_point)
+        if len(busy) == len(real):
+            break
+    return busy
+
+def needs_privileges(item):
+    try:
+        backend = mountbackend.get(item.backend) if item.backend else mountbackend.for_kind(item.is_fuse)
+    except ValueError:
+        return False
+    return backend.privileged and os.geteuid() != 0
+
+class manager():
+    def __init__(self, registry, idle_timeout=None, max_mounts=None):
+        self.registry = registry
+        self.idle_timeout = idle_timeout
+        self.max_mounts = max_mounts
+        self.last_access = {}
+        self.busy = set()
+
+    def touch(self, mount_point, when=None):
+        # Note a use of mount_point the scan cannot see, such as mounting it
+        self.last_access[mount_point] = when if when is not None else time.time()
+
+    def scan(self, now=None):
+        # Refresh which mounts are in use and when each was last accessed
+        now = now if now is not None else time.time()
+        mount_points = [item.mount_point for item in self.registry]
+        self.busy = busy_mounts(mount_points)
+        for mount_point in mount_points:
+            last = self.last_access.get(mount_point, now)
+            if mount_point in self.busy:
+                last = now
+            self.last_access[mount_point] = last
+        for mount_point in list(self.last_access):
+            if mount_point not in self.registry:
+                del self.last_access[mount_point]
+        return now
+
+    def expired(self, now=None, keep=()):
+        # Mounts to unmount now: the idle ones past the timeout, then the
+        # least recently used idle ones until at most max_mounts remain.
+        # Mount points in keep, and mounts that need privileges to unmount,
+        # are treated as in use.
+        timeout = self.idle_timeout if self.idle_timeout is not None else idle_timeout()
+        limit = self.max_mounts if self.max_mounts is not None else max_mounts()
+        if not timeout and not limit:
+            return []
+        now = self.scan(now)
+        idle = sorted((self.last_access[item.mount_point], item.mount_point) for item in self.registry
+                      if item.mount_point not in self.busy and item.mount_point not in keep and not needs_privileges(item))
+        chosen = [mount_point for last, mount_point in idle if timeout and now - last >= timeout]
+        if limit:
+            excess = len(self.registry) - len(chosen) - limit
+            for last, mount_point in idle:
+                if excess <= 0:
+                    break
+                if mount_point not in chosen:
+                    chosen.append(mount_point)
+                    excess -= 1
+        return [self.registry.get(mount_point) for mount_point in chosen]
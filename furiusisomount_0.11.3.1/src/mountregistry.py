@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import os
+import atomicfile
+import globals
+import mounttable
+
+# The images this application has mounted, persisted to FuriusMountList.csv.
+#
+# Mounts are indexed by mount point and by image file. reconcile() compares
+# the registry with the kernel's mount table in one pass: entries whose mount
+# point is gone are dropped, and fuseiso or loop mounts of known images that
+# the registry does not list yet are adopted.
+#
+# The window and the command line may both have the list open, so save()
+# merges with the file under a lock instead of overwriting it: mounts
+# another process recorded since this registry last loaded or saved are
+# taken in, and ones it removed are let go.
+
+class mount():
+    def __init__(self, mount_point, image_file, is_fuse, backend=None):
+        self.mount_point = mount_point
+        self.image_file = image_file
+        self.is_fuse = is_fuse
+        # The mountbackend name, None for the default of its kind
+        self.backend = backend
+
+    def row(self):
+        # The [mount point, image, fuse] row shown in the mounted image list
+        return [self.mount_point, self.image_file, str(self.is_fuse)]
+
+class registry():
+    def __init__(self, path=None):
+        self.path = path if path else globals.mount_list
+        self.by_mount_point = {}
+        self.by_image = {}
+        # Mount points in the file as of the last load or save
+        self.saved = set()
+
+    def __len__(self):
+        return len(self.by_mount_point)
+
+    def __iter__(self):
+        return iter(list(self.by_mount_point.values()))
+
+    def __contains__(self, mount_point):
+        return mount_point in self.by_mount_point
+
+    def get(self, mount_point):
+        return self.by_mount_point.get(mount_point)
+
+    def mounts_of(self, image_file):
+        return [self.by_mount_point[mount_point] for mount_point in self.by_image.get(image_file, ())]
+
+    def add(self, mount_point, image_file, is_fuse, backend=None):
+        self.remove(mount_point)
+        item = mount(mount_point, image_file, is_fuse, backend)
+        self.by_mount_point[mount_point] = item
+        self.by_image.setdefault(image_file, set()).add(mount_point)
+        return item
+
+    def remove(self, mount_point):
+        item = self.by_mount_point.pop(mount_point, None)
+        if item is not None:
+            mount_points = self.by_image.get(item.image_file)
+            mount_points.discard(mount_point)
+            if not mount_points:
+                del self.by_image[item.image_file]
+        return item
+
+    def read(self):
+        # The mounts in the file, by mount point
+        items = {}
+        if not os.path.exists(self.path):
+            return items
+        with open(self.path, 'r', newline='', encoding='utf-8', errors='surrogateescape') as mount_file:
+            for fields in csv.reader(mount_file):
+                if len(fields) >= 3:
+                    items[fields[0]] = mount(fields[0], fields[1], fields[2] == 'True', fields[3] if len(fields) > 3 and fields[3] else None)
+        return items
+
+    def load(self):
+        self.by_mount_point = {}
+        self.by_image = {}
+        for item in self.read().values():
+            self.add(item.mount_point, item.image_file, item.is_fuse, item.backend)
+        self.saved = set(self.by_mount_point)
+        return self
+
+    def save(self):
+        # Returns (learned, forgotten): the mounts other processes added and
+        # removed since the last load or save
+        with atomicfile.locked(self.path):
+            on_disk = self.read()
+            learned = [self.add(item.mount_point, item.image_file, item.is_fuse, item.backend)
+                       for mount_point, item in on_disk.items()
+                       if mount_point not in self.saved and mount_point not in self.by_mount_point]
+            forgotten = [self.remove(item.mount_point) for item in self
+                         if item.mount_point in self.saved and item.mount_point not in on_disk]
+            with atomicfile.atomic_write(self.path, newline='', encoding='utf-8', errors='surrogateescape') as mount_file:
+                writer = csv.writer(mount_file)
+                for item in self.by_mount_point.values():
+                    writer.writerow(item.row() + [item.backend or ''])
+            self.saved = set(self.by_mount_point)
+        return learned, forgotten
+
+    def reconcile(self, known_images=(), table=None, adopt=True):
+        # Returns (dropped, adopted) lists of mounts
+        if table is None:
+            table = mounttable.read()
+        mounted = dict((entry.mount_point, entry) for entry in table)
+        dropped = [item for item in self if mounttable.normalise(item.mount_point) not in mounted
+                   and item.mount_point not in mounted]
+        for item in dropped:
+            self.remove(item.mount_point)
+        if not adopt:
+            return dropped, []
+
+        known = set(known_images) | set(self.by_image)
+        known_mount_points = set(mounttable.normalise(item.mount_point) for item in self)
+        adopted = []
+        fuseiso_images = None
+        for entry in table:
+            if entry.mount_point in known_mount_points:
+                continue
+            image_file = None
+            is_fuse = False
+            if entry.fstype.startswith('fuse') and 'fuseiso' in (entry.source, entry.fstype[5:]):
+                if fuseiso_images is None:
+                    fuseiso_images = fuseiso_mounts()
+                image_file = fuseiso_images.get(entry.mount_point)
+                is_fuse = True
+            elif entry.source.startswith('/dev/loop'):
+                image_file = loop_backing_file(entry.source)
+            if image_file is not None and image_file in known:
+                adopted.append(self.add(entry.mount_point, image_file, is_fuse))
+        return dropped, adopted
+
+def loop_backing_file(device):
+    name = os.path.basename(device)
+    try:
+        with open('/sys/block/%s/loop/backing_file' % name, 'r') as backing_file:
+            return backing_file.read().strip()
+    except (IOError, OSError):
+        return None
+
+def fuseiso_mounts():
+    # Maps mount point -> image for every running fuseiso process
+    mounts = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/%s/cmdline' % pid, 'rb') as cmdline:
+                argv = [argument.decode('utf-8', 'surrogateescape') for argument in cmdline.read().split(b'\0') if argument]
+            if not argv or os.path.basename(argv[0]) != 'fuseiso':
+                continue
+            cwd = os.readlink('/proc/%s/cwd' % pid)
+        except (IOError, OSError):
+            continue
+        positional = []
+        skip = False
+        for argument in argv[1:]:
+            if skip:
+                skip = False
+            elif argument == '-o':
+                skip = True
+            elif not argument.startswith('-'):
+                positional.append(os.path.normpath(os.path.join(cwd, argument)))
+        if len(positional) >= 2:
+            mounts[mounttable.normalise(positional[1])] = positional[0]
+    return mounts
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+
+# Reader for the kernel's mount table in /proc/self/mountinfo
+
+mountinfo = '/proc/self/mountinfo'
+octal_escape = re.compile(r'\\([0-7]{3})')
+
+class mount_entry():
+    def __init__(self, fields):
+        separator = fields.index('-')
+        self.mount_id = int(fields[0])
+        self.parent_id = int(fields[1])
+        self.device = fields[2]
+        self.root = unescape(fields[3])
+        self.mount_point = unescape(fields[4])
+        self.options = fields[5]
+        self.fstype = fields[separator + 1]
+        self.source = unescape(fields[separator + 2])
+        self.super_options = fields[separator + 3] if len(fields) > separator + 3 else ''
+
+def unescape(field):
+    # Spaces, tabs, newlines and backslashes are written as octal escapes
+    return octal_escape.sub(lambda match: chr(int(match.group(1), 8)), field)
+
+def parse(text):
+    entries = []
+    for line in text.splitlines():
+        fields = line.split()
+        if '-' in fields[6:]:
+            entries.append(mount_entry(fields))
+    return entries
+
+def read(path=mountinfo):
+    try:
+        with open(path, 'r', errors='surrogateescape') as table:
+            return parse(table.read())
+    except (IOError, OSError):
+        return []
+
+def mount_points(path=mountinfo):
+    return set(entry.mount_point for entry in read(path))
+
+def normalise(mount_location):
+    return os.path.realpath(os.path.abspath(mount_location))
+
+def is_mounted(mount_location, path=mountinfo):
+    return normalise(mount_location) in mount_points(path)
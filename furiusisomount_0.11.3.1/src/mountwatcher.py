@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import select
+import mounttable
+
+# Watches the kernel's mount table for changes.
+#
+# The kernel flags an open /proc/self/mountinfo with POLLPRI|POLLERR whenever
+# a mount is added or removed, so the table is only re-read when something
+# actually changed; there is no timer and an idle watcher costs nothing.
+
+class watcher():
+    def __init__(self, path=mounttable.mountinfo):
+        self.table_file = open(path, 'r', errors='surrogateescape')
+        self.source = None
+        # Reading the table arms the change notification
+        self.mounted = self.read()
+
+    def fileno(self):
+        return self.table_file.fileno()
+
+    def read(self):
+        self.table_file.seek(0)
+        return dict((entry.mount_id, entry) for entry in mounttable.parse(self.table_file.read()))
+
+    def entries(self):
+        return list(self.mounted.values())
+
+    def changes(self):
+        # Re-read the table and return (added, removed) entries since last time
+        current = self.read()
+        added = [current[mount_id] for mount_id in current.keys() - self.mounted.keys()]
+        removed = [self.mounted[mount_id] for mount_id in self.mounted.keys() - current.keys()]
+        self.mounted = current
+        return added, removed
+
+    def wait(self, timeout=None):
+        # Block until the table changes (or timeout seconds pass) for callers
+        # without a GLib main loop; returns (added, removed)
+        poller = select.poll()
+        poller.register(self.fileno(), select.POLLPRI | select.POLLERR)
+        if not poller.poll(None if timeout is None else int(timeout * 1000)):
+            return [], []
+        return self.changes()
+
+    def attach(self, callback):
+        # Call callback(added, removed) from the GLib main loop on every change
+        from gi.repository import GLib
+        self.source = GLib.io_add_watch(self.fileno(), GLib.PRIORITY_DEFAULT,
+                                        GLib.IOCondition.PRI | GLib.IOCondition.ERR,
+                                        self.table_changed, callback)
+        return self.source
+
+    def table_changed(self, fd, condition, callback):
+        added, removed = self.changes()
+        if added or removed:
+            callback(added, removed)
+        return True
+
+    def detach(self):
+        if self.source is not None:
+            from gi.repository import GLib
+            GLib.source_remove(self.source)
+            self.source = None
+
+    def close(self):
+        self.detach()
+        self.table_file.close()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from gettext import gettext as _
+import atomicfile
+import chunkio
+import cli
+import filehash
+import history
+import imageformat
+import metrics
+import mountregistry
+
+# Performance benchmarks run against synthetic images generated on the spot.
+#
+# Every figure is the median of a few runs and is stored with its unit and
+# whether higher or lower is better, so a later run can be compared with a
+# saved baseline and regressions beyond a tolerance reported. Nothing here
+# reads or touches the user's settings: fixtures, history and mount lists
+# live in a temporary directory, checksums bypass the cache and name their
+# reader explicitly, and the startup runs get a home and runtime directory
+# of their own.
+
+suite_version = 1
+sector = 2048
+fixture_seed = 2008
+small_files = 32
+small_file_size = 4096
+hash_buffer_sizes = (64 * 1024, 2**20, 4 * 2**20)
+history_entries = 5000
+mount_entries = 2000
+detect_rounds = 200
+default_tolerance = cli.perf_tolerance
+benchmark_names = cli.perf_benchmarks
+# The checksum reader, fixed so results compare across machines
+hash_strategy = chunkio.default_strategy
+hash_depth = chunkio.default_depth
+hash_cache_mode = 'normal'
+# Run in a child process: prints ready once the window's first frame is drawn
+gui_startup_script = '''
+import sys
+sys.path.insert(0, %r)
+import main
+from gi.repository import Gtk
+
+def drawn(widget, context):
+    print('ready', flush=True)
+    Gtk.main_quit()
+    return False
+
+window = main.MainWindow()
+window.builder.get_object('main_window').connect_after('draw', drawn)
+Gtk.main()
+'''
+
+def both_endian(format, value):
+    return struct.pack('<' + format, value) + struct.pack('>' + format, value)
+
+def directory_record(name, extent, size, is_directory=False):
+    record = struct.pack('<BB', 0, 0) + both_endian('I', extent) + both_endian('I', size)
+    record += bytes(7) + struct.pack('<BBB', 2 if is_directory else 0, 0, 0) + both_endian('H', 1)
+    record += struct.pack('<B', len(name)) + name
+    if len(record) % 2:
+        record += b'\x00'
+    return bytes([len(record)]) + record[1:]
+
+def write_random(image_file, generator, size):
+    while size > 0:
+        count = min(size, 2**20)
+        image_file.write(generator.randbytes(count))
+        size -= count
+
+def write_iso(path, size):
+    # A plain ISO9660 image: a root directory holding small_files small
+    # files and one large file that brings the image up to size bytes
+    generator = random.Random(fixture_seed)
+    root_extent = 20
+    names = [b'FILE%03d.DAT;1' % index for index in range(small_files)] + [b'LARGE.DAT;1']
+    records = [directory_record(b'\x00', root_extent, sector, True), directory_record(b'\x01', root_extent, sector, True)]
+    extent = root_extent + 1
+    sizes = []
+    large_size = max(size - (extent + small_files * 2) * sector, sector)
+    for name in names:
+        file_size = large_size if name.startswith(b'LARGE') else small_file_size
+        records.append(directory_record(name, extent, file_size))
+        sizes.append(file_size)
+        extent += (file_size + sector - 1) // sector
+    directory = b''.join(records)
+    if len(directory) > sector:
+        raise ValueError('root directory does not fit in one sector')
+
+    descriptor = bytearray(sector)
+    descriptor[0:7] = b'\x01CD001\x01'
+    descriptor[40:72] = b'FURIUS_BENCHMARK'.ljust(32)
+    descriptor[80:88] = both_endian('I', extent)
+    descriptor[120:124] = both_endian('H', 1)
+    descriptor[124:128] = both_endian('H', 1)
+    descriptor[128:132] = both_endian('H', sector)
+    descriptor[132:140] = both_endian('I', 10)
+    descriptor[140:144] = struct.pack('<I', 18)
+    descriptor[148:152] = struct.pack('>I', 19)
+    descriptor[156:190] = directory_record(b'\x00', root_extent, sector, True)
+    descriptor[881] = 1
+    terminator = b'\xffCD001\x01'.ljust(sector, b'\x00')
+    little_table = struct.pack('<BBIH', 1, 0, root_extent, 1) + b'\x00\x00'
+    big_table = struct.pack('>BBIH', 1, 0, root_extent, 1) + b'\x00\x00'
+
+    with open(path, 'wb') as image_file:
+        image_file.write(bytes(16 * sector))
+        for block in (bytes(descriptor), terminator, little_table, big_table, directory):
+            image_file.write(block.ljust(sector, b'\x00'))
+        for file_size in sizes:
+            write_random(image_file, generator, file_size)
+            image_file.write(bytes(-file_size % sector))
+
+def write_bin(path, iso_path):
+    # The same data as 2352-byte mode 1 sectors
+    sync = imageformat.raw_sync
+    with open(iso_path, 'rb') as source, open(path, 'wb') as image_file:
+        address = 0
+        while True:
+            data = source.read(sector)
+            if not data:
+                break
+            header = sync + bytes([address // 4500, address // 75 % 60, address % 75, 1])
+            image_file.write(header + data + bytes(288))
+            address += 1
+
+def write_img(path, size):
+    # A floppy style FAT image: boot sector then zeros
+    boot = bytearray(512)
+    boot[54:59] = b'FAT12'
+    boot[510:512] = b'\x55\xaa'
+    with open(path, 'wb') as image_file:
+        image_file.write(boot)
+        image_file.truncate(max(size, 512))
+
+def make_fixtures(directory, size):
+    fixtures = {'iso': os.path.join(directory, 'benchmark.iso'),
+                'bin': os.path.join(directory, 'benchmark.bin'),
+                'img': os.path.join(directory, 'benchmark.img')}
+    write_iso(fixtures['iso'], size)
+    write_bin(fixtures['bin'], fixtures['iso'])
+    write_img(fixtures['img'], size)
+    return fixtures
+
+def timed(action, repeat):
+    # Median wall time of action() over repeat runs
+    times = []
+    for index in range(repeat):
+        started = time.perf_counter()
+        action()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+def figure(value, unit, better):
+    return {'value': value, 'unit': unit, 'better': better}
+
+def bench_hash(fixtures, repeat, results):
+    iso = fixtures['iso']
+    size = os.path.getsize(iso)
+    def compute(algorithm, buffer_size):
+        filehash.checksum().compute(iso, (algorithm,), hash_strategy, buffer_size, use_cache=False,
+                                    cache_mode=hash_cache_mode, decompress=False, depth=hash_depth)
+
+    # Warm the page cache so every run reads from memory
+    compute('crc32', chunkio.default_buffer_size)
+    for algorithm in filehash.supported_algorithms:
+        for buffer_size in hash_buffer_sizes:
+            elapsed = timed(lambda: compute(algorithm, buffer_size), repeat)
+            results['hash.%s.%dk' % (algorithm, buffer_size // 1024)] = figure(size / elapsed / 1e6, 'MB/s', 'higher')
+
+def bench_history(directory, repeat, results):
+    path = os.path.join(directory, 'history.txt')
+    images = ['/media/library/image%05d.iso' % index for index in range(history_entries)]
+
+    def fill():
+        mount_history = history.history(path, history_entries)
+        for image_file in images:
+            mount_history.add(image_file)
+        # Promote old entries to exercise the move path too
+        for image_file in images[::10]:
+            mount_history.add(image_file)
+        mount_history.save()
+
+    results['history.add_save'] = figure(timed(fill, repeat) * 1e3, 'ms', 'lower')
+    results['history.load'] = figure(timed(lambda: history.history(path, history_entries).load(), repeat) * 1e3, 'ms', 'lower')
+    loaded = history.history(path, history_entries).load()
+    results['history.prefix'] = figure(timed(lambda: loaded.matching('/media/library/image04', 50), repeat) * 1e6, 'us', 'lower')
+
+def bench_mount_list(directory, repeat, results):
+    path = os.path.join(directory, 'mounts.csv')
+    registry = mountregistry.registry(path)
+    for index in range(mount_entries):
+        registry.add('/media/mount%05d' % index, '/media/library/image%05d.iso' % index, index % 2 == 0)
+    results['mountlist.save'] = figure(timed(registry.save, repeat) * 1e3, 'ms', 'lower')
+    results['mountlist.load'] = figure(timed(lambda: mountregistry.registry(path).load(), repeat) * 1e3, 'ms', 'lower')
+
+def bench_detect(fixtures, repeat, results):
+    for kind, path in sorted(fixtures.items()):
+        def detect_uncached():
+            for index in range(detect_rounds):
+                imageformat.verdicts.clear()
+                imageformat.detect(path)
+
+        def detect_cached():
+            for index in range(detect_rounds):
+                imageformat.detect(path)
+
+        results['detect.%s' % kind] = figure(timed(detect_uncached, repeat) / detect_rounds * 1e6, 'us', 'lower')
+        results['detect.%s.cached' % kind] = figure(timed(detect_cached, repeat) / detect_rounds * 1e6, 'us', 'lower')
+
+def startup_time(argv, home, ready=None):
+    # Seconds from starting the process until it prints ready (or exits)
+    # The child's settings and single-instance socket stay in home too
+    environment = dict(os.environ, HOME=home, XDG_RUNTIME_DIR=home)
+    started = time.perf_counter()
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=environment, text=True)
+    try:
+        if ready is None:
+            process.wait()
+        else:
+            for line in process.stdout:
+                if line.strip() == ready:
+                    break
+            else:
+                return None
+        return time.perf_counter() - started
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+def bench_startup(directory, repeat, results):
+    source = os.path.dirname(os.path.abspath(__file__))
+    home = os.path.join(directory, 'home')
+    os.mkdir(home)
+    cli = [sys.executable, os.path.join(source, 'cli.py'), 'list']
+    startup_time(cli, home)
+    results['startup.cli'] = figure(statistics.median(startup_time(cli, home) for index in range(repeat)) * 1e3, 'ms', 'lower')
+
+    if importlib.util.find_spec('gi') is None or not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')):
+        return _('GUI startup skipped: needs PyGObject and a display')
+    gui = [sys.executable, '-c', gui_startup_script % source]
+    times = [startup_time(gui, home, 'ready') for index in range(repeat)]
+    if None in times:
+        return _('GUI startup skipped: the window did not start')
+    results['startup.gui'] = figure(statistics.median(times) * 1e3, 'ms', 'lower')
+
+def run_suite(size, repeat, selected=None):
+    # Synthetic runs are kept out of the operation metrics
+    metrics.recording = False
+    results = {}
+    notes = []
+    directory = tempfile.mkdtemp(prefix='furiusisomount-perf-')
+    try:
+        fixtures = make_fixtures(directory, size)
+        benchmarks = (
+            ('hash', lambda: bench_hash(fixtures, repeat, results)),
+            ('history', lambda: bench_history(directory, repeat, results)),
+            ('mountlist', lambda: bench_mount_list(directory, repeat, results)),
+            ('detect', lambda: bench_detect(fixtures, repeat, results)),
+            ('startup', lambda: bench_startup(directory, repeat, results)),
+        )
+        for name, benchmark in benchmarks:
+            if selected and name not in selected:
+                continue
+            note = benchmark()
+            if note:
+                notes.append(note)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'version': suite_version,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'numpy': importlib.util.find_spec('numpy') is not None,
+                        'hash_reader': {'strategy': hash_strategy, 'buffer_count': hash_depth, 'cache_mode': hash_cache_mode}},
+        'fixture_size': size,
+        'repeat': repeat,
+        'notes': notes,
+        'results': results,
+    }
+
+def compare(report, baseline, tolerance):
+    # Returns (name, baseline, current, change) for every figure that got
+    # worse by more than tolerance
+    regressions = []
+    for name, current in sorted(report['results'].items()):
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous['value']:
+            continue
+        change = (current['value'] - previous['value']) / previous['value']
+        worse = -change if current['better'] == 'higher' else change
+        if worse > tolerance:
+            regressions.append((name, previous['value'], current['value'], change))
+    return regressions
+
+def build_parser(parser=None):
+    if parser is None:
+        parser = argparse.ArgumentParser(prog='furiusisomount perf',
+                                         description=_('Run the performance benchmarks against synthetic images.'),
+                                         epilog=_('Exit status is 1 when --compare finds a regression.'))
+    return cli.perf_arguments(parser)
+
+def run(args):
+    unknown = [name for name in args.only if name not in benchmark_names]
+    if unknown:
+        sys.stderr.write(_('Unknown benchmark: %s\n') % ', '.join(unknown))
+        return 2
+    report = run_suite(max(args.size, 1) * 2**20, max(args.repeat, 1), args.only)
+    for name, result in sorted(report['results'].items()):
+        sys.stdout.write('%-28s %12.2f %s\n' % (name, result['value'], result['unit']))
+    for note in report['notes']:
+        sys.stdout.write('%s\n' % note)
+    if args.output:
+        with atomicfile.atomic_write(args.output) as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    if not args.compare:
+        return 0
+    try:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+    except (IOError, OSError, ValueError) as e:
+        sys.stderr.write(_('%s: cannot read baseline: %s\n') % (args.compare, e))
+        return 2
+    regressions = compare(report, baseline, args.tolerance / 100.0)
+    for name, previous, current, change in regressions:
+        sys.stdout.write(_('REGRESSION %s: %.2f -> %.2f (%+.1f%%)\n') % (name, previous, current, change * 100))
+    if not regressions:
+        sys.stdout.write(_('No regressions against %s\n') % args.compare)
+    return 1 if regressions else 0
+
+def main(argv=None):
+    return run(build_parser().parse_args(argv))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GLib
+from gettext import gettext as _
+
+# A window listing what the I/O scheduler is running and has queued, device
+# by device. Built in code rather than in the Glade file since it is only
+# a list and three buttons. Refreshed twice a second while it is open.
+
+refresh_interval = 500
+states = {
+    'queued': _('Queued'),
+    'running': _('Running'),
+    'done': _('Done'),
+    'failed': _('Failed'),
+    'cancelled': _('Cancelled'),
+}
+
+class queue_window():
+    def __init__(self, parent, scheduler):
+        self.scheduler = scheduler
+        self.tasks = []
+        self.window = Gtk.Window(title=_('Disk Queue'))
+        self.window.set_transient_for(parent)
+        self.window.set_default_size(640, 320)
+        self.window.set_border_width(6)
+        self.window.connect('delete-event', self.window_delete)
+
+        # Task, device, state, priority, progress, progress text
+        self.storage = Gtk.ListStore(str, str, str, str, int, str)
+        self.treeview = Gtk.TreeView(model=self.storage)
+        for position, title in enumerate((_('Task'), _('Disk'), _('State'), _('Priority'))):
+            renderer = Gtk.CellRendererText()
+            column = Gtk.TreeViewColumn(title, renderer, text=position)
+            column.set_resizable(True)
+            column.set_expand(position == 0)
+            self.treeview.append_column(column)
+        self.treeview.append_column(Gtk.TreeViewColumn(_('Progress'), Gtk.CellRendererProgress(), value=4, text=5))
+        self.treeview.get_selection().connect('changed', self.selection_changed)
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_shadow_type(Gtk.ShadowType.IN)
+        scrolled.add(self.treeview)
+
+        self.label_devices = Gtk.Label(xalign=0)
+        self.button_run_next = Gtk.Button(label=_('Run Next'))
+        self.button_run_next.connect('clicked', self.button_run_next_clicked)
+        self.button_cancel = Gtk.Button(label=_('Cancel'))
+        self.button_cancel.connect('clicked', self.button_cancel_clicked)
+        button_close = Gtk.Button(label=_('Close'))
+        button_close.connect('clicked', lambda button: self.window.hide())
+        buttons = Gtk.HBox(spacing=6)
+        buttons.pack_start(self.button_run_next, False, False, 0)
+        buttons.pack_start(self.button_cancel, False, False, 0)
+        buttons.pack_end(button_close, False, False, 0)
+
+        vbox = Gtk.VBox(spacing=6)
+        vbox.pack_start(scrolled, True, True, 0)
+        vbox.pack_start(self.label_devices, False, False, 0)
+        vbox.pack_start(buttons, False, False, 0)
+        self.window.add(vbox)
+        self.refresh_source = None
+
+    def present(self):
+        self.refresh()
+        self.window.show_all()
+        self.window.present()
+        if self.refresh_source is None:
+            self.refresh_source = GLib.timeout_add(refresh_interval, self.refresh)
+
+    def window_delete(self, window, event):
+        # Hidden rather than destroyed so it opens again as it was
+        window.hide()
+        return True
+
+    def refresh(self):
+        if not self.window.get_visible():
+            self.refresh_source = None
+            return False
+        selected = self.selected_task()
+        self.tasks = self.scheduler.snapshot()
+        self.storage.clear()
+        for position, item in enumerate(self.tasks):
+            progress = item.progress()
+            self.storage.append([item.description, item.device_name, states[item.state],
+                                 item.priority_name, int(progress * 100), '%d%%' % (progress * 100)])
+            if item is selected:
+                self.treeview.get_selection().select_path(Gtk.TreePath(position))
+        summaries = []
+        for name, rotational, limit, running, waiting in self.scheduler.device_summary():
+            kind = {True: _('disk'), False: _('SSD')}.get(rotational, _('other'))
+            summaries.append(_('%s (%s): %d of %d running, %d waiting') % (name, kind, running, limit, waiting))
+        self.label_devices.set_text('\n'.join(summaries) if summaries else _('Nothing queued'))
+        self.selection_changed(self.treeview.get_selection())
+        return True
+
+    def selected_task(self):
+        model, iter = self.treeview.get_selection().get_selected()
+        if iter is None:
+            return None
+        position = model.get_path(iter).get_indices()[0]
+        return self.tasks[position] if position < len(self.tasks) else None
+
+    def selection_changed(self, selection):
+        item = self.selected_task()
+        queued = item is not None and item.state == 'queued'
+        self.button_run_next.set_sensitive(queued and item.priority_name != 'high')
+        self.button_cancel.set_sensitive(queued)
+
+    def button_run_next_clicked(self, button):
+        item = self.selected_task()
+        if item is not None:
+            self.scheduler.reprioritise(item, 'high')
+            self.refresh()
+
+    def button_cancel_clicked(self, button):
+        # Checksum jobs are cancelled through their job so the main window
+        # hears about it; anything else is just taken off the queue
+        item = self.selected_task()
+        if item is not None:
+            owner = getattr(item.action, '__self__', None)
+            if hasattr(owner, 'cancel'):
+                owner.cancel()
+            else:
+                item.cancel()
+            self.refresh()
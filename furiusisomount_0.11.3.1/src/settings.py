@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import atomicfile
+import globals
+from configparser import ConfigParser
+
+# Optional options read from settings.cfg. The file created on first run only
+# holds [mount_options], so every lookup here falls back to a default.
+
+def load():
+    config = ConfigParser()
+    config.read(globals.settings_file)
+    return config
+
+def get(section, option, default):
+    try:
+        return load().get(section, option)
+    except Exception:
+        return default
+
+def get_int(section, option, default):
+    try:
+        return int(get(section, option, default))
+    except ValueError:
+        return default
+
+def get_float(section, option, default):
+    try:
+        return float(get(section, option, default))
+    except ValueError:
+        return default
+
+def get_boolean(section, option, default):
+    value = str(get(section, option, default)).strip().lower()
+    if value in ('1', 'yes', 'true', 'on'):
+        return True
+    if value in ('0', 'no', 'false', 'off'):
+        return False
+    return default
+
+def set_option(section, option, value):
+    config = load()
+    if not config.has_section(section):
+        config.add_section(section)
+    config.set(section, option, str(value))
+    with atomicfile.atomic_write(globals.settings_file) as settings_object:
+        config.write(settings_object)
+
+def ensure_settings():
+    # Create the settings directory and file the way MainWindow does on first
+    # run, for front ends that start without the GUI
+    if not os.path.exists(globals.settings_directory):
+        os.mkdir(globals.settings_directory)
+    if not os.path.exists(globals.settings_file):
+        with open(globals.settings_file, 'w') as settings_object:
+            settings_object.write('[mount_options]\nmount_point: %s' % globals.home_directory)
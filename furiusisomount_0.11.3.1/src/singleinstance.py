@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import json
+import os
+import socket
+import stat
+import tempfile
+import globals
+
+# Keeps one GUI process per user. The running window listens on a Unix
+# socket; a later launch (from a file manager, say) connects, sends the image
+# files it was given and exits, and the running window mounts them. The
+# socket lives in $XDG_RUNTIME_DIR, or else in a private directory under the
+# temporary directory, so only the same user can reach it.
+#
+# A request is one JSON object, {"images": [...]}, after which the client
+# shuts down its side; the server answers "ok\n".
+
+connect_timeout = 0.5
+request_limit = 2**20
+
+def socket_path():
+    runtime_directory = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_directory or not os.path.isdir(runtime_directory):
+        runtime_directory = os.path.join(tempfile.gettempdir(), '%s-%d' % (globals.assembly_name, os.getuid()))
+        try:
+            os.mkdir(runtime_directory, 0o700)
+        except FileExistsError:
+            pass
+        status = os.lstat(runtime_directory)
+        if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0o077:
+            raise OSError(errno.EPERM, 'Unsafe runtime directory', runtime_directory)
+    return os.path.join(runtime_directory, '%s.sock' % globals.assembly_name)
+
+def hand_off(images, path=None):
+    # Give images to the running instance. Returns False when there is none,
+    # in which case the caller should start the GUI itself.
+    try:
+        path = path if path else socket_path()
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    except OSError:
+        return False
+    try:
+        client.settimeout(connect_timeout)
+        client.connect(path)
+        client.sendall(json.dumps({'images': [os.path.abspath(image) for image in images]}).encode())
+        client.shutdown(socket.SHUT_WR)
+        return client.recv(16) == b'ok\n'
+    except OSError:
+        return False
+    finally:
+        client.close()
+
+def is_listening(path):
+    # Whether something accepts connections on path
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.settimeout(connect_timeout)
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+class server():
+    def __init__(self, path=None):
+        # Raises OSError (EADDRINUSE) if another instance is listening
+        self.path = path if path else socket_path()
+        self.source = None
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.bind()
+        except:
+            self.listener.close()
+            raise
+        self.listener.listen(8)
+        self.listener.setblocking(False)
+
+    def bind(self):
+        try:
+            self.listener.bind(self.path)
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE or is_listening(self.path):
+                raise
+            # Left behind by an instance that did not exit cleanly
+            os.unlink(self.path)
+            self.listener.bind(self.path)
+        self.identity = os.stat(self.path).st_ino
+
+    def fileno(self):
+        return self.listener.fileno()
+
+    def accept(self):
+        # Read one pending request, returning its list of images, or None if
+        # there was nothing (or nothing sensible) to read
+        try:
+            connection, address = self.listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return None
+        try:
+            connection.settimeout(connect_timeout)
+            data = b''
+            while len(data) < request_limit:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            images = json.loads(data.decode()).get('images', [])
+            if not isinstance(images, list):
+                return None
+            connection.sendall(b'ok\n')
+            return [str(image) for image in images]
+        except (OSError, ValueError, AttributeError):
+            return None
+        finally:
+            connection.close()
+
+    def attach(self, callback):
+        # Call callback(images) from the GLib main loop for every request
+        from gi.repository import GLib
+        self.source = GLib.io_add_watch(self.fileno(), GLib.PRIORITY_DEFAULT, GLib.IOCondition.IN,
+                                        self.request_received, callback)
+        return self.source
+
+    def request_received(self, fd, condition, callback):
+        images = self.accept()
+        if images is not None:
+            callback(images)
+        return True
+
+    def close(self):
+        if self.source is not None:
+            from gi.repository import GLib
+            GLib.source_remove(self.source)
+            self.source = None
+        self.listener.close()
+        # Only remove the socket if a newer instance has not replaced it
+        try:
+            if os.stat(self.path).st_ino == self.identity:
+                os.unlink(self.path)
+        except OSError:
+            pass
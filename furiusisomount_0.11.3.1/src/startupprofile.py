@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is part of PyFuriusIsoMount. Copyright 2008 Dean Harris (marcus_furius@hotmail.com)
+#
+# PyFuriusIsoMount is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyFuriusIsoMount is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyFuriusIsoMount.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import time
+
+# Timings of the steps between starting the program and the window being
+# usable, printed by --profile-startup. Each mark() closes the phase that
+# started at the previous mark, so the phases add up to the whole startup.
+
+class phases():
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.last = self.started
+        self.timings = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.timings.append((name, now - self.last, now - self.started))
+        self.last = now
+
+    def report(self, stream=None):
+        stream = stream if stream else sys.stderr
+        width = max([len(name) for name, elapsed, total in self.timings] + [5])
+        stream.write('%-*s %10s %10s\n' % (width, 'phase', 'ms', 'total ms'))
+        for name, elapsed, total in self.timings:
+            stream.write('%-*s %10.1f %10.1f\n' % (width, name, elapsed * 1000, total * 1000))
+        stream.flush()
@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# globals.py places the settings directory under HOME when it is imported,
+# and the single-instance socket lives in XDG_RUNTIME_DIR, so both point at
+# a scratch directory before any module under test is loaded
+home = tempfile.mkdtemp(prefix='furiusisomount-tests-')
+os.environ['HOME'] = home
+os.environ['XDG_RUNTIME_DIR'] = home
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import perfsuite
+
+# Large enough for several index checkpoints, small enough to build quickly
+image_size = 2**20
+
+@pytest.fixture(scope='session')
+def iso(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('images') / 'fixture.iso')
+    perfsuite.write_iso(path, image_size)
+    return path
+
+@pytest.fixture(scope='session')
+def iso_bytes(iso):
+    with open(iso, 'rb') as image_file:
+        return image_file.read()
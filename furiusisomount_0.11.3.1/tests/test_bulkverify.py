@@ -0,0 +1,56 @@
+import gzip
+import hashlib
+import os
+
+import bulkverify
+import filehash
+
+digest = 'd41d8cd98f00b204e9800998ecf8427e'
+
+def write(path, text):
+    with open(path, 'w') as sum_file:
+        sum_file.write(text)
+    return str(path)
+
+def test_gnu_lines(tmp_path):
+    sum_file = write(tmp_path / 'MD5SUMS', '# comment\n\n%s  one.iso\n%s *two.iso\r\n' % (digest, digest.upper()))
+    entries = bulkverify.parse(sum_file)
+    assert [entry.image for entry in entries] == [str(tmp_path / 'one.iso'), str(tmp_path / 'two.iso')]
+    assert all(entry.algorithm == 'md5' and entry.expected == digest for entry in entries)
+
+def test_bsd_lines(tmp_path):
+    sha256 = 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+    sum_file = write(tmp_path / 'checksums', 'SHA256 (a b.iso) = %s\nMD5 (c.iso) = %s\n' % (sha256, digest))
+    entries = bulkverify.parse(sum_file)
+    assert [(entry.algorithm, entry.image) for entry in entries] == [('sha256', str(tmp_path / 'a b.iso')), ('md5', str(tmp_path / 'c.iso'))]
+
+def test_algorithm_from_length(tmp_path):
+    sum_file = write(tmp_path / 'checksums', '%s  one.iso\n%s  two.iso\nnot a sum line\n' % ('0' * 40, '1' * 8))
+    assert [entry.algorithm for entry in bulkverify.parse(sum_file)] == ['sha1', 'crc32']
+
+def test_escaped_names(tmp_path):
+    sum_file = write(tmp_path / 'MD5SUMS', '\\%s  back\\\\slash\\nline.iso\n' % digest)
+    assert bulkverify.parse(sum_file)[0].image == str(tmp_path / 'back\\slash\nline.iso')
+
+def test_one_read_per_image(tmp_path, monkeypatch):
+    data = b'furius' * 1000
+    (tmp_path / 'one.iso').write_bytes(data)
+    with gzip.open(str(tmp_path / 'two.iso.gz'), 'wb') as compressed:
+        compressed.write(data)
+    write(tmp_path / 'MD5SUMS', '%s  one.iso\n%s  two.iso\n%s  three.iso\n' % ((hashlib.md5(data).hexdigest(),) * 3))
+    write(tmp_path / 'SHA256SUMS', '%s  one.iso\n%s  two.iso\n' % (hashlib.sha256(data).hexdigest(), '0' * 64))
+    reads = []
+    original = filehash.checksum.digest
+
+    def counted(self, file, algorithms, *args):
+        reads.append((os.path.basename(file), tuple(algorithms)))
+        return original(self, file, algorithms, *args)
+
+    monkeypatch.setattr(filehash.checksum, 'digest', counted)
+    entries = bulkverify.parse(str(tmp_path / 'MD5SUMS')) + bulkverify.parse(str(tmp_path / 'SHA256SUMS'))
+    reported = []
+    bulkverify.verify(entries, 2, use_cache=False, report=reported.append)
+    assert sorted(reads) == [('one.iso', ('md5', 'sha256')), ('two.iso.gz', ('md5', 'sha256'))]
+    assert reported == entries
+    assert [item.status for item in entries] == ['OK', 'OK', 'MISSING', 'OK', 'FAILED']
+    assert bulkverify.exit_status(entries) == bulkverify.exit_failed
@@ -0,0 +1,99 @@
+import errno
+import os
+import random
+
+import pytest
+
+import chunkio
+
+@pytest.fixture
+def data_file(tmp_path):
+    data = random.Random(2008).randbytes(2**20 + 4321)
+    path = tmp_path / 'data.img'
+    path.write_bytes(data)
+    return str(path), data
+
+def read_all(reader):
+    pieces = []
+    for view, token in reader.chunks():
+        pieces.append(bytes(view))
+        reader.release(token)
+    return b''.join(pieces)
+
+@pytest.mark.parametrize('strategy', chunkio.strategies)
+def test_strategies_read_the_whole_file(data_file, strategy):
+    path, data = data_file
+    with chunkio.open_reader(path, strategy, 2**16, 2, 'normal') as reader:
+        assert reader.size == len(data)
+        assert read_all(reader) == data
+
+def test_buffers_are_reused(data_file):
+    path, data = data_file
+    with chunkio.open_reader(path, 'readinto', 2**16, 2, 'normal') as reader:
+        tokens = set()
+        for view, token in reader.chunks():
+            tokens.add(id(token))
+            reader.release(token)
+    assert len(tokens) <= 2
+
+def test_small_buffers_are_raised(data_file):
+    path, data = data_file
+    with chunkio.open_reader(path, 'readinto', 1, 1, 'normal') as reader:
+        assert reader.buffer_size == 4096
+
+def test_unknown_strategy(data_file):
+    with pytest.raises(ValueError):
+        chunkio.open_reader(data_file[0], 'nosuch', cache_mode='normal')
+
+def test_unknown_cache_mode(data_file):
+    with pytest.raises(ValueError):
+        chunkio.open_reader(data_file[0], 'readinto', cache_mode='nosuch')
+
+def test_reader_needs_chunks():
+    class incomplete(chunkio.reader):
+        pass
+    with pytest.raises(TypeError):
+        incomplete('/dev/null')
+
+@pytest.mark.parametrize('cache_mode', chunkio.cache_modes)
+@pytest.mark.parametrize('strategy', chunkio.strategies)
+def test_cache_modes_read_the_same_bytes(data_file, strategy, cache_mode):
+    path, data = data_file
+    with chunkio.open_reader(path, strategy, 2**16, 2, cache_mode) as reader:
+        assert read_all(reader) == data
+
+def test_direct_buffers_are_aligned(data_file):
+    with chunkio.open_reader(data_file[0], 'readinto', 5000, 1, 'direct') as reader:
+        assert reader.buffer_size % chunkio.direct_alignment == 0
+
+def test_direct_falls_back_to_dropbehind(data_file, monkeypatch):
+    # As on tmpfs, which refuses O_DIRECT at open
+    path, data = data_file
+    real_open = os.open
+    def refuse_direct(file, flags, *args):
+        if flags & os.O_DIRECT:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+        return real_open(file, flags, *args)
+    monkeypatch.setattr(os, 'open', refuse_direct)
+    with chunkio.open_reader(path, 'readinto', 2**16, 2, 'direct') as reader:
+        assert reader.cache_mode == 'dropbehind'
+        assert read_all(reader) == data
+
+def test_dropbehind_advice(data_file, monkeypatch):
+    # Every range read is dropped, and the whole file again at close
+    path, data = data_file
+    advice = []
+    monkeypatch.setattr(chunkio, 'advise', lambda descriptor, offset, length, kind: advice.append((offset, length, kind)))
+    with chunkio.open_reader(path, 'readinto', 2**16, 2, 'dropbehind') as reader:
+        read_all(reader)
+    dropped = [(offset, length) for offset, length, kind in advice if kind == os.POSIX_FADV_DONTNEED]
+    assert dropped[:-1] == [(offset, min(2**16, len(data) - offset)) for offset in range(0, len(data), 2**16)]
+    assert dropped[-1] == (0, 0)
+    assert (0, 0, os.POSIX_FADV_SEQUENTIAL) in advice
+
+def test_normal_gives_no_advice(data_file, monkeypatch):
+    advice = []
+    monkeypatch.setattr(chunkio, 'advise', lambda *args: advice.append(args))
+    with chunkio.open_reader(data_file[0], 'readinto', 2**16, 2, 'normal') as reader:
+        read_all(reader)
+    assert advice == []
@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+
+import cli
+
+source = os.path.join(os.path.dirname(__file__), '..', 'src')
+
+def imported_by_parser():
+    # Modules loaded by building the parser, in a fresh interpreter
+    script = 'import sys; before = set(sys.modules); import cli; cli.build_parser(); print(" ".join(sorted(set(sys.modules) - before)))'
+    output = subprocess.run([sys.executable, '-c', script], cwd=source, check=True, capture_output=True, text=True).stdout
+    return output.split()
+
+def test_verify_arguments():
+    args = cli.build_parser().parse_args(['verify', '-j', '2', '--no-cache', 'MD5SUMS', 'SHA256SUMS'])
+    assert (args.command, args.sum_files, args.workers, args.no_cache, args.quiet) == ('verify', ['MD5SUMS', 'SHA256SUMS'], 2, True, False)
+
+def test_parser_does_not_import_bulkverify():
+    assert 'bulkverify' not in imported_by_parser()
+
+def test_perf_arguments():
+    args = cli.build_parser().parse_args(['perf', '-s', '8', '-t', '5', 'hash', 'detect'])
+    assert (args.command, args.size, args.repeat, args.tolerance, args.only) == ('perf', 8, 3, 5.0, ['hash', 'detect'])
+
+def test_parser_does_not_import_perfsuite():
+    assert 'perfsuite' not in imported_by_parser()
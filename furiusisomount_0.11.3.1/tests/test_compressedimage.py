@@ -0,0 +1,98 @@
+import lzma
+import zlib
+
+import pytest
+
+import compressedimage
+import isoreader
+
+flush_every = 64 * 2**10
+
+def write_gzip(path, data):
+    # Full flushes every flush_every bytes, as gzip --rsyncable and pigz -i
+    # leave them, so the reader has points to index
+    stream = zlib.compressobj(6, zlib.DEFLATED, 31)
+    with open(path, 'wb') as image_file:
+        for start in range(0, len(data), flush_every):
+            image_file.write(stream.compress(data[start:start + flush_every]))
+            image_file.write(stream.flush(zlib.Z_FULL_FLUSH))
+        image_file.write(stream.flush())
+
+@pytest.fixture
+def spacing(monkeypatch):
+    # Index every flush point instead of one per 32 MiB
+    monkeypatch.setattr(compressedimage, 'index_spacing', lambda: compressedimage.block_size)
+
+@pytest.fixture
+def gzip_image(tmp_path, iso_bytes):
+    path = str(tmp_path / 'fixture.iso.gz')
+    write_gzip(path, iso_bytes)
+    return path
+
+def read_at(path, offset, length):
+    source = compressedimage.compressed_source(path)
+    try:
+        return source.read(offset, length)
+    finally:
+        source.close()
+
+def test_detects_compression(gzip_image, iso):
+    assert compressedimage.compression_of(gzip_image) == 'gzip'
+    assert compressedimage.compression_of(iso) is None
+
+def test_gzip_index(gzip_image, iso_bytes, spacing):
+    source = compressedimage.compressed_source(gzip_image)
+    try:
+        assert source.read(0, len(iso_bytes) + 1) == iso_bytes
+        assert source.size == len(iso_bytes)
+    finally:
+        source.close()
+    index = compressedimage.load_index(gzip_image)
+    assert index.complete and index.size == len(iso_bytes)
+    assert len(index.checkpoints) > 1
+    # Reads from a saved checkpoint give the same bytes as from the start
+    offset = index.checkpoints[-1].uoffset + 1000
+    assert read_at(gzip_image, offset, 5000) == iso_bytes[offset:offset + 5000]
+
+def test_gzip_partial_index(gzip_image, iso_bytes, spacing):
+    # A read part way in keeps the checkpoints it passed, without a size
+    offset = len(iso_bytes) // 2
+    assert read_at(gzip_image, offset, 4096) == iso_bytes[offset:offset + 4096]
+    index = compressedimage.load_index(gzip_image)
+    assert not index.complete and index.size is None
+    assert len(index.checkpoints) > 1
+
+def test_xz_index(tmp_path, iso_bytes):
+    path = str(tmp_path / 'fixture.iso.xz')
+    with open(path, 'wb') as image_file:
+        image_file.write(lzma.compress(iso_bytes, lzma.FORMAT_XZ))
+    source = compressedimage.compressed_source(path)
+    try:
+        assert source.index.complete and source.size == len(iso_bytes)
+        offset = len(iso_bytes) - 10000
+        assert source.read(offset, 20000) == iso_bytes[offset:]
+    finally:
+        source.close()
+
+def test_zstd_index(tmp_path, iso_bytes):
+    zstandard = pytest.importorskip('zstandard')
+    path = str(tmp_path / 'fixture.iso.zst')
+    with open(path, 'wb') as image_file:
+        image_file.write(zstandard.ZstdCompressor().compress(iso_bytes))
+    source = compressedimage.compressed_source(path)
+    try:
+        assert source.size == len(iso_bytes)
+        offset = len(iso_bytes) // 3
+        assert source.read(offset, 4096) == iso_bytes[offset:offset + 4096]
+    finally:
+        source.close()
+
+def test_lists_compressed_image(gzip_image):
+    with isoreader.image(gzip_image) as image:
+        assert 'LARGE.DAT' in image.listdir('/')
+
+def test_decoder_is_abstract():
+    class partial(compressedimage.decoder):
+        pass
+    with pytest.raises(TypeError):
+        partial(0, compressedimage.checkpoint(0, 0))
@@ -0,0 +1,58 @@
+import os
+import shutil
+
+import pytest
+
+import contentindex
+
+@pytest.fixture
+def library(tmp_path, iso):
+    # Two copies of the fixture image and a file that is not an image
+    directory = tmp_path / 'library'
+    directory.mkdir()
+    for name in ('first.iso', 'second.iso'):
+        shutil.copy(iso, str(directory / name))
+    (directory / 'notes.txt').write_text('not an image')
+    return directory
+
+@pytest.fixture
+def content_index(tmp_path):
+    with contentindex.index(str(tmp_path / 'index.sqlite')) as content_index:
+        yield content_index
+
+def test_indexes_and_searches(library, content_index):
+    assert content_index.add(str(library / 'first.iso'))
+    matches = content_index.search('large')
+    assert [(os.path.basename(item.image), item.path) for item in matches] == [('first.iso', '/LARGE.DAT')]
+    assert matches[0].size > 0 and matches[0].offset % 2048 == 0 and not matches[0].is_directory
+
+def test_glob_search(library, content_index):
+    content_index.add(str(library / 'first.iso'))
+    assert len(content_index.search('FILE00?.DAT', use_glob=True)) == 10
+    assert len(content_index.search('/FILE01*', use_glob=True)) == 10
+    assert len(content_index.search('FILE', limit=3)) == 3
+    # Substring search treats % and _ literally
+    assert content_index.search('%') == []
+
+def test_unchanged_images_are_not_reread(library, content_index):
+    image = str(library / 'first.iso')
+    assert content_index.add(image)
+    assert not content_index.add(image)
+    assert content_index.add(image, force=True)
+    os.utime(image, ns=(0, 0))
+    assert content_index.add(image)
+    assert len(content_index.search('LARGE')) == 1
+
+def test_prune_forgets_missing_images(library, content_index):
+    for name in ('first.iso', 'second.iso'):
+        content_index.add(str(library / name))
+    os.remove(str(library / 'second.iso'))
+    assert content_index.prune() == [str(library / 'second.iso')]
+    assert content_index.images() == [str(library / 'first.iso')]
+    assert set(item.image for item in content_index.search('LARGE')) == set([str(library / 'first.iso')])
+
+def test_update_reports_each_file(library, monkeypatch, tmp_path):
+    monkeypatch.setattr(contentindex.globals, 'content_index', str(tmp_path / 'update.sqlite'))
+    reports = []
+    contentindex.update([str(library)], lambda path, status: reports.append((os.path.basename(path), status)))
+    assert reports == [('first.iso', 'indexed'), ('notes.txt', 'not an ISO9660 image'), ('second.iso', 'indexed')]
@@ -0,0 +1,80 @@
+import os
+import struct
+
+import pytest
+
+import convert
+import imageformat
+import isoreader
+
+def raw_sectors(iso_bytes, mode):
+    # The ISO as 2352 byte sectors: mode 1 (data after a 16 byte header) or
+    # mode 2 form 1 (after the header and an 8 byte subheader)
+    sectors = []
+    for offset in range(0, len(iso_bytes), 2048):
+        header = imageformat.raw_sync + bytes(3) + bytes([mode])
+        subheader = bytes(8) if mode == 2 else b''
+        sector = header + subheader + iso_bytes[offset:offset + 2048]
+        sectors.append(sector + bytes(2352 - len(sector)))
+    return b''.join(sectors)
+
+def nero_image(data, start):
+    # data placed at start, described by a v2 (NER5) footer with one ETN2
+    # track entry
+    chunks = start + len(data)
+    entry = struct.pack('>QQ', start, len(data)) + bytes(16)
+    footer = b'ETN2' + struct.pack('>I', len(entry)) + entry + b'END!' + bytes(4)
+    return bytes(start) + data + footer + b'NER5' + struct.pack('>Q', chunks)
+
+@pytest.fixture(params=[1, 2])
+def bin_image(request, tmp_path, iso_bytes):
+    path = tmp_path / 'image.bin'
+    path.write_bytes(raw_sectors(iso_bytes, request.param))
+    return str(path)
+
+def test_bin_to_iso(bin_image, iso_bytes, tmp_path):
+    output = str(tmp_path / 'image.iso')
+    assert convert.convert(bin_image, output)
+    with open(output, 'rb') as image_file:
+        assert image_file.read() == iso_bytes
+
+def test_cooked_source_is_browsable(bin_image):
+    with isoreader.image(bin_image) as image:
+        assert 'LARGE.DAT' in image.listdir('/')
+
+def test_nero_raw_track(tmp_path, iso_bytes):
+    path = tmp_path / 'image.nrg'
+    path.write_bytes(nero_image(raw_sectors(iso_bytes, 1), 4096))
+    layout = convert.layout_of(str(path))
+    assert (layout.offset, layout.sector_size, layout.data_offset, layout.count) == (4096, 2352, 16, len(iso_bytes) // 2048)
+    output = str(tmp_path / 'image.iso')
+    convert.convert(str(path), output, layout)
+    with open(output, 'rb') as image_file:
+        assert image_file.read() == iso_bytes
+
+def test_nero_cooked_track_mounts_in_place(tmp_path, iso_bytes):
+    path = tmp_path / 'image.nrg'
+    path.write_bytes(nero_image(iso_bytes, 307200))
+    assert not convert.needs_conversion(str(path))
+    assert convert.loop_source(str(path)) == (str(path), 307200, len(iso_bytes))
+
+def test_cancelled_conversion_leaves_nothing(bin_image, tmp_path):
+    class cancelled():
+        def is_set(self):
+            return True
+    output = str(tmp_path / 'image.iso')
+    assert not convert.convert(bin_image, output, cancelled=cancelled())
+    assert sorted(os.listdir(str(tmp_path))) == ['image.bin']
+
+def test_converted_copy_is_reused_and_released(bin_image, monkeypatch):
+    assert convert.needs_conversion(bin_image)
+    output, offset, size = convert.loop_source(bin_image)
+    assert (output, offset) == (convert.converted_path(bin_image), 0)
+    assert not convert.needs_conversion(bin_image)
+    # Still attached to a loop device, perhaps by another process
+    monkeypatch.setattr(convert, 'loop_backing_files', lambda: set([os.path.realpath(output)]))
+    convert.release(bin_image)
+    assert os.path.exists(output)
+    monkeypatch.setattr(convert, 'loop_backing_files', lambda: set())
+    convert.release(bin_image)
+    assert not os.path.exists(output)
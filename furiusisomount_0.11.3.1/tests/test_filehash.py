@@ -0,0 +1,76 @@
+import hashlib
+import os
+import random
+import threading
+import zlib
+
+import pytest
+
+import filehash
+import iosched
+
+@pytest.fixture
+def data_file(tmp_path):
+    # Not a multiple of any buffer size, so the last chunk is a short one
+    data = random.Random(2008).randbytes(3 * 2**20 + 12345)
+    path = tmp_path / 'data.img'
+    path.write_bytes(data)
+    return str(path), data
+
+def test_every_algorithm_from_one_read(data_file):
+    path, data = data_file
+    job = filehash.checksum()
+    job.compute(path, filehash.supported_algorithms, buffer_size=2**16, use_cache=False)
+    expected = dict((algorithm, hashlib.new(algorithm, data).hexdigest()) for algorithm in filehash.supported_algorithms if algorithm != 'crc32')
+    expected['crc32'] = '%08x' % zlib.crc32(data)
+    assert job.hashes == expected
+    assert job.hash == expected['md5']
+    assert job.progress == 1.0 and job.bytes_done == len(data)
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.img'
+    path.write_bytes(b'')
+    job = filehash.checksum()
+    job.compute(str(path), ('sha1',), use_cache=False)
+    assert job.hash == hashlib.sha1(b'').hexdigest()
+
+def test_missing_file(tmp_path):
+    job = filehash.checksum()
+    job.compute(str(tmp_path / 'missing.img'), use_cache=False)
+    assert job.hash == 'Error reading file' and job.hashes == {}
+
+def test_unsupported_algorithm():
+    with pytest.raises(ValueError):
+        filehash.new_hash('md4')
+
+def test_cancelled_checksum(data_file):
+    path, data = data_file
+    cancelled = threading.Event()
+    cancelled.set()
+    job = filehash.checksum(cancelled)
+    job.compute(path, ('md5',), buffer_size=2**16, use_cache=False)
+    assert job.hash == 'No Checksum Generated' and job.hashes == {}
+    # Stopped after the first read rather than reading the rest
+    assert job.bytes_done == 2**16
+
+def test_job_runs_on_the_scheduler(data_file):
+    path, data = data_file
+    job = filehash.job(path, ('sha1',), use_cache=False, scheduler=iosched.scheduler()).start()
+    assert job.wait(10)
+    assert job.hash == hashlib.sha1(data).hexdigest()
+    assert job.is_finished() and not job.is_cancelled()
+    assert job.rate() > 0 and job.eta() == 0.0
+
+def test_queued_job_cancels_at_once(data_file):
+    path, data = data_file
+    # One slot, held until release is set, so the job stays queued
+    scheduler = iosched.scheduler(1)
+    release = threading.Event()
+    blocker = scheduler.submit(path, release.wait)
+    job = filehash.job(path, ('md5',), use_cache=False, scheduler=scheduler).start()
+    assert job.is_queued()
+    job.cancel()
+    assert job.is_finished() and job.is_cancelled()
+    assert job.hash == 'Calculating, please wait...'
+    release.set()
+    blocker.result(10)
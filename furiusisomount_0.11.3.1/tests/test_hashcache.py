@@ -0,0 +1,53 @@
+import itertools
+
+import pytest
+
+import hashcache
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Distinct, increasing use times whatever the clock's resolution
+    ticks = itertools.count(1)
+    monkeypatch.setattr(hashcache.time, 'time_ns', lambda: next(ticks))
+
+def identity(inode, size=100, mtime_ns=1):
+    return (1, inode, size, mtime_ns)
+
+def test_store_and_lookup(tmp_path, clock):
+    with hashcache.cache(str(tmp_path / 'cache.sqlite'), 10) as cache:
+        cache.store(identity(1), {'md5': 'aa', 'sha1': 'bb'})
+        assert cache.lookup(identity(1), ['md5', 'sha256']) == {'md5': 'aa'}
+        assert cache.lookup(identity(2), ['md5']) == {}
+    # And again from a new connection
+    with hashcache.cache(str(tmp_path / 'cache.sqlite'), 10) as cache:
+        assert cache.lookup(identity(1), ['md5', 'sha1']) == {'md5': 'aa', 'sha1': 'bb'}
+
+@pytest.mark.parametrize('changed', [identity(1, size=101), identity(1, mtime_ns=2)])
+def test_changed_file_is_dropped(tmp_path, clock, changed):
+    with hashcache.cache(str(tmp_path / 'cache.sqlite'), 10) as cache:
+        cache.store(identity(1), {'md5': 'aa'})
+        assert cache.lookup(changed, ['md5']) == {}
+        # The stale entry is gone, not just hidden
+        assert cache.lookup(identity(1), ['md5']) == {}
+
+def test_store_after_change_forgets_old_digests(tmp_path, clock):
+    with hashcache.cache(str(tmp_path / 'cache.sqlite'), 10) as cache:
+        cache.store(identity(1), {'md5': 'aa', 'sha1': 'bb'})
+        cache.store(identity(1, mtime_ns=2), {'md5': 'cc'})
+        assert cache.lookup(identity(1, mtime_ns=2), ['md5', 'sha1']) == {'md5': 'cc'}
+
+def test_least_recently_used_evicted(tmp_path, clock):
+    with hashcache.cache(str(tmp_path / 'cache.sqlite'), 2) as cache:
+        cache.store(identity(1), {'md5': 'aa'})
+        cache.store(identity(2), {'md5': 'bb'})
+        # Using 1 makes 2 the least recently used
+        cache.lookup(identity(1), ['md5'])
+        cache.store(identity(3), {'md5': 'cc'})
+        assert cache.lookup(identity(2), ['md5']) == {}
+        assert cache.lookup(identity(1), ['md5']) == {'md5': 'aa'}
+        assert cache.lookup(identity(3), ['md5']) == {'md5': 'cc'}
+
+def test_zero_capacity_stores_nothing(tmp_path):
+    with hashcache.cache(str(tmp_path / 'cache.sqlite'), 0) as cache:
+        cache.store(identity(1), {'md5': 'aa'})
+        assert cache.lookup(identity(1), ['md5']) == {}
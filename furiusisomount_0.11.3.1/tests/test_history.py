@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+import history
+
+class list_storage():
+    # The parts of Gtk.ListStore the history uses; rows are one-item lists
+    def __init__(self):
+        self.rows = []
+
+    def clear(self):
+        self.rows = []
+
+    def append(self, row):
+        self.rows.append(row)
+        return row
+
+    def prepend(self, row):
+        self.rows.insert(0, row)
+        return row
+
+    def move_after(self, row, sibling):
+        # A sibling of None moves the row to the top
+        self.rows.remove(row)
+        self.rows.insert(0, row)
+
+    def remove(self, row):
+        self.rows.remove(row)
+
+    def names(self):
+        return [row[0] for row in self.rows]
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'history.txt')
+
+def test_most_recent_first(path):
+    recent = history.history(path, 3)
+    for image_file in ('/a.iso', '/b.iso', '/c.iso', '/a.iso', '/d.iso'):
+        recent.add(image_file)
+    assert list(recent) == ['/d.iso', '/a.iso', '/c.iso']
+    assert '/b.iso' not in recent
+
+def test_storage_follows_changes(path):
+    recent = history.history(path, 3)
+    storage = list_storage()
+    recent.add('/a.iso')
+    recent.attach(storage)
+    for image_file in ('/b.iso', '/c.iso', '/a.iso', '/d.iso'):
+        recent.add(image_file)
+        assert storage.names() == list(recent)
+
+def test_prefix_matches(path):
+    recent = history.history(path, 10)
+    for image_file in ('/media/b.iso', '/home/a.iso', '/media/a.iso', '/media/c.iso'):
+        recent.add(image_file)
+    assert recent.matching('/media/') == ['/media/a.iso', '/media/b.iso', '/media/c.iso']
+    assert recent.matching('/media/', 2) == ['/media/a.iso', '/media/b.iso']
+    recent.discard('/media/a.iso')
+    assert recent.matching('/media/a') == []
+
+def test_save_and_load(path):
+    recent = history.history(path, 3)
+    for image_file in ('/a.iso', '/b.iso'):
+        recent.add(image_file)
+    recent.save()
+    with open(path) as history_file:
+        assert history_file.read() == '/b.iso\n/a.iso\n'
+    assert list(history.history(path, 3).load()) == ['/b.iso', '/a.iso']
+    assert sorted(os.listdir(os.path.dirname(path))) == ['history.txt', 'history.txt.lock']
+
+def test_save_merges_other_processes(path):
+    window = history.history(path, 4)
+    window.add('/a.iso')
+    window.add('/b.iso')
+    window.save()
+    storage = list_storage()
+    window.attach(storage)
+    command_line = history.history(path, 4).load()
+    command_line.add('/c.iso')
+    command_line.discard('/a.iso')
+    command_line.save()
+    # The window's own addition is the newest; the command line's is kept,
+    # and what it dropped stays dropped
+    window.add('/d.iso')
+    window.save()
+    assert list(window) == ['/d.iso', '/c.iso', '/b.iso']
+    assert storage.names() == list(window)
+    assert list(history.history(path, 4).load()) == ['/d.iso', '/c.iso', '/b.iso']
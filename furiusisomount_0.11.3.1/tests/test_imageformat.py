@@ -0,0 +1,75 @@
+import gzip
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import imageformat
+
+def write(path, data, size=None):
+    with open(str(path), 'wb') as image_file:
+        image_file.write(data)
+        if size:
+            image_file.truncate(size)
+    return str(path)
+
+def at(offset, data, size=2**17):
+    # size bytes of zeros with data at offset
+    image = bytearray(size)
+    image[offset:offset + len(data)] = data
+    return bytes(image)
+
+def test_iso9660(iso):
+    result = imageformat.detect(iso)
+    assert (result.format, result.backends) == ('iso9660', ('fuse', 'loop'))
+
+def test_raw_cd_sectors(tmp_path, iso_bytes):
+    # The ISO's sectors written as 2352 byte mode 1 sectors, as in a BIN
+    sectors = []
+    for offset in range(0, 20 * 2048, 2048):
+        sectors.append(imageformat.raw_sync + bytes(4) + iso_bytes[offset:offset + 2048] + bytes(288))
+    result = imageformat.detect(write(tmp_path / 'image.bin', b''.join(sectors)))
+    assert (result.format, result.sector_size, result.data_offset) == ('raw', 2352, 16)
+
+def test_nero_footer(tmp_path):
+    result = imageformat.detect(write(tmp_path / 'image.nrg', bytes(4096) + b'NER5' + (1234).to_bytes(8, 'big')))
+    assert (result.format, result.footer) == ('nrg', (2, 1234))
+
+def test_compressed(tmp_path):
+    path = str(tmp_path / 'image.iso.gz')
+    with gzip.open(path, 'wb') as compressed:
+        compressed.write(bytes(4096))
+    result = imageformat.detect(path)
+    assert result.is_compressed() and not result.is_mountable()
+
+@pytest.mark.parametrize('offset, magic', [(offset, magic) for offset, magic, name in imageformat.superblocks])
+def test_filesystem_superblocks(tmp_path, offset, magic):
+    result = imageformat.detect(write(tmp_path / 'disk.raw', at(offset, magic)))
+    assert (result.format, result.backends) == ('filesystem', ('loop',))
+
+@pytest.mark.skipif(shutil.which('mkfs.ext4') is None, reason='needs mkfs.ext4')
+def test_ext4_made_by_mkfs(tmp_path):
+    path = write(tmp_path / 'disk.img', b'', 8 * 2**20)
+    subprocess.run(['mkfs.ext4', '-q', '-F', path], check=True, capture_output=True)
+    result = imageformat.detect(path)
+    assert result.format == 'filesystem' and result.supports_loop()
+
+def test_boot_sectors(tmp_path):
+    fat = bytearray(at(510, b'\x55\xaa', 4096))
+    fat[54:59] = b'FAT16'
+    assert imageformat.detect(write(tmp_path / 'floppy.img', bytes(fat))).format == 'fat'
+    assert imageformat.detect(write(tmp_path / 'disk.raw', at(510, b'\x55\xaa', 4096))).format == 'mbr'
+
+def test_unrecognised_img_goes_to_loop(tmp_path):
+    data = b'not an image' * 1000
+    unknown = imageformat.detect(write(tmp_path / 'data.bin', data))
+    assert unknown.format == 'unknown' and not unknown.is_mountable()
+    assert imageformat.detect(write(tmp_path / 'data.IMG', data)).supports_loop()
+
+def test_cache_follows_changes(tmp_path):
+    path = write(tmp_path / 'image.bin', b'not an image' * 1000)
+    assert imageformat.detect(path).format == 'unknown'
+    write(path, at(0, b'hsqs'))
+    os.utime(path, ns=(1, 1))
+    assert imageformat.detect(path).format == 'filesystem'
@@ -0,0 +1,119 @@
+import os
+import threading
+
+import pytest
+
+import iosched
+
+# Files are named 'disk/...' or 'ssd/...'; each name prefix is its own device
+devices = {'disk': os.makedev(0, 901), 'other': os.makedev(0, 902), 'ssd': os.makedev(0, 903), 'ssd2': os.makedev(0, 904)}
+
+@pytest.fixture(autouse=True)
+def fake_devices(monkeypatch):
+    monkeypatch.setattr(iosched, 'device_of', lambda file: devices[file.split('/')[0]])
+    monkeypatch.setattr(iosched, 'is_rotational', lambda device: device in (devices['disk'], devices['other']))
+
+class jobs():
+    # Actions that note when they start and then wait to be released
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []
+        self.release = threading.Event()
+        self.changed = threading.Condition(self.lock)
+
+    def action(self, name):
+        with self.lock:
+            self.started.append(name)
+            self.changed.notify_all()
+        assert self.release.wait(5)
+        return name
+
+    def wait_for(self, count):
+        with self.lock:
+            assert self.changed.wait_for(lambda: len(self.started) >= count, 5)
+            return list(self.started)
+
+def finish(tasks):
+    return [item.result(5) for item in tasks]
+
+def test_rotational_disk_runs_one_at_a_time():
+    scheduler, work = iosched.scheduler(), jobs()
+    tasks = [scheduler.submit('disk/%d.iso' % index, work.action, index) for index in range(3)]
+    assert work.wait_for(1) == [0]
+    assert [item.state for item in tasks] == ['running', 'queued', 'queued']
+    work.release.set()
+    assert finish(tasks) == [0, 1, 2]
+    assert work.started == [0, 1, 2]
+
+def test_solid_state_runs_up_to_its_limit():
+    scheduler, work = iosched.scheduler(), jobs()
+    tasks = [scheduler.submit('ssd/%d.iso' % index, work.action, index) for index in range(6)]
+    work.wait_for(iosched.default_solid_state_limit)
+    assert [item.state for item in tasks].count('running') == iosched.default_solid_state_limit
+    work.release.set()
+    assert finish(tasks) == list(range(6))
+
+def test_devices_run_side_by_side():
+    scheduler, work = iosched.scheduler(), jobs()
+    tasks = [scheduler.submit('disk/a.iso', work.action, 'a'), scheduler.submit('other/b.iso', work.action, 'b')]
+    assert sorted(work.wait_for(2)) == ['a', 'b']
+    work.release.set()
+    finish(tasks)
+
+def test_total_limit():
+    scheduler, work = iosched.scheduler(total_limit=1), jobs()
+    tasks = [scheduler.submit('ssd/a.iso', work.action, 'a'), scheduler.submit('ssd2/b.iso', work.action, 'b')]
+    work.wait_for(1)
+    assert [item.state for item in tasks] == ['running', 'queued']
+    work.release.set()
+    assert finish(tasks) == ['a', 'b']
+
+def test_priority_then_submission_order():
+    scheduler, work = iosched.scheduler(), jobs()
+    tasks = [scheduler.submit('disk/busy.iso', work.action, 'busy')]
+    work.wait_for(1)
+    for name, priority in (('low', 'low'), ('normal 1', 'normal'), ('high', 'high'), ('normal 2', 'normal')):
+        tasks.append(scheduler.submit('disk/%s.iso' % name, work.action, name, priority=priority))
+    work.release.set()
+    finish(tasks)
+    assert work.started == ['busy', 'high', 'normal 1', 'normal 2', 'low']
+
+def test_reprioritise():
+    scheduler, work = iosched.scheduler(), jobs()
+    tasks = [scheduler.submit('disk/busy.iso', work.action, 'busy')]
+    work.wait_for(1)
+    tasks.append(scheduler.submit('disk/normal.iso', work.action, 'normal'))
+    tasks.append(scheduler.submit('disk/late.iso', work.action, 'late', priority='low'))
+    assert scheduler.reprioritise(tasks[2], 'high')
+    assert tasks[2].priority_name == 'high'
+    assert not scheduler.reprioritise(tasks[0], 'low')
+    assert scheduler.device_summary() == [('0:901', True, 1, 1, 2)]
+    work.release.set()
+    finish(tasks)
+    assert work.started == ['busy', 'late', 'normal']
+
+def test_cancel():
+    scheduler, work = iosched.scheduler(), jobs()
+    running = scheduler.submit('disk/busy.iso', work.action, 'busy')
+    work.wait_for(1)
+    queued = scheduler.submit('disk/queued.iso', work.action, 'queued')
+    assert queued.cancel()
+    assert not running.cancel()
+    with pytest.raises(InterruptedError):
+        queued.result(5)
+    work.release.set()
+    assert running.result(5) == 'busy'
+    assert work.started == ['busy']
+    assert [item.state for item in scheduler.snapshot()] == ['cancelled', 'done']
+
+def test_result_raises_what_the_action_raised():
+    def fail():
+        raise IOError('unreadable')
+    item = iosched.scheduler().submit('ssd/bad.iso', fail)
+    with pytest.raises(IOError):
+        item.result(5)
+    assert item.state == 'failed'
+
+def test_unknown_priority():
+    with pytest.raises(ValueError):
+        iosched.scheduler().submit('ssd/a.iso', len, 'a', priority='urgent')
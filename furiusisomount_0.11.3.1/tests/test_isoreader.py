@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import isoreader
+import perfsuite
+
+def test_lists_root(iso):
+    with isoreader.image(iso) as image:
+        names = image.listdir('/')
+    assert len(names) == perfsuite.small_files + 1
+    assert 'LARGE.DAT' in names
+
+def test_reads_files(iso):
+    with isoreader.image(iso) as image:
+        sizes = dict((path, entry.st_size) for path, entry in image.walk('/'))
+        small = sorted(path for path in sizes if path != '/LARGE.DAT')
+        assert all(sizes[path] == perfsuite.small_file_size for path in small)
+        with image.open(small[0]) as member:
+            assert len(member.read()) == perfsuite.small_file_size
+
+def test_missing_path(iso):
+    with isoreader.image(iso) as image:
+        with pytest.raises(FileNotFoundError):
+            image.lookup('/NOSUCH.DAT')
+
+class tracked_source():
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+
+    def read(self, offset, length):
+        return self.data[offset:offset + length]
+
+    def close(self):
+        self.closed = True
+
+def test_not_an_iso_closes_source():
+    source = tracked_source(bytes(64 * 2**10))
+    with pytest.raises(ValueError):
+        isoreader.image(source)
+    assert source.closed
+
+def test_truncated_iso_leaves_no_file_open(iso, tmp_path):
+    truncated = tmp_path / 'truncated.iso'
+    with open(iso, 'rb') as image_file:
+        truncated.write_bytes(image_file.read(16 * 2048 + 100))
+    before = len(os.listdir('/proc/self/fd'))
+    # The traceback keeps the half-built image alive, so nothing is closed
+    # by the garbage collector instead
+    with pytest.raises(ValueError) as raised:
+        isoreader.image(str(truncated))
+    assert len(os.listdir('/proc/self/fd')) == before
+    assert raised.traceback
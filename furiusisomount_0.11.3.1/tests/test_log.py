@@ -0,0 +1,59 @@
+import json
+import os
+
+import pytest
+
+import log
+
+@pytest.fixture
+def log_writer(tmp_path):
+    # A writer of its own, so settings.cfg and other tests do not matter
+    log_writer = log.writer(str(tmp_path / 'test.log'))
+    log_writer.format = log.format_text
+    log_writer.max_bytes = 0
+    return log_writer
+
+def write(log_writer, count, **details):
+    for index in range(count):
+        record = {'time': 0.0, 'message': 'message %d' % index}
+        record.update(details)
+        log_writer.put(record)
+    log_writer.flush()
+
+def test_text_format(log_writer):
+    write(log_writer, 2, operation='mount')
+    with open(log_writer.log) as log_file:
+        text = log_file.read()
+    assert ':message 0\n' in text and ':message 1\n' in text
+    assert 'operation' not in text
+
+def test_json_format(log_writer):
+    log_writer.format = log.format_json
+    write(log_writer, 3, operation='checksum', image='/images/a.iso', outcome='error', error='Error reading file')
+    with open(log_writer.log) as log_file:
+        records = [json.loads(line) for line in log_file]
+    assert [record['message'] for record in records] == ['message 0', 'message 1', 'message 2']
+    assert all(record['outcome'] == 'error' and record['operation'] == 'checksum' for record in records)
+    assert records[0]['time'].startswith('19')
+
+def test_rotation_keeps_backup_count(log_writer):
+    log_writer.max_bytes = 300
+    log_writer.backup_count = 2
+    for batch in range(10):
+        write(log_writer, 1)
+    assert os.path.getsize(log_writer.log) <= 300
+    assert all(os.path.exists(log.backup_path(log_writer.log, number)) for number in (1, 2))
+    assert not os.path.exists(log.backup_path(log_writer.log, 3))
+
+def test_write_and_delete(tmp_path):
+    path = str(tmp_path / 'module.log')
+    log.write(path, 'hello', outcome='ok')
+    log.flush(path)
+    with open(path) as log_file:
+        assert ':hello\n' in log_file.read()
+    log.writer_for(path).max_bytes = 1
+    log.write(path, 'again')
+    log.flush(path)
+    assert os.path.exists(log.backup_path(path, 1))
+    log.delete(path)
+    assert not os.path.exists(path) and not os.path.exists(log.backup_path(path, 1))
@@ -0,0 +1,79 @@
+import json
+import os
+import random
+import threading
+
+import pytest
+
+import manifest
+
+block_size = 4096
+blocks = 10
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / 'image.iso'
+    # The last block is a short one
+    path.write_bytes(random.Random(2008).randbytes(blocks * block_size - 100))
+    return str(path)
+
+def damage(path, offset):
+    with open(path, 'r+b') as image_file:
+        image_file.seek(offset)
+        data = image_file.read(1)
+        image_file.seek(offset)
+        image_file.write(bytes([data[0] ^ 0xff]))
+
+def test_intact_image(image):
+    created = manifest.create(image, block_size, workers=2)
+    assert len(created['blocks']) == blocks
+    assert manifest.load(image) == created
+    result = manifest.verify(image, workers=2)
+    assert result.is_intact() and result.damaged_ranges() == []
+
+def test_damaged_ranges(image):
+    manifest.create(image, block_size, workers=2)
+    for offset in (2 * block_size + 5, 3 * block_size, blocks * block_size - 101):
+        damage(image, offset)
+    result = manifest.verify(image, workers=2)
+    assert result.complete and not result.is_intact()
+    assert result.damaged_ranges() == [(2 * block_size, 4 * block_size), (9 * block_size, blocks * block_size - 100)]
+
+def test_resumes_after_cancel(image):
+    manifest.create(image, block_size, workers=1)
+    cancelled = threading.Event()
+
+    def progress(done, total):
+        if done == 4:
+            cancelled.set()
+
+    first = manifest.verify(image, workers=1, cancelled=cancelled, progress=progress)
+    assert not first.complete
+    assert os.path.exists(manifest.progress_path(image))
+    second = manifest.verify(image, workers=1)
+    assert second.resumed == len(first.verified) and second.resumed >= 4
+    assert second.is_intact()
+    assert not os.path.exists(manifest.progress_path(image))
+
+def test_progress_of_a_changed_image_is_ignored(image):
+    manifest.create(image, block_size, workers=1)
+    cancelled = threading.Event()
+    manifest.verify(image, workers=1, cancelled=cancelled, progress=lambda done, total: cancelled.set())
+    os.utime(image, ns=(0, 0))
+    assert manifest.verify(image, workers=1).resumed == 0
+
+def test_damaged_manifest(image):
+    manifest.create(image, block_size, workers=1)
+    with open(manifest.manifest_path(image)) as manifest_file:
+        data = json.load(manifest_file)
+    data['blocks'][0] = '0' * 64
+    with open(manifest.manifest_path(image), 'w') as manifest_file:
+        json.dump(data, manifest_file)
+    with pytest.raises(ValueError):
+        manifest.load(image)
+
+def test_merkle_root_carries_odd_nodes():
+    digests = ['%064x' % index for index in range(3)]
+    assert manifest.merkle_root(digests) != manifest.merkle_root(digests[:2])
+    assert manifest.merkle_root(digests[:1]) != digests[0]
+    assert manifest.ranges([1, 2, 3, 7]) == [[1, 4], [7, 8]]
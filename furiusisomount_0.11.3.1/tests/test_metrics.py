@@ -0,0 +1,21 @@
+import json
+import os
+
+import metrics
+
+def test_flush_merges_with_saved_totals(tmp_path):
+    path = str(tmp_path / 'metrics.json')
+    metrics.record('mount', 0.2)
+    metrics.record('mount', 3.0, 'error')
+    metrics.flush(path, str(tmp_path))
+    metrics.record('mount', 0.5, byte_count=2**20)
+    totals = metrics.flush(path, str(tmp_path))
+    assert totals['mount'].outcomes == {'ok': 2, 'error': 1}
+    with open(path) as summary_file:
+        saved = json.load(summary_file)['operations']['mount']
+    assert (saved['count'], saved['errors'], saved['bytes']) == (3, 1, 2**20)
+    assert os.path.exists(metrics.textfile_path(str(tmp_path)))
+
+def test_flush_without_records(tmp_path):
+    assert metrics.flush(str(tmp_path / 'metrics.json')) is None
+    assert not os.path.exists(str(tmp_path / 'metrics.json'))
@@ -0,0 +1,47 @@
+import os
+import tempfile
+
+import pytest
+
+import mountbackend
+import mountbenchmark
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        mountbackend.get('nosuch')
+
+def test_fake_backend_not_offered():
+    assert 'fake' not in [item.name for item in mountbackend.available()]
+
+def test_benchmark_through_fake_backend(iso, tmp_path, monkeypatch):
+    # The fake backend mounts nothing, so there is nothing to read, but the
+    # run must mount, unmount and clean up without an error
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    result = mountbenchmark.run(iso, 'fake')
+    assert result.error is None and result.entries == 0
+    assert os.listdir(str(tmp_path)) == []
+    assert mountbackend.get('fake').mounted == {}
+
+def test_benchmark_reports_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    result = mountbenchmark.run(str(tmp_path / 'missing.iso'), 'fake')
+    assert result.error
+    assert os.listdir(str(tmp_path)) == []
+
+def test_fastest_per_kind():
+    results = []
+    for name, rate in (('fuseiso', 10.0), ('udisks', 30.0), ('loop', 20.0)):
+        result = mountbenchmark.measurement(name)
+        result.sequential_rate = rate
+        results.append(result)
+    failed = mountbenchmark.measurement('loop')
+    failed.error = 'failed'
+    best = mountbenchmark.fastest(results + [failed])
+    assert dict((kind, result.backend) for kind, result in best.items()) == {'fuse': 'fuseiso', 'loop': 'udisks'}
+
+def test_backend_needs_mount_and_unmount():
+    class incomplete(mountbackend.backend):
+        async def mount(self, image_file, mount_location, offset=0, sizelimit=None):
+            return mount_location
+    with pytest.raises(TypeError):
+        incomplete()
@@ -0,0 +1,21 @@
+import os
+
+import mountbackend
+import mountengine
+
+def test_fake_mount_and_unmount(iso, tmp_path):
+    fake = mountbackend.get('fake')
+    outcomes = mountengine.mount_batch([iso, iso], True, backend='fake', root=str(tmp_path))
+    assert all(outcome.ok and outcome.backend == 'fake' for outcome in outcomes)
+    locations = [outcome.mount_location for outcome in outcomes]
+    # Two images with the same name get distinct mount points
+    assert len(set(locations)) == 2
+    assert all(os.path.dirname(location) == str(tmp_path) and fake.is_mounted(location) for location in locations)
+    unmounted = mountengine.unmount_batch([(location, True, 'fake') for location in locations])
+    assert all(outcome.ok for outcome in unmounted)
+    assert not any(fake.is_mounted(location) or os.path.exists(location) for location in locations)
+
+def test_fake_mount_failure(tmp_path):
+    outcome = mountengine.mount_batch([str(tmp_path / 'missing.iso')], True, backend='fake', root=str(tmp_path))[0]
+    assert not outcome.ok and outcome.error
+    assert os.listdir(str(tmp_path)) == []
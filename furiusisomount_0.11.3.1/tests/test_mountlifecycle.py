@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+import mountlifecycle
+import mountregistry
+
+@pytest.fixture
+def mounts(tmp_path):
+    # Three empty mount points nothing is using
+    registry = mountregistry.registry(str(tmp_path / 'mounts.csv'))
+    points = {}
+    for name in ('a', 'b', 'c'):
+        points[name] = str(tmp_path / name)
+        os.mkdir(points[name])
+        registry.add(points[name], '/images/%s.iso' % name, True, 'fuseiso')
+    return registry, points
+
+def manager(registry, idle_timeout=0, max_mounts=0):
+    # Mounts first seen 100 seconds apart, in registry order from 0
+    lifecycle = mountlifecycle.manager(registry, idle_timeout, max_mounts)
+    for when, item in enumerate(registry):
+        lifecycle.touch(item.mount_point, when * 100)
+    return lifecycle
+
+def picked(lifecycle, now, keep=()):
+    return [item.mount_point for item in lifecycle.expired(now, keep)]
+
+def test_idle_timeout(mounts):
+    registry, points = mounts
+    lifecycle = manager(registry, idle_timeout=150)
+    assert picked(lifecycle, 260) == [points['a'], points['b']]
+    assert picked(lifecycle, 260, keep=[points['a']]) == [points['b']]
+
+def test_off_unless_set(mounts):
+    registry, points = mounts
+    assert picked(manager(registry), 10**6) == []
+
+def test_max_mounts_picks_least_recently_used(mounts):
+    registry, points = mounts
+    lifecycle = manager(registry, max_mounts=2)
+    lifecycle.touch(points['a'], 250)
+    assert picked(lifecycle, 300) == [points['b']]
+
+def test_touch_keeps_a_mount(mounts):
+    registry, points = mounts
+    lifecycle = manager(registry, idle_timeout=150)
+    lifecycle.touch(points['a'], 250)
+    assert picked(lifecycle, 260) == [points['b']]
+
+def test_open_file_keeps_a_mount(mounts):
+    # Seen in use by the /proc scan, so last accessed now
+    registry, points = mounts
+    lifecycle = manager(registry, idle_timeout=150)
+    with open(os.path.join(points['a'], 'file'), 'w'):
+        assert picked(lifecycle, 260) == [points['b']]
+    assert picked(lifecycle, 300) == [points['b']]
+
+def test_root_access_does_not_count(mounts):
+    registry, points = mounts
+    lifecycle = manager(registry, idle_timeout=150)
+    os.utime(points['a'], (250, 250))
+    assert picked(lifecycle, 260) == [points['a'], points['b']]
+
+def test_privileged_mounts_are_left_alone(mounts, monkeypatch):
+    registry, points = mounts
+    monkeypatch.setattr(os, 'geteuid', lambda: 1000)
+    registry.add(points['a'], '/images/a.iso', False, 'loop')
+    lifecycle = manager(registry, idle_timeout=150)
+    assert mountlifecycle.needs_privileges(registry.get(points['a']))
+    assert picked(lifecycle, 10**6) == [points['b'], points['c']]
+
+def test_forgets_removed_mounts(mounts):
+    registry, points = mounts
+    lifecycle = manager(registry)
+    registry.remove(points['c'])
+    lifecycle.scan(300)
+    assert set(lifecycle.last_access) == set([points['a'], points['b']])
@@ -0,0 +1,69 @@
+import pytest
+
+import mountregistry
+import mounttable
+
+def table(*mounts):
+    # mountinfo lines for (mount point, fstype, source)
+    return mounttable.parse('\n'.join('%d 1 0:%d / %s ro - %s %s ro' % (index + 30, index, mount_point, fstype, source)
+                                      for index, (mount_point, fstype, source) in enumerate(mounts)))
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'mounts.csv')
+
+def test_round_trip(path):
+    saved = mountregistry.registry(path)
+    saved.add('/mnt/a', '/images/a.iso', True)
+    saved.add('/mnt/b', '/images/b,c.iso', False, 'udisks')
+    saved.save()
+    loaded = mountregistry.registry(path).load()
+    assert [(item.mount_point, item.image_file, item.is_fuse, item.backend) for item in loaded] == [
+        ('/mnt/a', '/images/a.iso', True, None), ('/mnt/b', '/images/b,c.iso', False, 'udisks')]
+
+def test_index_by_image(path):
+    registry = mountregistry.registry(path)
+    registry.add('/mnt/a', '/images/a.iso', True)
+    registry.add('/mnt/a_2', '/images/a.iso', True)
+    assert sorted(item.mount_point for item in registry.mounts_of('/images/a.iso')) == ['/mnt/a', '/mnt/a_2']
+    registry.remove('/mnt/a')
+    registry.remove('/mnt/a_2')
+    assert registry.mounts_of('/images/a.iso') == [] and len(registry) == 0
+
+def test_save_merges_other_processes(path):
+    window = mountregistry.registry(path).load()
+    window.add('/mnt/a', '/images/a.iso', True)
+    window.add('/mnt/b', '/images/b.iso', True)
+    window.save()
+    command_line = mountregistry.registry(path).load()
+    command_line.add('/mnt/c', '/images/c.iso', True)
+    command_line.remove('/mnt/a')
+    command_line.save()
+    # The window adds its own mount without undoing the command line's
+    window.add('/mnt/d', '/images/d.iso', True)
+    learned, forgotten = window.save()
+    assert [item.mount_point for item in learned] == ['/mnt/c']
+    assert [item.mount_point for item in forgotten] == ['/mnt/a']
+    assert sorted(mountregistry.registry(path).read()) == ['/mnt/b', '/mnt/c', '/mnt/d']
+    assert sorted(item.mount_point for item in window) == ['/mnt/b', '/mnt/c', '/mnt/d']
+
+def test_reconcile_drops_vanished_mounts(path):
+    registry = mountregistry.registry(path)
+    registry.add('/mnt/a', '/images/a.iso', True)
+    registry.add('/mnt/b', '/images/b.iso', True)
+    dropped, adopted = registry.reconcile(table=table(('/mnt/b', 'fuse.fuseiso', 'fuseiso')), adopt=False)
+    assert [item.mount_point for item in dropped] == ['/mnt/a'] and adopted == []
+    assert [item.mount_point for item in registry] == ['/mnt/b']
+
+def test_reconcile_adopts_known_images(path, monkeypatch):
+    monkeypatch.setattr(mountregistry, 'fuseiso_mounts', lambda: {'/mnt/a': '/images/a.iso', '/mnt/x': '/images/x.iso'})
+    monkeypatch.setattr(mountregistry, 'loop_backing_file', lambda device: {'/dev/loop3': '/images/b.iso'}.get(device))
+    registry = mountregistry.registry(path)
+    mounts = table(('/mnt/a', 'fuse.fuseiso', 'fuseiso'), ('/mnt/x', 'fuse.fuseiso', 'fuseiso'),
+                   ('/media/b', 'iso9660', '/dev/loop3'), ('/home', 'ext4', '/dev/sda2'))
+    dropped, adopted = registry.reconcile(['/images/a.iso', '/images/b.iso'], table=mounts)
+    assert dropped == []
+    assert [(item.mount_point, item.image_file, item.is_fuse) for item in adopted] == [
+        ('/mnt/a', '/images/a.iso', True), ('/media/b', '/images/b.iso', False)]
+    # Nothing new is adopted the second time round
+    assert registry.reconcile(['/images/a.iso', '/images/b.iso'], table=mounts) == ([], [])
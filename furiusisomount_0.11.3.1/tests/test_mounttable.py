@@ -0,0 +1,24 @@
+import mounttable
+
+mountinfo = '''22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw
+36 22 0:31 / /home/user/My\\040Image_iso rw,nosuid,nodev master:2 shared:3 - fuse.fuseiso fuseiso rw,user_id=1000
+37 22 7:0 / /media/disc ro - iso9660 /dev/loop0
+'''
+
+def test_parse():
+    entries = mounttable.parse(mountinfo)
+    assert [entry.mount_point for entry in entries] == ['/', '/home/user/My Image_iso', '/media/disc']
+    fuse = entries[1]
+    assert (fuse.mount_id, fuse.parent_id, fuse.fstype, fuse.source) == (36, 22, 'fuse.fuseiso', 'fuseiso')
+    assert fuse.super_options == 'rw,user_id=1000'
+    assert entries[2].options == 'ro' and entries[2].source == '/dev/loop0'
+
+def test_skips_malformed_lines():
+    assert mounttable.parse('not a mountinfo line\n\n') == []
+
+def test_is_mounted(tmp_path):
+    table = tmp_path / 'mountinfo'
+    table.write_text(mountinfo)
+    assert mounttable.is_mounted('/media/disc', str(table))
+    assert not mounttable.is_mounted('/media/other', str(table))
+    assert mounttable.read(str(tmp_path / 'missing')) == []